@@ -46,6 +46,7 @@ class Document(Base):
     bplan_details = relationship("BPlanDetails", back_populates="document")
     cmp_details = relationship("ComplianceDetails", back_populates="document")
     completeness_check = relationship("CompletenessCheckResult", back_populates="document")
+    openai_calls = relationship("OpenAICall", back_populates="document")
 
 # AnalysisResult model with JSON field for key-value pairs
 class AnalysisResult(Base):
@@ -252,4 +253,29 @@ class RequiredDocument(Base):
     action_needed = Column(Text, nullable=False)
 
     completeness_check_id = Column(Integer, ForeignKey("completeness_check_results.id"), nullable=False)
-    completeness_check_result = relationship("CompletenessCheckResult", back_populates="required_documents")
\ No newline at end of file
+    completeness_check_result = relationship("CompletenessCheckResult", back_populates="required_documents")
+
+
+# One row per OpenAI request (see services/usage_ledger.py)
+class OpenAICall(Base):
+    __tablename__ = "openai_calls"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey('documents.id'), nullable=True, index=True)
+    job = Column(String, nullable=True)
+    stage = Column(String, nullable=True)  # Call site, e.g. page, final_fields, comparison
+    field = Column(String, nullable=True)
+    model = Column(String, nullable=True)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)
+    latency = Column(Float, default=0.0)  # Seconds, retries and backoff included
+    retries = Column(Integer, default=0)
+    status_code = Column(Integer, nullable=True)
+    from_cache = Column(Boolean, default=False)
+    batch = Column(Boolean, default=False)
+    escalated = Column(Boolean, default=False)  # Sent to the large model after a rejected small-model reply
+    cost = Column(Float, default=0.0)  # USD
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    document = relationship('Document', back_populates='openai_calls')
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from ..database.database import get_db
+from ..models import models, schemas
+from ..authentication import oauth2
+from ..services.rate_limiter import request_scheduler
+from ..services.openai_retry import circuit_breaker
+from ..services.response_cache import response_cache
+from ..services.usage_ledger import usage_ledger, aggregate_calls, prompt_cache_report
+from ..services.model_router import routing_stats
+from ..services.openai_service import api_stats_snapshot
+
+router = APIRouter(
+    tags=["Metrics"]
+)
+
+
+@router.get('/metrics/openai/')
+def openai_metrics(current_user: schemas.User = Depends(oauth2.get_current_user)):
+    """
+    Queue depth, wait times and budgets of the process-wide OpenAI request scheduler,
+    the state of the circuit breaker, hit rate and saved latency of the response cache,
+    plus the request and token counters of this process and the escalation rates of the model routing.
+    """
+    return {
+        "scheduler": request_scheduler.stats(),
+        "circuit": circuit_breaker.stats(),
+        "cache": response_cache.stats(),
+        "usage": api_stats_snapshot(),
+        "routing": routing_stats.stats(),
+    }
+
+
+@router.get('/metrics/openai/projects/')
+def openai_project_costs(db: Session = Depends(get_db), current_user: schemas.User = Depends(oauth2.get_current_user)):
+    """
+    OpenAI requests, tokens, latency and cost per project of the current user, most expensive first.
+    """
+    user = db.query(models.User).filter(models.User.email == current_user.email).first()
+    documents = {document.id: document.file_name for document in db.query(models.Document).filter(models.Document.user_id == user.id)}
+    usage_ledger.flush()
+    projects = aggregate_calls(db, group_by=("document_id",), document_ids=list(documents))
+    for project in projects:
+        project["project_name"] = documents.get(project["document_id"])
+    return projects
+
+
+@router.get('/metrics/openai/prompt-cache/')
+def openai_prompt_cache(db: Session = Depends(get_db), current_user: schemas.User = Depends(oauth2.get_current_user)):
+    """
+    Share of prompt tokens served from OpenAI's prompt cache and the latency with and
+    without cached tokens, per prompt (stage and field) of the current user's projects.
+    """
+    user = db.query(models.User).filter(models.User.email == current_user.email).first()
+    document_ids = [document.id for document in db.query(models.Document).filter(models.Document.user_id == user.id)]
+    usage_ledger.flush()
+    return prompt_cache_report(db, document_ids=document_ids)
+
+
+@router.get('/metrics/openai/routing/')
+def openai_model_routing(db: Session = Depends(get_db), current_user: schemas.User = Depends(oauth2.get_current_user)):
+    """
+    Model routing per call site and field, to tune the routing table: the escalation rates and
+    average latency per tier of this process, and the requests, escalations and latency per
+    model of the current user's projects from the usage ledger.
+    """
+    user = db.query(models.User).filter(models.User.email == current_user.email).first()
+    document_ids = [document.id for document in db.query(models.Document).filter(models.Document.user_id == user.id)]
+    usage_ledger.flush()
+    return {
+        "process": routing_stats.stats(),
+        "projects": aggregate_calls(db, group_by=("stage", "field", "model"), document_ids=document_ids),
+    }
+
+
+@router.get('/metrics/openai/projects/{doc_id}')
+def openai_project_cost_details(doc_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(oauth2.get_current_user)):
+    """
+    OpenAI usage of one project in total and per stage and field, to find the expensive fields.
+    """
+    user = db.query(models.User).filter(models.User.email == current_user.email).first()
+    document = db.query(models.Document).filter(models.Document.id == doc_id, models.Document.user_id == user.id).first()
+    if not document:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Project with id {doc_id} not found.")
+    usage_ledger.flush()
+    total = aggregate_calls(db, document_ids=[doc_id])
+    return {
+        "document_id": doc_id,
+        "project_name": document.file_name,
+        "total": total[0] if total else None,
+        "stages": aggregate_calls(db, group_by=("stage", "model"), document_ids=[doc_id]),
+        "fields": aggregate_calls(db, group_by=("stage", "field"), document_ids=[doc_id]),
+    }
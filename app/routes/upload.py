@@ -2,8 +2,13 @@ from fastapi import APIRouter, File, UploadFile, HTTPException, status
 import os, time, json
 import logging
 from ..services.file_service import unzip_files, save_doc_into_db, save_analysis_into_db, save_project_details_into_db, add_completeness_check_result
-from ..services.pdf_service import process_pdf
-from ..services.openai_service import extracting_project_details, extract_location, completeness_check
+from ..services.pdf_service import process_pdfs
+from ..services.openai_service import (
+    extracting_project_details, extracting_project_details_streaming, extract_location, completeness_check,
+    resolve_extraction_mode
+)
+from ..services.response_cache import set_cache_bypass
+from ..services.usage_ledger import set_ledger_document
 from ..database.database import get_db
 from sqlalchemy.orm import Session
 from fastapi import Depends
@@ -139,11 +144,19 @@ async def upload_file(
 @router.post('/analyze/')
 async def upload_file(
     doc_id, project_name,
+    pipeline: bool = False,
+    persist_images: bool = False,
+    mode: str = None,
+    no_cache: bool = False,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(oauth2.get_current_user)
 ):
-    
+    # Unknown modes and the offline batch mode are rejected before any work starts
+    mode = resolve_extraction_mode(mode)
     try:
+        # Ask OpenAI again instead of reusing cached responses
+        set_cache_bypass(no_cache)
+        set_ledger_document(int(doc_id))
         start_time = time.time()
         logging.info(start_time)
         user = db.query(models.User).filter(models.User.email == current_user.email).first()
@@ -187,22 +200,25 @@ async def upload_file(
             
             # Threaded PDF processing
             pdf_files = os.listdir(os.path.join(CURRENT_DIR, str(user.id), project_name, "pdfs", project_name))
-            logging.info("Starting PDF to image conversion")
-            
-            def process_file(file):
-                return process_pdf(
-                    os.path.join(CURRENT_DIR, str(user.id), project_name, "pdfs", project_name, file),
-                    folder_path=img_folder,
-                    project_name=project_name
+            pdf_paths = [os.path.join(CURRENT_DIR, str(user.id), project_name, "pdfs", project_name, file) for file in pdf_files]
+
+            if pipeline:
+                # Render, encode and send pages to gpt as a stream
+                logging.info("Starting streaming extraction pipeline")
+                extracted_details = extracting_project_details_streaming(
+                    pdf_paths,
+                    project_name=project_name,
+                    images_path=img_folder,
+                    persist_images=persist_images,
+                    mode=mode
                 )
+            else:
+                logging.info("Starting PDF to image conversion")
+                process_pdfs(pdf_paths, folder_path=img_folder, project_name=project_name)
+                logging.info("Converted PDFs to images successfully")
 
-            for file in pdf_files:
-                process_file(file)
-
-            logging.info("Converted PDFs to images successfully")
-            
-            logging.info("sending images to gpt")
-            extracted_details = extracting_project_details(images_path=img_folder)
+                logging.info("sending images to gpt")
+                extracted_details = extracting_project_details(images_path=img_folder, mode=mode)
             logging.info("response: %s", extracted_details)
             
             end_time = time.time()  # Record end time
@@ -284,6 +300,7 @@ async def cmplt_check(
 ):
     
     try:
+        set_ledger_document(int(doc_id))
         start_time = time.time()
         logging.info(start_time)
         user = db.query(models.User).filter(models.User.email == current_user.email).first()
@@ -330,15 +347,11 @@ async def cmplt_check(
         pdf_files = os.listdir(os.path.join(CURRENT_DIR, str(user.id), project_name, "pdfs", project_name))
         logging.info("Starting PDF to image conversion")
         
-        def process_file(file):
-            return process_pdf(
-                os.path.join(CURRENT_DIR, str(user.id), project_name, "pdfs", project_name, file),
-                folder_path=img_folder,
-                project_name=project_name
-            )
-
-        for file in pdf_files:
-            process_file(file)
+        process_pdfs(
+            [os.path.join(CURRENT_DIR, str(user.id), project_name, "pdfs", project_name, file) for file in pdf_files],
+            folder_path=img_folder,
+            project_name=project_name
+        )
 
         logging.info("Converted PDFs to images successfully")
         
@@ -1,11 +1,17 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException, status, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 import os, json
+import queue
 import logging
+import threading
+import contextvars
 from ..services.pdf_service import process_plan_pdf
 from ..services.file_service import save_bplan_into_db, save_bplan_details_into_db, save_cmp_details_into_db
-from ..services.openai_service import extracting_bplan_details, comparison, PdfReport
-from ..database.database import get_db
+from ..services.openai_service import extracting_bplan_details, comparison, PdfReport, resolve_extraction_mode
+from ..services.response_cache import set_cache_bypass
+from ..services.usage_ledger import set_ledger_document
+from ..database.database import get_db, SessionLocal
 from sqlalchemy.orm import Session
 from fastapi import Depends
 from ..models import models, schemas
@@ -25,6 +31,8 @@ from app.utils.utils import extract_project_details_as_string , extract_bplan_de
 
 
 CURRENT_DIR = os.path.join(os.getcwd(), "uploads")
+# Seconds between keep-alive comments of the /upload-B-Plan/ event stream
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
 router = APIRouter(
     tags=['project']
 )
@@ -173,14 +181,229 @@ def send_email_with_report(to_email: str, pdf_path: str, user_id: int):
 
 
 
+def run_compliance_check(db, user, latest_project, file_path: str, saved_file_path: str, bplan_name: str,
+                         mode: str = None, emit=None):
+    """
+    Extract the uploaded B-plan, compare it with the project, save the results and email the PDF report.
+
+    Args:
+    - emit: Called as emit(event, data) when a stage starts ("stage") and with
+      every piece of the streamed comparison and report replies ("token").
+      "restart" means the reply of the stage starts over (a retry, re-ask or
+      escalation), the tokens received for it so far must be dropped.
+      Without it nothing is streamed.
+
+    Returns:
+    dict: the response of /upload-B-Plan/
+    """
+    if emit is None:
+        emit = lambda event, data: None
+        relay = lambda stage: None
+    else:
+        relay = lambda stage: (
+            lambda text: emit("restart", {"stage": stage}) if text is None else emit("token", {"stage": stage, "text": text})
+        )
+    B_plan_images_path = os.path.join(file_path, "images")
+
+    emit("stage", {"stage": "render"})
+    result = process_plan_pdf(os.path.join(saved_file_path), folder_path= B_plan_images_path, project_name="B-plan")
+    logging.info("converted BPlan pdf into images")
+    
+    logging.info("sending BPlan images to gpt")
+    emit("stage", {"stage": "extract"})
+    # response = check_compliance(b_plan_Path=B_plan_images_path, images_path=project_images)
+    extracted_details = extracting_bplan_details(db=db,b_plan_path=B_plan_images_path, user_id=user.id, doc_id=latest_project.id, mode=mode)
+    duration = extracted_details.get("total_time")
+    response = extracted_details.get("result")
+    logging.info("response: %s", response)
+    
+    logging.info("saving bplan info into db.")
+    emit("stage", {"stage": "save_bplan"})
+    bplan_id = save_bplan_into_db(db=db, user_id=user.id, bplan_name=bplan_name, doc_id=latest_project.id)
+    
+    logging.info("saving bplan details info into db.")
+    # save_bplan_details_into_db(
+    #         db=db,
+    #         user_id=user.id,
+    #         document_id=latest_project.id,
+    #         bplan_id=bplan_id,
+    #         duration=duration,
+    #         location_within_building_zone=response.get("location_within_building_zone"),
+    #         building_use_type=response.get("building_use_type"),
+    #         building_style=response.get("building_style"),
+    #         grz=response.get("grz"),
+    #         gfz=response.get("gfz"),
+    #         building_height=response.get("building_height"),
+    #         number_of_floors=response.get("number_of_floors"),
+    #         roof_shape=response.get("roof_shape"),
+    #         dormers=response.get("dormers"),
+    #         roof_orientation=response.get("roof_orientation"),
+    #         parking_spaces=response.get("parking_spaces"),
+    #         outdoor_space=response.get("outdoor_space"),
+    #         setback_area=response.get("setback_area"),
+    #         setback_relevant_filling_work=response.get("setback_relevant_filling_work"),
+    #         deviations_from_b_plan=response.get("deviations_from_b_plan"),
+    #         exemptions_required=response.get("exemptions_required"),
+    #         species_protection_check=response.get("species_protection_check"),
+    #         compliance_with_zoning_rules=response.get("compliance_with_zoning_rules"),
+    #         compliance_with_building_codes=response.get("compliance_with_building_codes")
+    #     )
+    save_bplan_details_into_db(
+            db=db,
+            user_id=user.id,
+            document_id=latest_project.id,
+            bplan_id=bplan_id,
+            duration=duration,
+            **{key: response.get(value) for key, value in mapping.items()}
+        )
+    logging.info("saved into db.")
+    logging.info("Now, extracting project and bplan details for comparison.")
+    project_details_id, project_details = extract_project_details_as_string(db, doc_id=latest_project.id)
+    print("Project Details: \n\n", project_details)
+    bplan_details_id, bplan_details = extract_bplan_details_as_string(db, doc_id=latest_project.id, bplan_id=1)
+    print("BPlan Details: \n\n", bplan_details)
+    
+    emit("stage", {"stage": "comparison"})
+    comparison_response = comparison(project_details=project_details, bplan_details=bplan_details, on_delta=relay("comparison"))
+    # print("Comparison response: ", comparison_response)
+    # if "```json" in comparison_response:
+    #     comparison_response = comparison_response.replace("```json", "")
+    #     comparison_response = comparison_response.replace("```", "")
+    
+    cleaned_response = json.loads(comparison_response)
+    print("Cleaned response: \n\n", cleaned_response)
+    # print("Status: ", cleaned_response.get("overall_status"))
+    logging.info("Saving compliance details into db.")
+    emit("stage", {"stage": "save_compliance"})
+    # save_cmp_details_into_db(
+    #     db=db,
+    #     user_id=user.id,
+    #     document_id=latest_project.id,
+    #     bplan_id=1,
+    #     proj_detail_id=project_details_id,
+    #     bplan_detail_id=bplan_details_id,
+    #     compliant_status=cleaned_response.get("overall_status") if cleaned_response.get("overall_status") else None,
+    #     location_within_building_zone=cleaned_response.get("location_within_building_zone") if cleaned_response.get("location_within_building_zone") else None,
+    #     building_use_type=cleaned_response.get("building_use_type") if cleaned_response.get("building_use_type") else None,
+    #     grz=cleaned_response.get("grz") if cleaned_response.get("grz") else None,
+    #     gfz=cleaned_response.get("gfz") if cleaned_response.get("gfz") else None,
+    #     building_height=cleaned_response.get("building_height") if cleaned_response.get("building_height") else None,
+    #     number_of_floors=cleaned_response.get("number_of_floors") if cleaned_response.get("number_of_floors") else None,
+    #     roof_shape=cleaned_response.get("roof_shape") if cleaned_response.get("roof_shape") else None,
+    #     dormers=cleaned_response.get("dormers") if cleaned_response.get("dormers") else None,
+    #     roof_orientation=cleaned_response.get("roof_orientation") if cleaned_response.get("roof_orientation") else None,
+    #     parking_spaces=cleaned_response.get("parking_spaces") if cleaned_response.get("parking_spaces") else None,
+    #     outdoor_space=cleaned_response.get("outdoor_space") if cleaned_response.get("outdoor_space") else None,
+    #     setback_area=cleaned_response.get("setback_area") if cleaned_response.get("setback_area") else None,
+    #     setback_relevant_filling_work=cleaned_response.get("setback_relevant_filling_work") if cleaned_response.get("setback_relevant_filling_work") else None,
+    #     deviations_from_b_plan=cleaned_response.get("deviations_from_b_plan") if cleaned_response.get("deviations_from_b_plan") else None,
+    #     exemptions_required=cleaned_response.get("exemptions_required") if cleaned_response.get("exemptions_required") else None,
+    #     species_protection_check=cleaned_response.get("species_protection_check") if cleaned_response.get("species_protection_check") else None,
+    #     compliance_with_zoning_rules=cleaned_response.get("compliance_with_zoning_rules") if cleaned_response.get("compliance_with_zoning_rules") else None,
+    #     compliance_with_building_codes=cleaned_response.get("compliance_with_building_codes") if cleaned_response.get("compliance_with_building_codes") else None,
+    # )
+    save_cmp_details_into_db(
+        db=db,
+        user_id=user.id,
+        document_id=latest_project.id,
+        bplan_id=1,
+        proj_detail_id=project_details_id,
+        bplan_detail_id=bplan_details_id,
+        compliant_status=cleaned_response.get("overall_status") if cleaned_response.get("overall_status") else None,
+        **{key: cleaned_response.get(value) for key, value in mapping.items()}
+    )
+    logging.info("saved compliance details into db.")
+    
+    # Generate PDF report
+    report_path = os.path.join(file_path, "Compliance_Report.pdf")
+    response = json.dumps(cleaned_response)
+    emit("stage", {"stage": "report"})
+    pdf_content = PdfReport(results=response, on_delta=relay("report"))
+    # print("PDF content: \n", pdf_content)
+    logging.info(f"generating pdf...")
+    emit("stage", {"stage": "pdf"})
+    generate_pdf_report(pdf_content, report_path)
+    logging.info("PDF report generated: %s", report_path)
+    try:
+        # Send email with the PDF report attached
+        emit("stage", {"stage": "email"})
+        send_email_with_report(to_email=user.email, pdf_path=report_path, user_id=user.id)
+        logging.info("Email sent with report.")
+    except Exception as e:
+        logging.error(f"Error sending email: {e}")
+        print(f"Error sending email: {e}")
+
+    return {
+        "message": "Compliance report generated and sent to your email",
+        "Test date": latest_project.uploaded_at,
+        # "result": cmp_response_list
+        "result": cleaned_response
+    }
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+
+def stream_compliance_check(context, user_id: int, project_id: int, file_path: str, saved_file_path: str,
+                            bplan_name: str, mode: str = None):
+    """
+    Run run_compliance_check in a worker thread and yield its events as server-sent events.
+
+    The worker uses its own database session and runs in the request's
+    context, so it finishes and saves the results even when the client
+    disconnects. The last event is "result" with the response of
+    /upload-B-Plan/, or "error".
+    """
+    events = queue.Queue()
+
+    def emit(event, data):
+        events.put((event, data))
+
+    def work():
+        db = SessionLocal()
+        try:
+            user = db.query(models.User).filter(models.User.id == user_id).first()
+            latest_project = db.query(models.Document).filter(models.Document.id == project_id).first()
+            result = run_compliance_check(db, user, latest_project, file_path, saved_file_path, bplan_name, mode, emit)
+            emit("result", result)
+        except Exception as e:
+            logging.error("Streaming compliance check failed: %s", str(e))
+            emit("error", {"detail": getattr(e, "detail", str(e))})
+        finally:
+            db.close()
+            events.put(None)
+
+    threading.Thread(target=context.run, args=(work,), name="bplan-stream", daemon=True).start()
+    yield sse_event("stage", {"stage": "accepted"})
+    while True:
+        try:
+            item = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+        except queue.Empty:
+            # Keeps proxies from closing the connection during the long stages
+            yield ": keep-alive\n\n"
+            continue
+        if item is None:
+            return
+        yield sse_event(*item)
+
+
 @router.post('/upload-B-Plan/')
 async def upload_file(
     project_id:int,
     file: UploadFile = File(...),
+    mode: str = None,
+    no_cache: bool = False,
+    stream: bool = False,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(oauth2.get_current_user)
 ):
+    # Unknown modes and the offline batch mode are rejected before any work starts
+    mode = resolve_extraction_mode(mode)
     try:
+        # Ask OpenAI again instead of reusing cached responses
+        set_cache_bypass(no_cache)
+        set_ledger_document(project_id)
         # Validate file type (only .zip allowed)
         if not file.filename.endswith(".pdf"):
             raise HTTPException(
@@ -212,132 +435,14 @@ async def upload_file(
         bplan_name = file.filename.split(".")[-2]
         print("File_name = ", file.filename.split(".")[-2])
 
-        result = process_plan_pdf(os.path.join(saved_file_path), folder_path= B_plan_images_path, project_name="B-plan")
-        logging.info("converted BPlan pdf into images")
-        
-        logging.info("sending BPlan images to gpt")
-        # response = check_compliance(b_plan_Path=B_plan_images_path, images_path=project_images)
-        extracted_details = extracting_bplan_details(db=db,b_plan_path=B_plan_images_path, user_id=user.id, doc_id=latest_project.id)
-        duration = extracted_details.get("total_time")
-        response = extracted_details.get("result")
-        logging.info("response: %s", response)
-        
-        logging.info("saving bplan info into db.")
-        bplan_id = save_bplan_into_db(db=db, user_id=user.id, bplan_name=bplan_name, doc_id=latest_project.id)
-        
-        logging.info("saving bplan details info into db.")
-        # save_bplan_details_into_db(
-        #         db=db,
-        #         user_id=user.id,
-        #         document_id=latest_project.id,
-        #         bplan_id=bplan_id,
-        #         duration=duration,
-        #         location_within_building_zone=response.get("location_within_building_zone"),
-        #         building_use_type=response.get("building_use_type"),
-        #         building_style=response.get("building_style"),
-        #         grz=response.get("grz"),
-        #         gfz=response.get("gfz"),
-        #         building_height=response.get("building_height"),
-        #         number_of_floors=response.get("number_of_floors"),
-        #         roof_shape=response.get("roof_shape"),
-        #         dormers=response.get("dormers"),
-        #         roof_orientation=response.get("roof_orientation"),
-        #         parking_spaces=response.get("parking_spaces"),
-        #         outdoor_space=response.get("outdoor_space"),
-        #         setback_area=response.get("setback_area"),
-        #         setback_relevant_filling_work=response.get("setback_relevant_filling_work"),
-        #         deviations_from_b_plan=response.get("deviations_from_b_plan"),
-        #         exemptions_required=response.get("exemptions_required"),
-        #         species_protection_check=response.get("species_protection_check"),
-        #         compliance_with_zoning_rules=response.get("compliance_with_zoning_rules"),
-        #         compliance_with_building_codes=response.get("compliance_with_building_codes")
-        #     )
-        save_bplan_details_into_db(
-                db=db,
-                user_id=user.id,
-                document_id=latest_project.id,
-                bplan_id=bplan_id,
-                duration=duration,
-                **{key: response.get(value) for key, value in mapping.items()}
+        if stream:
+            context = contextvars.copy_context()
+            return StreamingResponse(
+                stream_compliance_check(context, user.id, latest_project.id, file_path, saved_file_path, bplan_name, mode),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
             )
-        logging.info("saved into db.")
-        logging.info("Now, extracting project and bplan details for comparison.")
-        project_details_id, project_details = extract_project_details_as_string(db, doc_id=latest_project.id)
-        print("Project Details: \n\n", project_details)
-        bplan_details_id, bplan_details = extract_bplan_details_as_string(db, doc_id=latest_project.id, bplan_id=1)
-        print("BPlan Details: \n\n", bplan_details)
-        
-        comparison_response = comparison(project_details=project_details, bplan_details=bplan_details)
-        # print("Comparison response: ", comparison_response)
-        # if "```json" in comparison_response:
-        #     comparison_response = comparison_response.replace("```json", "")
-        #     comparison_response = comparison_response.replace("```", "")
-        
-        cleaned_response = json.loads(comparison_response)
-        print("Cleaned response: \n\n", cleaned_response)
-        # print("Status: ", cleaned_response.get("overall_status"))
-        logging.info("Saving compliance details into db.")
-        # save_cmp_details_into_db(
-        #     db=db,
-        #     user_id=user.id,
-        #     document_id=latest_project.id,
-        #     bplan_id=1,
-        #     proj_detail_id=project_details_id,
-        #     bplan_detail_id=bplan_details_id,
-        #     compliant_status=cleaned_response.get("overall_status") if cleaned_response.get("overall_status") else None,
-        #     location_within_building_zone=cleaned_response.get("location_within_building_zone") if cleaned_response.get("location_within_building_zone") else None,
-        #     building_use_type=cleaned_response.get("building_use_type") if cleaned_response.get("building_use_type") else None,
-        #     grz=cleaned_response.get("grz") if cleaned_response.get("grz") else None,
-        #     gfz=cleaned_response.get("gfz") if cleaned_response.get("gfz") else None,
-        #     building_height=cleaned_response.get("building_height") if cleaned_response.get("building_height") else None,
-        #     number_of_floors=cleaned_response.get("number_of_floors") if cleaned_response.get("number_of_floors") else None,
-        #     roof_shape=cleaned_response.get("roof_shape") if cleaned_response.get("roof_shape") else None,
-        #     dormers=cleaned_response.get("dormers") if cleaned_response.get("dormers") else None,
-        #     roof_orientation=cleaned_response.get("roof_orientation") if cleaned_response.get("roof_orientation") else None,
-        #     parking_spaces=cleaned_response.get("parking_spaces") if cleaned_response.get("parking_spaces") else None,
-        #     outdoor_space=cleaned_response.get("outdoor_space") if cleaned_response.get("outdoor_space") else None,
-        #     setback_area=cleaned_response.get("setback_area") if cleaned_response.get("setback_area") else None,
-        #     setback_relevant_filling_work=cleaned_response.get("setback_relevant_filling_work") if cleaned_response.get("setback_relevant_filling_work") else None,
-        #     deviations_from_b_plan=cleaned_response.get("deviations_from_b_plan") if cleaned_response.get("deviations_from_b_plan") else None,
-        #     exemptions_required=cleaned_response.get("exemptions_required") if cleaned_response.get("exemptions_required") else None,
-        #     species_protection_check=cleaned_response.get("species_protection_check") if cleaned_response.get("species_protection_check") else None,
-        #     compliance_with_zoning_rules=cleaned_response.get("compliance_with_zoning_rules") if cleaned_response.get("compliance_with_zoning_rules") else None,
-        #     compliance_with_building_codes=cleaned_response.get("compliance_with_building_codes") if cleaned_response.get("compliance_with_building_codes") else None,
-        # )
-        save_cmp_details_into_db(
-            db=db,
-            user_id=user.id,
-            document_id=latest_project.id,
-            bplan_id=1,
-            proj_detail_id=project_details_id,
-            bplan_detail_id=bplan_details_id,
-            compliant_status=cleaned_response.get("overall_status") if cleaned_response.get("overall_status") else None,
-            **{key: cleaned_response.get(value) for key, value in mapping.items()}
-        )
-        logging.info("saved compliance details into db.")
-        
-        # Generate PDF report
-        report_path = os.path.join(file_path, "Compliance_Report.pdf")
-        response = json.dumps(cleaned_response)
-        pdf_content = PdfReport(results=response)
-        # print("PDF content: \n", pdf_content)
-        logging.info(f"generating pdf...")
-        generate_pdf_report(pdf_content, report_path)
-        logging.info("PDF report generated: %s", report_path)
-        try:
-            # Send email with the PDF report attached
-            send_email_with_report(to_email=user.email, pdf_path=report_path, user_id=user.id)
-            logging.info("Email sent with report.")
-        except Exception as e:
-            logging.error(f"Error sending email: {e}")
-            print(f"Error sending email: {e}")
-
-        return {
-            "message": "Compliance report generated and sent to your email",
-            "Test date": latest_project.uploaded_at,
-            # "result": cmp_response_list
-            "result": cleaned_response
-        }
+        return run_compliance_check(db, user, latest_project, file_path, saved_file_path, bplan_name, mode)
 
 
     except Exception as e:
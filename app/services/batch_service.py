@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+from fastapi import HTTPException, status
+from .openai_client import openai_client
+
+logger = logging.getLogger(__name__)
+
+# Offline extraction through the OpenAI Batch API: "openai" or "local" (file-based stand-in)
+OPENAI_BATCH_TRANSPORT = os.getenv("OPENAI_BATCH_TRANSPORT", "openai")
+OPENAI_BATCH_DIR = os.getenv("OPENAI_BATCH_DIR", "batches")
+OPENAI_BATCH_POLL_SECONDS = float(os.getenv("OPENAI_BATCH_POLL_SECONDS", 60))
+# Give up waiting a bit after the 24h completion window
+OPENAI_BATCH_TIMEOUT = float(os.getenv("OPENAI_BATCH_TIMEOUT", 25 * 3600))
+
+# Batch API input limits per file (50,000 requests and 200 MB), with some headroom
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_BYTES = int(os.getenv("OPENAI_BATCH_MAX_MB", 190)) * 1024 * 1024
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchJob:
+    """
+    Collects chat completion requests into Batch API JSONL input files.
+
+    Requests are written as they are added, so large backlogs do not have to be
+    held in memory. A new file is started whenever one would exceed the
+    request or size limit of the Batch API.
+    """
+
+    def __init__(self, name: str, folder: str = None):
+        self.name = name
+        self.folder = os.path.join(folder or OPENAI_BATCH_DIR, "input")
+        os.makedirs(self.folder, exist_ok=True)
+        self.files = []
+        self.requests = 0
+        self._file = None
+        self._file_requests = 0
+        self._file_bytes = 0
+
+    def add(self, custom_id: str, payload: dict):
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": payload}) + "\n"
+        size = len(line.encode("utf-8"))
+        if self._file is None or self._file_requests >= BATCH_MAX_REQUESTS or self._file_bytes + size > BATCH_MAX_BYTES:
+            self._roll()
+        self._file.write(line)
+        self._file_requests += 1
+        self._file_bytes += size
+        self.requests += 1
+
+    def _roll(self):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.folder, f"{self.name}-{len(self.files) + 1}.jsonl")
+        self._file = open(path, "w", encoding="utf-8")
+        self._file_requests = 0
+        self._file_bytes = 0
+        self.files.append(path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class OpenAIBatchTransport:
+    """
+    Talks to the OpenAI Files and Batches endpoints over the shared client.
+    """
+
+    def __init__(self, api_key: str = None):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+
+    def _request(self, method: str, path: str, **kwargs):
+        if not self.api_key:
+            raise RuntimeError("OpenAI API key is not set")
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        response = openai_client.run(openai_client.request(method, path, headers=headers, **kwargs))
+        if response.status_code != 200:
+            logger.error(f"OpenAI Batch API Error: {response.text}")
+            raise HTTPException(status_code=response.status_code, detail=f"OpenAI Batch API Error: {response.text}")
+        return response
+
+    def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            response = self._request(
+                "POST", "/files",
+                data={"purpose": "batch"},
+                files={"file": (os.path.basename(path), f.read(), "application/jsonl")}
+            )
+        return response.json()["id"]
+
+    def create(self, input_file_id: str, metadata: dict = None) -> str:
+        body = {"input_file_id": input_file_id, "endpoint": BATCH_ENDPOINT, "completion_window": "24h"}
+        if metadata:
+            body["metadata"] = metadata
+        return self._request("POST", "/batches", json=body).json()["id"]
+
+    def retrieve(self, batch_id: str) -> dict:
+        return self._request("GET", f"/batches/{batch_id}").json()
+
+    def download(self, file_id: str) -> str:
+        return self._request("GET", f"/files/{file_id}/content").text
+
+
+class LocalBatchTransport:
+    """
+    File-based stand-in for the Batch API, for tests and local runs.
+
+    Uploaded files and batch states are kept in folder. A batch is answered on
+    its first poll by calling responder with every request body, which returns
+    the chat completion response json.
+    """
+
+    def __init__(self, responder, folder: str = None):
+        self.folder = os.path.join(folder or OPENAI_BATCH_DIR, "local")
+        self.responder = responder
+        os.makedirs(os.path.join(self.folder, "files"), exist_ok=True)
+        os.makedirs(os.path.join(self.folder, "batches"), exist_ok=True)
+
+    def _file_path(self, file_id: str) -> str:
+        return os.path.join(self.folder, "files", f"{file_id}.jsonl")
+
+    def _batch_path(self, batch_id: str) -> str:
+        return os.path.join(self.folder, "batches", f"{batch_id}.json")
+
+    def upload(self, path: str) -> str:
+        file_id = f"file-{uuid.uuid4().hex}"
+        shutil.copyfile(path, self._file_path(file_id))
+        return file_id
+
+    def create(self, input_file_id: str, metadata: dict = None) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch = {"id": batch_id, "status": "validating", "input_file_id": input_file_id, "metadata": metadata}
+        with open(self._batch_path(batch_id), "w") as f:
+            json.dump(batch, f)
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> dict:
+        with open(self._batch_path(batch_id)) as f:
+            batch = json.load(f)
+        if batch["status"] in BATCH_FINAL_STATES:
+            return batch
+
+        output_file_id = f"file-{uuid.uuid4().hex}"
+        completed = failed = 0
+        with open(self._file_path(batch["input_file_id"]), encoding="utf-8") as src, \
+                open(self._file_path(output_file_id), "w", encoding="utf-8") as out:
+            for line in src:
+                request = json.loads(line)
+                try:
+                    result = {"status_code": 200, "body": self.responder(request["body"])}
+                    error = None
+                    completed += 1
+                except Exception as e:
+                    result = None
+                    error = {"code": "local_error", "message": str(e)}
+                    failed += 1
+                out.write(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": result,
+                    "error": error
+                }) + "\n")
+        batch.update(
+            status="completed",
+            output_file_id=output_file_id,
+            request_counts={"total": completed + failed, "completed": completed, "failed": failed}
+        )
+        with open(self._batch_path(batch_id), "w") as f:
+            json.dump(batch, f)
+        return batch
+
+    def download(self, file_id: str) -> str:
+        with open(self._file_path(file_id), encoding="utf-8") as f:
+            return f.read()
+
+
+def get_batch_transport(name: str = None):
+    name = name or OPENAI_BATCH_TRANSPORT
+    if name == "local":
+        # Local runs answer every request with the canned replies of the fake OpenAI server
+        from app.utils.fake_openai_server import fake_completion
+        return LocalBatchTransport(fake_completion)
+    if name == "openai":
+        return OpenAIBatchTransport()
+    raise ValueError(f"Unknown batch transport '{name}', expected 'openai' or 'local'.")
+
+
+def run_batch(batch: BatchJob, transport=None, poll_interval: float = None, timeout: float = None) -> dict:
+    """
+    Submit the input files of a batch job, wait for them to finish and collect the results.
+
+    Returns:
+    dict: custom_id -> chat completion response json, for every request that succeeded
+    """
+    batch.close()
+    transport = transport or get_batch_transport()
+    poll_interval = OPENAI_BATCH_POLL_SECONDS if poll_interval is None else poll_interval
+    timeout = OPENAI_BATCH_TIMEOUT if timeout is None else timeout
+    start_time = time.time()
+
+    batch_ids = []
+    for path in batch.files:
+        file_id = transport.upload(path)
+        batch_ids.append(transport.create(file_id, metadata={"job": batch.name}))
+    logger.info(f"Submitted {batch.requests} requests of {batch.name} in {len(batch_ids)} batch(es): {batch_ids}")
+
+    results = {}
+    failed = 0
+    pending = list(batch_ids)
+    while pending:
+        for batch_id in list(pending):
+            state = transport.retrieve(batch_id)
+            if state["status"] not in BATCH_FINAL_STATES:
+                continue
+            pending.remove(batch_id)
+            if state["status"] != "completed":
+                logger.error(f"Batch {batch_id} ended as {state['status']}: {state.get('errors')}")
+            # Expired and cancelled batches still return the requests finished so far
+            if state.get("output_file_id"):
+                for line in transport.download(state["output_file_id"]).splitlines():
+                    if not line.strip():
+                        continue
+                    item = json.loads(line)
+                    response = item.get("response") or {}
+                    if response.get("status_code") == 200:
+                        results[item["custom_id"]] = response["body"]
+                    else:
+                        failed += 1
+                        logger.error(f"Batch request {item['custom_id']} failed: {item.get('error') or response}")
+        if pending:
+            if time.time() - start_time > timeout:
+                raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=f"Batches {pending} did not finish in time.")
+            logger.info(f"Waiting for {len(pending)} batch(es) of {batch.name}...")
+            time.sleep(poll_interval)
+
+    missing = batch.requests - len(results) - failed
+    logger.info(
+        f"Batch {batch.name} finished in {time.time() - start_time:.0f}s: {len(results)} succeeded, "
+        f"{failed} failed, {missing} without result."
+    )
+    return results
@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import logging
+from difflib import SequenceMatcher
+from .image_service import read_page_manifest
+
+logger = logging.getLogger(__name__)
+
+# Persisted next to the page manifest so that results can be attributed to every original page
+DEDUP_MAP = "dedup.json"
+
+# Pages whose 256 bit perceptual hashes differ in at most this many bits look the same
+DEDUP_HAMMING_THRESHOLD = int(os.getenv("DEDUP_HAMMING_THRESHOLD", 10))
+
+# Pages that look the same but carry text must also have this similar a text layer
+DEDUP_TEXT_SIMILARITY = float(os.getenv("DEDUP_TEXT_SIMILARITY", 0.9))
+
+# Pages with less ink than this and (almost) no text are blank
+BLANK_MAX_INK = float(os.getenv("BLANK_MAX_INK", 0.002))
+BLANK_MAX_CHARS = int(os.getenv("BLANK_MAX_CHARS", 3))
+
+
+def is_blank(page_info: dict) -> bool:
+    """
+    Return True for pages without text and (almost) without ink.
+    """
+    if "ink" not in page_info:
+        return False
+    return page_info["ink"] <= BLANK_MAX_INK and page_info.get("chars", 0) <= BLANK_MAX_CHARS
+
+
+def hamming_distance(phash_a: str, phash_b: str) -> int:
+    return bin(int(phash_a, 16) ^ int(phash_b, 16)).count("1")
+
+
+def _normalized_text(page_info: dict) -> str:
+    return " ".join((page_info.get("text") or "").split())
+
+
+def is_duplicate(page_a: dict, page_b: dict, threshold: int = None) -> bool:
+    """
+    Return True when two pages are near-duplicates.
+
+    The perceptual hashes decide whether the pages look alike. Because text
+    pages of one template look alike at hash resolution, pages with a text
+    layer additionally need DEDUP_TEXT_SIMILARITY similar text.
+    """
+    threshold = DEDUP_HAMMING_THRESHOLD if threshold is None else threshold
+    if not page_a.get("phash") or not page_b.get("phash"):
+        return False
+    if hamming_distance(page_a["phash"], page_b["phash"]) > threshold:
+        return False
+    text_a, text_b = _normalized_text(page_a), _normalized_text(page_b)
+    if not text_a and not text_b:
+        return True
+    matcher = SequenceMatcher(None, text_a, text_b, autojunk=False)
+    return (
+        matcher.real_quick_ratio() >= DEDUP_TEXT_SIMILARITY
+        and matcher.quick_ratio() >= DEDUP_TEXT_SIMILARITY
+        and matcher.ratio() >= DEDUP_TEXT_SIMILARITY
+    )
+
+
+def find_duplicate(page_info: dict, kept: dict, threshold: int = None):
+    """
+    Return the file of the first kept page that page_info duplicates, or None.
+
+    Args:
+    page_info (dict): Page features from the page manifest.
+    kept (dict): Image file -> page features of the pages kept so far.
+    """
+    for file, kept_info in kept.items():
+        if is_duplicate(page_info, kept_info, threshold):
+            return file
+    return None
+
+
+def build_dedup_map(manifest: dict, files: list, threshold: int = None) -> dict:
+    """
+    Drop blank pages and collapse near-duplicates among the given image files.
+
+    Files are compared in name order, so the same folder always keeps the
+    same pages. Files missing from the manifest are always kept.
+
+    Returns:
+    dict: "kept" image files in their original order, "blank" files, and
+    "duplicates" mapping each kept file to the files it stands in for.
+    """
+    threshold = DEDUP_HAMMING_THRESHOLD if threshold is None else threshold
+    kept, blank, duplicates = {}, [], {}
+    for file in sorted(files):
+        page_info = manifest.get(file)
+        if page_info is None:
+            kept[file] = {}
+            continue
+        if is_blank(page_info):
+            blank.append(file)
+            continue
+        original = find_duplicate(page_info, kept, threshold)
+        if original is None:
+            kept[file] = page_info
+        else:
+            duplicates.setdefault(original, []).append(file)
+    return {"threshold": threshold, "kept": [file for file in files if file in kept], "blank": blank, "duplicates": duplicates}
+
+
+def _fingerprint(manifest: dict, files: list, threshold: int) -> str:
+    payload = json.dumps(
+        [manifest, sorted(files), threshold, DEDUP_TEXT_SIMILARITY, BLANK_MAX_INK, BLANK_MAX_CHARS], sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def save_dedup_map(images_path: str, dedup_map: dict):
+    map_path = os.path.join(images_path, DEDUP_MAP)
+    tmp_path = f"{map_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dedup_map, f, ensure_ascii=False)
+    os.replace(tmp_path, map_path)
+
+
+def load_dedup_map(images_path: str, files: list, threshold: int = None) -> dict:
+    """
+    Return the dedup map of an image folder, building and saving it when it is
+    missing or the pages or thresholds changed since it was built.
+    """
+    threshold = DEDUP_HAMMING_THRESHOLD if threshold is None else threshold
+    manifest = read_page_manifest(images_path)
+    fingerprint = _fingerprint(manifest, files, threshold)
+    map_path = os.path.join(images_path, DEDUP_MAP)
+    if os.path.exists(map_path):
+        with open(map_path, "r", encoding="utf-8") as f:
+            dedup_map = json.load(f)
+        if dedup_map.get("fingerprint") == fingerprint:
+            return dedup_map
+
+    dedup_map = build_dedup_map(manifest, files, threshold)
+    dedup_map["fingerprint"] = fingerprint
+    save_dedup_map(images_path, dedup_map)
+    log_dedup_savings(dedup_map, files)
+    return dedup_map
+
+
+def original_pages(dedup_map: dict, file: str) -> list:
+    """
+    Return every original page a kept page stands for, the kept page first.
+    """
+    return [file] + dedup_map.get("duplicates", {}).get(file, [])
+
+
+def log_dedup_savings(dedup_map: dict, files: list) -> int:
+    """
+    Log and return how many pages dedup removed from the given files.
+    """
+    duplicate_count = sum(len(copies) for copies in dedup_map["duplicates"].values())
+    removed = len(dedup_map["blank"]) + duplicate_count
+    logger.info(
+        f"Page dedup: {len(dedup_map['kept'])} of {len(files)} pages kept, "
+        f"{len(dedup_map['blank'])} blank and {duplicate_count} near-duplicate pages dropped."
+    )
+    return removed
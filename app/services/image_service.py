@@ -3,37 +3,219 @@ from dotenv import load_dotenv
 import os
 import logging
 import base64
+import json
 from PIL import Image
 from io import BytesIO
+from .render_cache import render_cache, file_hash
 
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-Image.MAX_IMAGE_PIXELS = None
+# Ceiling for any page image that is rendered or decoded (3 bytes per pixel in RGB).
+# Larger images are rejected instead of letting a single A0 sheet take gigabytes.
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 150_000_000))
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+# Pixel budget of one image in a vision request. Pages rendered with the
+# "vision" profile already fit into it and are sent as they are.
+VISION_MAX_PIXELS = 1024 * 1024
+
+# On-disk formats of rendered page images. The format and MIME type of every
+# page are recorded in the page manifest so the right one is sent to gpt.
+PAGE_IMAGE_FORMATS = {
+    "png": {"pil": "PNG", "ext": ".png", "mime": "image/png"},
+    "jpeg": {"pil": "JPEG", "ext": ".jpg", "mime": "image/jpeg"},
+    "webp": {"pil": "WEBP", "ext": ".webp", "mime": "image/webp"},
+}
+PAGE_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+PAGE_IMAGE_FORMAT = os.getenv("PAGE_IMAGE_FORMAT", "webp")
+PAGE_IMAGE_QUALITY = int(os.getenv("PAGE_IMAGE_QUALITY", 85))
+PAGE_IMAGE_GRAYSCALE = os.getenv("PAGE_IMAGE_GRAYSCALE", "false").lower() in ("1", "true", "yes")
+
+
+def page_image_settings(image_format: str = None, quality: int = None, grayscale: bool = None) -> dict:
+    """
+    Return the page image settings, falling back to the PAGE_IMAGE_* defaults.
+    """
+    image_format = (image_format or PAGE_IMAGE_FORMAT).lower()
+    if image_format not in PAGE_IMAGE_FORMATS:
+        raise ValueError(f"Unknown page image format '{image_format}', expected one of {list(PAGE_IMAGE_FORMATS)}")
+    return {
+        "format": image_format,
+        "quality": PAGE_IMAGE_QUALITY if quality is None else quality,
+        "grayscale": PAGE_IMAGE_GRAYSCALE if grayscale is None else grayscale,
+    }
+
+
+def save_page_image(img, settings: dict, dpi: int = None) -> bytes:
+    """
+    Encode a page image with the given settings (see page_image_settings) and return the bytes.
+    """
+    image_format = PAGE_IMAGE_FORMATS[settings["format"]]
+    if settings["grayscale"] and img.mode != "L":
+        img = img.convert("L")
+    options = {"dpi": (dpi, dpi)} if dpi else {}
+    if image_format["pil"] != "PNG":
+        options["quality"] = settings["quality"]
+    if image_format["pil"] == "WEBP":
+        options["method"] = 4
+    buffered = BytesIO()
+    img.save(buffered, format=image_format["pil"], **options)
+    return buffered.getvalue()
+
+
+def page_image_mime(file, manifest: dict = None) -> str:
+    """
+    Return the MIME type of a page image, from the page manifest when it is recorded there.
+    """
+    page_info = (manifest or {}).get(os.path.basename(file), {})
+    if page_info.get("mime"):
+        return page_info["mime"]
+    ext = os.path.splitext(file)[1].lower()
+    for image_format in PAGE_IMAGE_FORMATS.values():
+        if image_format["ext"] == ext:
+            return image_format["mime"]
+    return "image/jpeg" if ext == ".jpeg" else "image/png"
+
+
+def image_data_url(img_data: bytes, mime: str) -> str:
+    return f"data:{mime};base64,{base64.b64encode(img_data).decode('utf-8')}"
+
+
+def page_fingerprint(img) -> dict:
+    """
+    Return the perceptual hash and ink coverage of a page image.
+
+    "phash" is a 256 bit difference hash (hex) of a 17x16 grayscale thumbnail,
+    close hashes mean visually near-identical pages. "ink" is the share of
+    non-white pixels, used to spot blank separator pages.
+    """
+    # Downscale before converting, so no full-size grayscale copy is made
+    small = img.resize((128, 128), Image.Resampling.BOX).convert("L")
+    thumb = small.resize((17, 16), Image.Resampling.BILINEAR)
+    pixels = list(thumb.getdata())
+    bits = 0
+    for row in range(16):
+        for col in range(16):
+            left, right = pixels[row * 17 + col], pixels[row * 17 + col + 1]
+            bits = (bits << 1) | (left > right)
+    ink = sum(1 for value in small.getdata() if value < 230) / (128 * 128)
+    return {"phash": f"{bits:064x}", "ink": round(ink, 4)}
+
+
+# Per-folder record of where each page image came from and what its text layer holds
+PAGE_MANIFEST = "pages.json"
+
+
+def read_page_manifest(images_path) -> dict:
+    """
+    Return the page manifest of an image folder, keyed by image file name.
+    """
+    manifest_path = os.path.join(images_path, PAGE_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_page_manifest(images_path, records: list):
+    """
+    Merge rendered page records into the page manifest of an image folder.
+    """
+    manifest = read_page_manifest(images_path)
+    for record in records:
+        if not record.get("image_path"):
+            continue
+        manifest[os.path.basename(record["image_path"])] = {
+            key: value for key, value in record.items()
+            if key not in ("image_path", "image_bytes", "error", "cached", "pdf_index")
+        }
+    tmp_path = os.path.join(images_path, f"{PAGE_MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(images_path, PAGE_MANIFEST))
+
+
+def _encode_image_file(file, mime: str = None):
+    """
+    Return a page image as a data URL ready for an image_url message.
+    """
+    try:
+        with Image.open(file) as img:  # Open the image file
+            if img.width * img.height <= VISION_MAX_PIXELS and img.format in ("PNG", "JPEG", "WEBP"):
+                # Already rendered at payload size, no need to decode and re-encode it
+                with open(file, "rb") as f:
+                    img_data = f.read()
+                mime = mime or Image.MIME[img.format]
+            else:
+                # Oversized images are downscaled once and the result is kept in the render cache
+                cache_key = render_cache.key(file_hash(file), 0, "payload-1024x1024")
+                img_data = render_cache.get_bytes(cache_key)
+                if img_data is None:
+                    if img.width * img.height > IMAGE_MAX_PIXELS:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"Image {file} has {img.width}x{img.height} pixels, more than IMAGE_MAX_PIXELS ({IMAGE_MAX_PIXELS})."
+                        )
+                    # JPEGs are decoded at reduced scale, the rest is reduced in integer steps before resampling
+                    img.draft("RGB", (1024, 1024))
+                    img = img.resize((1024, 1024), reducing_gap=3.0)
+                    buffered = BytesIO()  # Create a buffer to store the image bytes
+                    img.save(buffered, format="PNG")  # Save the image to the buffer in PNG format
+                    img_data = buffered.getvalue()  # Get the raw image data from the buffer
+                    render_cache.put(cache_key, data=img_data)
+                mime = "image/png"
+            return image_data_url(img_data, mime)
+    except HTTPException:
+        raise
+    except Image.DecompressionBombError as e:
+        # Image.open refuses images above twice Image.MAX_IMAGE_PIXELS (IMAGE_MAX_PIXELS) itself
+        raise HTTPException(status_code=413, detail=f"Image {file} has more pixels than IMAGE_MAX_PIXELS ({IMAGE_MAX_PIXELS}): {e}")
+    except Exception as e:
+        logger.error(f"Error processing image {file}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing image {file}: {e}")
+
+
+def list_page_files(images_path):
+    """
+    Return the page image file names of a folder, in the order they are encoded.
+    """
+    return [file for file in os.listdir(images_path) if file.lower().endswith(PAGE_IMAGE_EXTENSIONS)]
 
 
 def encode_images_to_base64(images_path):
-    image_files = [os.path.join(images_path, file) for file in os.listdir(images_path) if file.endswith(".png")]
+    image_files = [os.path.join(images_path, file) for file in list_page_files(images_path)]
     print("image file:", len(image_files))
     encoded_images = []    
     for file in image_files:
-        try:
-            with Image.open(file) as img:  # Open the image file
-                img = img.resize((1024, 1024)) 
-                buffered = BytesIO()  # Create a buffer to store the image bytes
-                img.save(buffered, format="PNG")  # Save the image to the buffer in PNG format
-                img_data = buffered.getvalue()  # Get the raw image data from the buffer
-                encoded_image = base64.b64encode(img_data).decode('utf-8')  # Encode the image data as base64
-                encoded_images.append(encoded_image)
-                # print("Image read successfully")
-        except Exception as e:
-            logger.error(f"Error processing image {file}: {e}")
-            raise HTTPException(status_code=500, detail=f"Error processing image {file}: {e}")
+        encoded_images.append(_encode_image_file(file))
     return encoded_images
 
 
+def encode_pages(images_path, files: list = None):
+    """
+    Prepare the pages of an image folder for gpt.
+
+    Pages the page manifest marks as text-rich are returned as {"text": ...}
+    and sent as plain text, all other pages as base64 data URLs.
+    Only the given image files are prepared when files is set.
+    """
+    manifest = read_page_manifest(images_path)
+    image_files = list_page_files(images_path) if files is None else files
+    pages = []
+    for file in image_files:
+        page_info = manifest.get(file, {})
+        if page_info.get("text_rich"):
+            pages.append({"text": page_info["text"]})
+        else:
+            pages.append(_encode_image_file(os.path.join(images_path, file), page_image_mime(file, manifest)))
+    text_pages = sum(1 for page in pages if isinstance(page, dict))
+    logger.info(f"Prepared {len(pages)} pages: {text_pages} as text, {len(pages) - text_pages} as images.")
+    return pages
+
+
 
 def parse_response_data(data):
     # Strip the data and split it into lines
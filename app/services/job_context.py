@@ -0,0 +1,87 @@
+import os
+import time
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# Retries one analysis (job) may spend in total before transient errors are passed on
+OPENAI_JOB_RETRY_BUDGET = int(os.getenv("OPENAI_JOB_RETRY_BUDGET", 50))
+
+_current_job = contextvars.ContextVar("openai_job", default=None)
+
+
+def new_job_stats(name: str) -> dict:
+    return {
+        "job": name,
+        "started": time.time(),
+        "requests": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "cached_tokens": 0,
+        "retries": 0,
+        "backoff_seconds": 0.0,
+        "failed_requests": 0,
+        "circuit_rejections": 0,
+        "cache_hits": 0,
+        "schema_reasks": 0,
+        "page_results_reused": 0,
+        "reducer_calls_skipped": 0,
+        "escalations": 0,
+        "retry_budget": OPENAI_JOB_RETRY_BUDGET,
+    }
+
+
+@contextmanager
+def job_context(name: str):
+    """
+    Collect the OpenAI usage, retries and backoff time of one job (e.g. one analysis).
+
+    The stats travel in a context variable. Threads do not inherit it, so work
+    handed to a thread pool must go through submit_in_context. Coroutines run
+    through openai_client.run carry it over to the client's event loop.
+    Nested jobs are not created, an already running job is reused.
+    """
+    stats = _current_job.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = new_job_stats(name)
+    token = _current_job.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_job.reset(token)
+
+
+def with_job(name: str):
+    """
+    Decorator running every call of the function as one job (see job_context).
+
+    The call runs in a copy of the caller's context, so context variables the
+    job sets for itself (e.g. its page store) do not outlive it.
+    """
+    def decorator(fn):
+        def run(*args, **kwargs):
+            with job_context(name):
+                return fn(*args, **kwargs)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return contextvars.copy_context().run(run, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_job():
+    """
+    Return the stats of the running job, or None outside of a job.
+    """
+    return _current_job.get()
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+    executor.submit that runs fn in a copy of the caller's context, so the job stats follow it.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,122 @@
+import os
+import json
+import logging
+import threading
+from pydantic import Field, create_model
+
+logger = logging.getLogger(__name__)
+
+# Model of each tier. Calls routed to the small tier are escalated to the large one
+# when the small model's structured reply does not validate or reports low confidence.
+MODEL_TIERS = {
+    "small": os.getenv("OPENAI_SMALL_MODEL", "gpt-4o-mini"),
+    "large": os.getenv("OPENAI_LARGE_MODEL", "gpt-4o"),
+}
+MODEL_ESCALATION_CONFIDENCE = float(os.getenv("MODEL_ESCALATION_CONFIDENCE", 0.7))
+
+# Tier per call site (the cache_as / ledger stage), optionally per field as "stage:field".
+# MODEL_ROUTES (JSON) overrides or extends it, e.g. '{"final_fields:roof_shape": "large"}'.
+# Call sites that are not listed use the large tier. Only call sites with a structured
+# reply (see call_routed) are escalated, the others (page, PdfReport) just use their tier.
+DEFAULT_ROUTES = {
+    "page": "large",
+    "final_fields": "small",
+    "final_response": "small",
+    "extract_location": "small",
+    "comparison": "large",
+    "PdfReport": "large",
+    "completeness_check": "large",
+}
+
+CONFIDENCE_NOTE = (
+    "\n\nAlso rate how confident you are that your answer is correct and supported by the "
+    "input as a number between 0 and 1 in the confidence field."
+)
+
+
+def load_routes() -> dict:
+    routes = dict(DEFAULT_ROUTES)
+    try:
+        routes.update(json.loads(os.getenv("MODEL_ROUTES") or "{}"))
+    except ValueError as e:
+        logger.error(f"Ignoring invalid MODEL_ROUTES: {e}")
+    for key, tier in list(routes.items()):
+        if tier not in MODEL_TIERS:
+            logger.error(f"Unknown model tier {tier!r} for {key}, using the large tier.")
+            routes[key] = "large"
+    return routes
+
+
+MODEL_ROUTES = load_routes()
+
+
+def route(stage: str, field: str = None) -> str:
+    """
+    Return the tier ("small" or "large") of a call site and field.
+    """
+    if field is not None and f"{stage}:{field}" in MODEL_ROUTES:
+        return MODEL_ROUTES[f"{stage}:{field}"]
+    return MODEL_ROUTES.get(stage, "large")
+
+
+def model_for(stage: str, field: str = None) -> str:
+    return MODEL_TIERS[route(stage, field)]
+
+
+def with_confidence(output_model: type) -> type:
+    """
+    Reply model of the small tier: output_model plus the model's confidence in its answer.
+    """
+    return create_model(
+        f"{output_model.__name__}WithConfidence",
+        __base__=output_model,
+        confidence=(float, Field(description="Confidence between 0 and 1 that the answer is correct.")),
+    )
+
+
+class RoutingStats:
+    """
+    Per call site and field: requests per tier, escalations and why, and the time spent per tier.
+
+    An escalated request counts its small and its large attempt, so the latency of
+    small-tier requests includes the ones that were escalated afterwards.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, field: str, tier: str, latency: float, escalated: str = None):
+        """
+        Count one routed request. escalated is the reason ("low_confidence" or "invalid") when
+        a small-tier reply was not accepted.
+        """
+        key = f"{stage}:{field}" if field is not None else stage
+        with self._lock:
+            counters = self.counters.setdefault(key, {
+                "small": 0, "large": 0, "escalated": 0, "low_confidence": 0, "invalid": 0,
+                "small_seconds": 0.0, "large_seconds": 0.0,
+            })
+            counters[tier] += 1
+            counters[f"{tier}_seconds"] += latency
+            if escalated is not None:
+                counters["escalated"] += 1
+                counters[escalated] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {key: dict(counters) for key, counters in self.counters.items()}
+        for counters in routes.values():
+            counters["escalation_rate"] = round(counters["escalated"] / counters["small"], 3) if counters["small"] else 0.0
+            for tier in MODEL_TIERS:
+                seconds = counters.pop(f"{tier}_seconds")
+                counters[f"avg_{tier}_seconds"] = round(seconds / counters[tier], 3) if counters[tier] else None
+        return {
+            "tiers": dict(MODEL_TIERS),
+            "routes": dict(MODEL_ROUTES),
+            "escalation_confidence": MODEL_ESCALATION_CONFIDENCE,
+            "fields": routes,
+        }
+
+
+routing_stats = RoutingStats()
@@ -0,0 +1,106 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Share of the page votes the most frequent value needs to be taken without asking the reducer
+NUMERIC_REDUCER_AGREEMENT = float(os.getenv("NUMERIC_REDUCER_AGREEMENT", 0.75))
+NUMERIC_REDUCER_ENABLED = os.getenv("NUMERIC_REDUCER", "true").lower() in ("1", "true", "yes")
+
+NUMBER = r"(\d+(?:[.,]\d+)?)"
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "ein": 1, "eins": 1, "eine": 1, "zwei": 2, "drei": 3, "vier": 4, "fünf": 5, "sechs": 6,
+    "i": 1, "ii": 2, "iii": 3, "iv": 4, "v": 5, "vi": 6, "vii": 7, "viii": 8,
+}
+
+# Per field: patterns whose first group is a candidate value, the tolerance within
+# which two values count as the same, and how the agreed value is written
+NUMERIC_FIELDS = {
+    "grz": {
+        "patterns": [re.compile(r"\bgrz\b[^0-9\n]{0,30}?" + NUMBER, re.IGNORECASE)],
+        "tolerance": 0.01,
+        "format": "GRZ {value}",
+    },
+    "gfz": {
+        "patterns": [re.compile(r"\bgfz\b[^0-9\n]{0,30}?" + NUMBER, re.IGNORECASE)],
+        "tolerance": 0.01,
+        "format": "GFZ {value}",
+    },
+    "building_height": {
+        "patterns": [re.compile(r"(?:höhe|height|high|hoch)[^0-9\n]{0,40}?" + NUMBER + r"\s*m\b", re.IGNORECASE)],
+        "tolerance": 0.1,
+        "format": "{value} m",
+    },
+    "number_of_floors": {
+        "patterns": [re.compile(
+            r"\b(\d+|" + "|".join(sorted(NUMBER_WORDS, key=len, reverse=True)) + r")\s+(?:full\s+|voll)?"
+            r"(?:floors?|stor(?:e)?ys?|levels?|geschosse?|vollgeschosse?)\b",
+            re.IGNORECASE
+        )],
+        "tolerance": 0,
+        "format": "{value} floors",
+    },
+}
+
+
+def _to_number(text: str):
+    text = text.lower()
+    if text in NUMBER_WORDS:
+        return NUMBER_WORDS[text]
+    value = float(text.replace(",", "."))
+    return int(value) if value.is_integer() else value
+
+
+def numeric_candidates(field: str, text: str) -> list:
+    """
+    Return the distinct values of a field mentioned in one page reply, in order of appearance.
+    """
+    config = NUMERIC_FIELDS[field]
+    values = []
+    for pattern in config["patterns"]:
+        for match in pattern.finditer(text or ""):
+            value = _to_number(match.group(1))
+            if not any(abs(value - other) <= config["tolerance"] for other in values):
+                values.append(value)
+    return values
+
+
+def consolidate(field: str, responses: list):
+    """
+    Pick the value of a numeric field from its page replies without a reducer request.
+
+    Every page with exactly one value votes for it, values within the field's
+    tolerance count as the same. Pages mentioning no value do not vote.
+
+    Returns:
+    str: the agreed value, or None when the reducer has to decide
+        (no value found, a page mentions several, or no value reaches NUMERIC_REDUCER_AGREEMENT)
+    """
+    if not NUMERIC_REDUCER_ENABLED or field not in NUMERIC_FIELDS:
+        return None
+    config = NUMERIC_FIELDS[field]
+    votes = []
+    for response in responses:
+        values = numeric_candidates(field, response)
+        if len(values) > 1:
+            logger.debug(f"A page reply mentions several values for {field}: {values}")
+            return None
+        votes.extend(values)
+    if not votes:
+        return None
+
+    # Group the votes around the first value of each group, in page order
+    groups = []
+    for value in votes:
+        group = next((group for group in groups if abs(group[0] - value) <= config["tolerance"]), None)
+        if group is None:
+            groups.append([value])
+        else:
+            group.append(value)
+    best = max(groups, key=len)
+    if len(best) / len(votes) < NUMERIC_REDUCER_AGREEMENT:
+        return None
+    value = max(best, key=best.count)
+    return config["format"].format(value=value)
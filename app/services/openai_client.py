@@ -0,0 +1,141 @@
+import os
+import asyncio
+import logging
+import threading
+import contextvars
+import concurrent.futures
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Point OPENAI_BASE_URL at a local fake server (see app.utils.fake_openai_server) for tests and benchmarks
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 120))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 10))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 50))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_KEEPALIVE_CONNECTIONS", 20))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "false").lower() in ("1", "true", "yes")
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class OpenAIClient:
+    """
+    Shared async HTTP client for the OpenAI API.
+
+    One httpx.AsyncClient with a keep-alive connection pool (and HTTP/2 when
+    enabled and the h2 package is installed) lives on a background event loop,
+    so async code and the existing synchronous callers reuse the same
+    connections instead of paying a new TCP and TLS handshake per request.
+    """
+
+    def __init__(self, base_url: str = OPENAI_BASE_URL, timeout: float = OPENAI_TIMEOUT, http2: bool = OPENAI_HTTP2):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.http2 = http2
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._client = None
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Return the background event loop, starting it on first use.
+        """
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="openai-client", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Only called on the background loop, so no lock is needed
+        if self._client is None:
+            http2 = self.http2 and _http2_available()
+            if self.http2 and not http2:
+                logger.warning("OPENAI_HTTP2 is set but the h2 package is not installed, using HTTP/1.1.")
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=http2,
+                timeout=httpx.Timeout(self.timeout, connect=OPENAI_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def request(self, method: str, path: str, timeout: float = None, **kwargs) -> httpx.Response:
+        """
+        Send a request to the API. Must be awaited on the background loop (see run).
+        """
+        client = self._get_client()
+        return await client.request(method, path, timeout=timeout or httpx.USE_CLIENT_DEFAULT, **kwargs)
+
+    async def post(self, path: str, json: dict, headers: dict = None, timeout: float = None) -> httpx.Response:
+        return await self.request("POST", path, json=json, headers=headers, timeout=timeout)
+
+    def stream(self, method: str, path: str, timeout: float = None, **kwargs):
+        """
+        Streaming counterpart of request, used as `async with openai_client.stream(...) as response`
+        on the background loop. The body is read with response.aiter_lines().
+        """
+        client = self._get_client()
+        return client.stream(method, path, timeout=timeout or httpx.USE_CLIENT_DEFAULT, **kwargs)
+
+    def run(self, coro):
+        """
+        Run a coroutine on the background loop and wait for its result.
+
+        This is the sync facade for code that is not async itself. It must not
+        be called from the background loop, which would wait on itself. The
+        coroutine runs in a copy of the caller's context, so context variables
+        such as the job stats (see job_context) carry over to the loop.
+        """
+        loop = self.loop()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("OpenAIClient.run() called from its own event loop, await the coroutine instead.")
+        context = contextvars.copy_context()
+        result = concurrent.futures.Future()
+
+        def start():
+            task = loop.create_task(coro, context=context)
+
+            def done(task):
+                if task.cancelled():
+                    result.cancel()
+                elif task.exception() is not None:
+                    result.set_exception(task.exception())
+                else:
+                    result.set_result(task.result())
+
+            task.add_done_callback(done)
+
+        loop.call_soon_threadsafe(start)
+        return result.result()
+
+    def close(self):
+        """
+        Close the connection pool and stop the background loop.
+        """
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result()
+            self._client = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+
+
+openai_client = OpenAIClient()
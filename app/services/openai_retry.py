@@ -0,0 +1,129 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Attempts per request (the first try included) and the exponential backoff range
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", 5))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", 1.0))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", 60.0))
+
+# Transient upstream responses worth another attempt
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Circuit breaker: consecutive upstream failures before failing fast, and how long to wait before probing again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("OPENAI_CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_SECONDS = float(os.getenv("OPENAI_CIRCUIT_RESET_SECONDS", 30))
+
+
+def parse_retry_after(headers) -> float:
+    """
+    Return the delay requested by Retry-After (seconds or HTTP date) or
+    OpenAI's retry-after-ms header, or None when there is none.
+    """
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """
+    Seconds to wait before retry number attempt (0-based).
+
+    Uses exponential backoff with full jitter. When the server asked for a
+    delay with Retry-After, that delay is honoured and only a little jitter is
+    added on top, so that waiting clients do not all come back at once.
+    """
+    if retry_after is not None:
+        return min(retry_after, OPENAI_BACKOFF_MAX) + random.uniform(0, OPENAI_BACKOFF_BASE)
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the upstream is down.
+
+    After failure_threshold consecutive upstream failures (5xx, timeouts,
+    connection errors) the circuit opens and requests are rejected right away.
+    After reset_seconds a single probe request is let through: success closes
+    the circuit again, failure keeps it open for another reset_seconds. A probe
+    that ends without either (e.g. cancelled) must be given back with release().
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("OpenAI circuit closed again.")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.error(f"OpenAI circuit opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self):
+        """
+        Let another request probe, after a request that was allowed ended without a result.
+        """
+        with self._lock:
+            self.probing = False
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0.0)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "retry_in_seconds": round(self.retry_in(), 1)}
+
+
+circuit_breaker = CircuitBreaker()
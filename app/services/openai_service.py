@@ -2,11 +2,35 @@ from fastapi import HTTPException, status
 import openai
 from dotenv import load_dotenv
 import os, time
+import json
 import logging
-import requests
+import asyncio
+import httpx
+import queue
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from .image_service import encode_images_to_base64, parse_response_data, parse_cmp_data
+from .image_service import encode_images_to_base64, encode_pages, list_page_files, update_page_manifest, image_data_url
+from .triage_service import load_triage_index, select_pages, log_triage_savings, page_relevant_fields
+from .dedup_service import load_dedup_map, save_dedup_map, is_blank, find_duplicate, log_dedup_savings, DEDUP_HAMMING_THRESHOLD
 from .file_service import save_bplan_details_into_db
+from .pdf_service import iter_pdf_pages
+from .openai_client import openai_client
+from .rate_limiter import request_scheduler, estimate_tokens
+from .openai_retry import OPENAI_MAX_ATTEMPTS, RETRYABLE_STATUS_CODES, circuit_breaker, parse_retry_after, backoff_delay
+from .job_context import with_job, current_job, submit_in_context
+from .page_store import set_page_store, current_page_store
+from .numeric_reducer import consolidate as consolidate_numeric
+from .response_cache import response_cache, cache_key
+from .batch_service import BatchJob
+from .usage_ledger import usage_ledger, ledger_field, in_field, current_ledger_field, ledger_escalation
+from .model_router import (
+    MODEL_TIERS, MODEL_ESCALATION_CONFIDENCE, CONFIDENCE_NOTE, route, model_for, with_confidence, routing_stats
+)
+from pydantic import ValidationError
+from .structured_output import (
+    FieldValue, LocationValue, AnalysisSummary, ANALYSIS_LABELS, CompletenessReport, compliance_report_model, response_format,
+    validation_summary
+)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -106,64 +130,672 @@ def get_api_key(OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")):
 
 openai.api_key = get_api_key()
 
+# Streaming pipeline settings: size of the queues between the render, encode and
+# dispatch stages, and the number of OpenAI requests allowed in flight.
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))
+PIPELINE_MAX_IN_FLIGHT = int(os.getenv("PIPELINE_MAX_IN_FLIGHT", 10))
+
+# Number of pages one send_to_gpt call has in flight at a time
+SEND_TO_GPT_CONCURRENCY = int(os.getenv("SEND_TO_GPT_CONCURRENCY", 10))
+
+# Request packing: fields whose pages are sent several at a time (see send_packed_to_gpt),
+# and the page count and input token budget of one packed request
+PACKED_FIELDS = {
+    field.strip()
+    for field in os.getenv(
+        "PACKED_FIELDS",
+        "location_within_building_zone,building_use_type,building_style,grz,gfz,parking_spaces,"
+        "deviations_from_b_plan,exemptions_required,species_protection_check,"
+        "compliance_with_zoning_rules,compliance_with_building_codes"
+    ).split(",")
+    if field.strip()
+}
+PACK_MAX_IMAGES = int(os.getenv("PACK_MAX_IMAGES", 8))
+PACK_MAX_TOKENS = int(os.getenv("PACK_MAX_TOKENS", 16000))
+
+# Tree reduce (see tree_reduce): input token budget of one reducer request, and how
+# many page replies or partial results one reducer request combines at most
+REDUCE_CHUNK_TOKENS = int(os.getenv("REDUCE_CHUNK_TOKENS", 24000))
+REDUCE_FAN_IN = int(os.getenv("REDUCE_FAN_IN", 32))
+
+# How often a reducer reply that does not match its JSON schema is asked for again
+OPENAI_SCHEMA_REASKS = int(os.getenv("OPENAI_SCHEMA_REASKS", 2))
+
+# Extraction modes: "per_field" sends every page once per field prompt, "single_pass"
+# sends every page once with a combined prompt answering all fields as a JSON record,
+# "batch" sends the per_field requests through the OpenAI Batch API (see batch_service).
+# The batch mode can take up to a day, so it only runs offline (app.utils.batch_extract)
+# and not in the request path.
+EXTRACTION_MODES = ("per_field", "single_pass", "batch")
+INTERACTIVE_EXTRACTION_MODES = ("per_field", "single_pass")
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "per_field")
+
+# Process-wide OpenAI usage counters. Each job (see job_context) also keeps its own.
+API_STATS = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+_api_stats_lock = threading.Lock()
+
+
+def _record_usage(response_json: dict):
+    usage = response_json.get("usage") or {}
+    job = current_job()
+    with _api_stats_lock:
+        for stats in (API_STATS, job) if job is not None else (API_STATS,):
+            stats["requests"] += 1
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                stats[key] += usage.get(key, 0)
+            # Prompt tokens the provider served from its prompt cache
+            stats["cached_tokens"] += (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+
+
+def api_stats_snapshot() -> dict:
+    with _api_stats_lock:
+        return dict(API_STATS)
+
+
+def extraction_stats(before: dict, start_time: float, mode: str) -> dict:
+    """
+    Return the requests, tokens, retries and wall time of the running job, and log them.
+
+    Outside of a job the process-wide counters since the before snapshot are used.
+    """
+    job = current_job()
+    if job is not None:
+        stats = {key: value for key, value in job.items() if key not in ("job", "started")}
+        stats["backoff_seconds"] = round(stats["backoff_seconds"], 2)
+    else:
+        after = api_stats_snapshot()
+        stats = {key: after[key] - before[key] for key in API_STATS}
+    stats["seconds"] = round(time.time() - start_time, 2)
+    stats["mode"] = mode
+    logger.info(
+        f"Extraction ({mode}): {stats['requests']} requests, {stats['total_tokens']} tokens "
+        f"({stats['prompt_tokens']} prompt, {stats.get('cached_tokens', 0)} of them cached, {stats['completion_tokens']} completion) "
+        f"in {stats['seconds']}s, "
+        f"{stats.get('retries', 0)} retries with {stats.get('backoff_seconds', 0)}s backoff, "
+        f"{stats.get('reducer_calls_skipped', 0)} reducer calls skipped, "
+        f"{stats.get('escalations', 0)} escalated to the large model"
+    )
+    return stats
+
+
+def resolve_extraction_mode(mode: str = None) -> str:
+    """
+    Return the extraction mode of an interactive extraction, the configured one by default.
+    """
+    mode = mode or EXTRACTION_MODE
+    if mode == "batch":
+        raise HTTPException(
+            status_code=400,
+            detail="The batch mode is only available offline, through python -m app.utils.batch_extract."
+        )
+    if mode not in INTERACTIVE_EXTRACTION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown extraction mode '{mode}', expected one of {list(INTERACTIVE_EXTRACTION_MODES)}."
+        )
+    return mode
+
+
 # OpenAI API Request
-def call_openai_api(payload: dict) -> dict:
+async def _read_stream(response, on_delta) -> dict:
+    """
+    Read a stream=true chat completion, pass every content delta to on_delta
+    and return the reply in the shape of a regular chat completion.
+    A refusal is not passed on, it ends up in the message's "refusal".
+    """
+    reply = {"id": None, "object": "chat.completion", "model": None, "usage": None}
+    content, refusal = [], []
+    finish_reason = None
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        reply["id"] = reply["id"] or chunk.get("id")
+        reply["model"] = reply["model"] or chunk.get("model")
+        if chunk.get("usage"):
+            reply["usage"] = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                content.append(delta["content"])
+                on_delta(delta["content"])
+            if delta.get("refusal"):
+                refusal.append(delta["refusal"])
+            finish_reason = choice.get("finish_reason") or finish_reason
+    message = {"role": "assistant", "content": "".join(content) if content or not refusal else None}
+    if refusal:
+        message["refusal"] = "".join(refusal)
+    reply["choices"] = [{"index": 0, "message": message, "finish_reason": finish_reason}]
+    return reply
+
+
+async def _send_openai_request(payload: dict, timeout: float = None, on_delta=None):
+    """
+    Send one chat completion request, without retries.
+
+    With on_delta the reply is streamed (stream=true) and every content delta
+    is passed to on_delta as it arrives; the result has the same shape either way.
+
+    Returns:
+    tuple: (response json or None, HTTPException or None, Retry-After seconds or None)
+    """
+    estimated_tokens = estimate_tokens(payload)
+    await request_scheduler.acquire(estimated_tokens)
+    used_tokens = None
     try:
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {get_api_key()}",
         }
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        if on_delta is None:
+            response = await openai_client.post("/chat/completions", json=payload, headers=headers, timeout=timeout)
+            if response.status_code != 200:
+                logger.error(f"OpenAI API Error: {response.text}")
+                error = HTTPException(status_code=response.status_code, detail=f"OpenAI API Error: {response.text}")
+                return None, error, parse_retry_after(response.headers)
+            response_json = response.json()
+        else:
+            stream_payload = dict(payload, stream=True, stream_options={"include_usage": True})
+            async with openai_client.stream("POST", "/chat/completions", json=stream_payload, headers=headers, timeout=timeout) as response:
+                if response.status_code != 200:
+                    text = (await response.aread()).decode("utf-8", "replace")
+                    logger.error(f"OpenAI API Error: {text}")
+                    error = HTTPException(status_code=response.status_code, detail=f"OpenAI API Error: {text}")
+                    return None, error, parse_retry_after(response.headers)
+                response_json = await _read_stream(response, on_delta)
+
+        _record_usage(response_json)
+        used_tokens = (response_json.get("usage") or {}).get("total_tokens")
+        return response_json, None, None
+    except httpx.TimeoutException as e:
+        logger.error(f"Timeout when waiting for OpenAI: {e!r}")
+        return None, HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="OpenAI request timed out."), None
+    except httpx.HTTPError as e:
+        logger.error(f"Network error when connecting to OpenAI: {e!r}")
+        return None, HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Unable to connect to OpenAI."), None
+    finally:
+        request_scheduler.release(estimated_tokens, used_tokens)
+
+
+async def call_openai_api_async(payload: dict, timeout: float = None, cache_as: str = None, on_delta=None) -> dict:
+    """
+    Send a chat completion request over the shared connection pool.
+
+    Must run on the client's event loop, e.g. through call_openai_api or a
+    coroutine passed to openai_client.run. Every request first waits for the
+    process-wide rate limits (see rate_limiter.request_scheduler).
+
+    Transient errors (429, 5xx, timeouts, connection errors) are retried up to
+    OPENAI_MAX_ATTEMPTS times with jittered exponential backoff, honouring
+    Retry-After, as long as the job's retry budget lasts. While the circuit
+    breaker is open requests fail fast with a 503.
+
+    Args:
+    cache_as: Name of the call site, recorded as the stage in the usage ledger.
+        When it is enabled in LLM_CACHE_FUNCTIONS, identical payloads are
+        answered from the response cache.
+    on_delta: Stream the reply and call on_delta with every piece of content
+        as it arrives (a cached reply is passed in one piece). When a request
+        is retried after part of its reply was streamed, on_delta(None) is
+        called before the reply streams again from the start, so the caller
+        can drop what it got so far.
+    """
+    job = current_job()
+    streamed = [False]
+    if on_delta is not None:
+        relay = on_delta
+
+        def on_delta(text):
+            streamed[0] = True
+            relay(text)
+
+    model = payload.get("model")
+    use_cache = cache_as is not None and response_cache.enabled(cache_as)
+    if use_cache:
+        key = cache_key(payload)
+        if not response_cache.bypassed():
+            cached = await asyncio.to_thread(response_cache.get, cache_as, key)
+            if cached is not None:
+                if job is not None:
+                    job["cache_hits"] += 1
+                usage_ledger.record(cached, stage=cache_as, model=model, from_cache=True)
+                if on_delta is not None:
+                    on_delta(cached['choices'][0]['message'].get('content') or "")
+                return cached
+    start_time = time.monotonic()
+
+    for attempt in range(OPENAI_MAX_ATTEMPTS):
+        if not circuit_breaker.allow():
+            if job is not None:
+                job["circuit_rejections"] += 1
+            usage_ledger.record(
+                stage=cache_as, model=model, latency=time.monotonic() - start_time, retries=attempt,
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"OpenAI is unavailable, not retrying for another {circuit_breaker.retry_in():.0f}s."
+            )
+
+        try:
+            response_json, error, retry_after = await _send_openai_request(payload, timeout, on_delta)
+        except Exception:
+            # E.g. a reply that is not valid JSON, the upstream did not give a usable answer
+            circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled, no verdict on the upstream, but a half-open probe must not stay taken
+            circuit_breaker.release()
+            raise
+        if error is None:
+            circuit_breaker.record_success()
+            latency = time.monotonic() - start_time
+            usage_ledger.record(response_json, stage=cache_as, model=model, latency=latency, retries=attempt)
+            if use_cache:
+                await asyncio.to_thread(response_cache.put, cache_as, key, response_json, latency)
+            return response_json
+
+        # 429s and client errors mean the upstream itself is up
+        if error.status_code >= 500:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+
+        retryable = error.status_code in RETRYABLE_STATUS_CODES
+        out_of_budget = job is not None and job["retries"] >= job["retry_budget"]
+        if not retryable or attempt == OPENAI_MAX_ATTEMPTS - 1 or out_of_budget:
+            if job is not None:
+                job["failed_requests"] += 1
+            if retryable and out_of_budget:
+                logger.error(f"Retry budget of job {job['job']} used up, giving up on this request.")
+            usage_ledger.record(
+                stage=cache_as, model=model, latency=time.monotonic() - start_time, retries=attempt,
+                status_code=error.status_code
+            )
+            raise error
+
+        delay = backoff_delay(attempt, retry_after)
+        if error.status_code == 429:
+            # Everyone else would run into the same limit, so hold back all requests
+            request_scheduler.pause(delay)
+        if job is not None:
+            job["retries"] += 1
+            job["backoff_seconds"] += delay
+        logger.warning(f"OpenAI request failed with {error.status_code}, retry {attempt + 1} in {delay:.1f}s.")
+        if streamed[0]:
+            relay(None)
+            streamed[0] = False
+        await asyncio.sleep(delay)
+
+
+def call_openai_api(payload: dict, timeout: float = None, cache_as: str = None, on_delta=None) -> dict:
+    """
+    Synchronous facade of call_openai_api_async for code that is not async.
 
-        if response.status_code != 200:
-            logger.error(f"OpenAI API Error: {response.text}")
-            raise HTTPException(status_code=response.status_code, detail=f"OpenAI API Error: {response.text}")
+    on_delta is called on the client's event loop, it must not block.
+    """
+    return openai_client.run(call_openai_api_async(payload, timeout, cache_as, on_delta))
 
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Network error when connecting to OpenAI: {e}")
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Unable to connect to OpenAI.")
 
+def call_structured(payload: dict, output_model: type, cache_as: str = None, on_delta=None, reasks: int = None):
+    """
+    Send a request whose reply must match the JSON schema of output_model and return the validated reply.
 
-def send_to_gpt(encoded_images: list, prompt):
-    responses = []
+    A reply that does not validate (or was cut off) is not retried as is: the
+    same conversation is sent again with the invalid reply and what is wrong
+    with it, up to reasks (default OPENAI_SCHEMA_REASKS) times. Only this one call is repeated.
+    With on_delta, every re-ask is announced with on_delta(None) (see call_openai_api_async).
+    """
+    reasks = OPENAI_SCHEMA_REASKS if reasks is None else reasks
+    payload = dict(payload, response_format=response_format(output_model))
+    job = current_job()
+    for attempt in range(reasks + 1):
+        response_json = call_openai_api(payload=payload, cache_as=cache_as, on_delta=on_delta)
+        choice = response_json['choices'][0]
+        message = choice['message']
+        if message.get("refusal"):
+            logger.error(f"OpenAI refused the {output_model.__name__} request: {message['refusal']}")
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"OpenAI refused the request: {message['refusal']}")
+        content = message.get("content") or ""
+        try:
+            return output_model.model_validate_json(content)
+        except ValidationError as e:
+            problems = validation_summary(e)
+            if choice.get("finish_reason") == "length":
+                problems = "the reply was cut off, keep it shorter"
+        logger.warning(f"{output_model.__name__} reply does not match its schema (attempt {attempt + 1}): {problems}")
+        if attempt == reasks:
+            break
+        if job is not None:
+            job["schema_reasks"] += 1
+        if on_delta is not None:
+            on_delta(None)
+        payload = dict(payload, messages=payload["messages"] + [
+            {"role": "assistant", "content": content},
+            {
+                "role": "user",
+                "content": f"Your reply does not match the required JSON schema ({problems}). "
+                           f"Reply again with the complete, corrected JSON object only."
+            }
+        ])
+    raise HTTPException(
+        status_code=status.HTTP_502_BAD_GATEWAY,
+        detail=f"OpenAI did not return a valid {output_model.__name__} after {reasks} re-asks."
+    )
 
-    def process_image(encoded_image, index):
-        print(f"Processing image {index + 1}")
-        payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": prompt
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{encoded_image}"
-                            }
-                        }
-                    ]
-                }
-            ]
+
+def call_routed(payload: dict, output_model: type, cache_as: str, field: str = None, on_delta=None):
+    """
+    Send a structured request (see call_structured) to the model tier of its call site and field.
+
+    On the small tier the reply also reports the model's confidence. A reply
+    that does not validate or whose confidence is below MODEL_ESCALATION_CONFIDENCE
+    is not re-asked but sent to the large model, which gets the original request.
+    The model of the payload is replaced by the one of the tier. With on_delta,
+    an escalation is announced with on_delta(None) (see call_openai_api_async).
+
+    Args:
+    cache_as: Name of the call site, the stage of the routing table (see model_router).
+    field: Field of the routing table, defaults to the field of the usage ledger.
+    """
+    field = field if field is not None else current_ledger_field()
+    tier = route(cache_as, field)
+    if tier == "small":
+        messages = list(payload["messages"])
+        messages[0] = dict(messages[0], content=messages[0]["content"] + CONFIDENCE_NOTE)
+        small_payload = dict(payload, model=MODEL_TIERS["small"], messages=messages)
+        start_time = time.monotonic()
+        try:
+            reply = call_structured(small_payload, with_confidence(output_model), cache_as=cache_as, on_delta=on_delta, reasks=0)
+            escalated = None if reply.confidence >= MODEL_ESCALATION_CONFIDENCE else "low_confidence"
+        except HTTPException as e:
+            # Invalid or refused replies, anything else (rate limits, outages) would hit the large model as well
+            if e.status_code != status.HTTP_502_BAD_GATEWAY:
+                raise
+            escalated = "invalid"
+        routing_stats.record(cache_as, field, "small", time.monotonic() - start_time, escalated)
+        if escalated is None:
+            return output_model.model_validate(reply.model_dump(exclude={"confidence"}))
+        name = f"{cache_as} ({field})" if field is not None else cache_as
+        logger.info(f"Escalating {name} to {MODEL_TIERS['large']}: {escalated.replace('_', ' ')}.")
+        job = current_job()
+        if job is not None:
+            with _api_stats_lock:
+                job["escalations"] += 1
+        if on_delta is not None:
+            on_delta(None)
+
+    start_time = time.monotonic()
+    with ledger_escalation(tier == "small"):
+        reply = call_structured(dict(payload, model=MODEL_TIERS["large"]), output_model, cache_as=cache_as, on_delta=on_delta)
+    routing_stats.record(cache_as, field, "large", time.monotonic() - start_time)
+    return reply
+
+
+def page_content(page) -> list:
+    """
+    Build the user message content for one page.
+
+    Text-rich pages (see encode_pages) are sent as their text layer, which is
+    far smaller and cheaper than the image. Everything else is sent as image,
+    either a data URL carrying its own MIME type or plain base64 (JPEG).
+    """
+    if isinstance(page, dict):
+        return [
+            {
+                "type": "text",
+                "text": f"Text content of a PDF page:\n\n{page['text']}"
+            }
+        ]
+    return [
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": page if page.startswith("data:") else f"data:image/jpeg;base64,{page}"
+            }
         }
-        response_json = call_openai_api(payload=payload)
-        assistant_message = response_json['choices'][0]['message']['content']
-        # print("Assistant msg:", assistant_message)
-        responses.append(assistant_message)
+    ]
+
+
+def page_model() -> str:
+    """
+    Model of the page requests of the current field (see model_router), also part of the page store key.
+    """
+    return model_for("page", current_ledger_field())
+
+
+def page_payload(page, prompt: str) -> dict:
+    """
+    Chat completion request for one page (base64 image or text page) with the given system prompt.
+    """
+    return {
+        "model": page_model(),
+        "messages": [
+            {
+                "role": "system",
+                "content": prompt
+            },
+            {
+                "role": "user",
+                "content": page_content(page)
+            }
+        ]
+    }
+
+
+async def gpt_page_response_async(page, prompt: str) -> str:
+    """
+    Send one page (base64 image or text page) with the given system prompt and return the reply text.
+    """
+    payload = page_payload(page, prompt)
+    response_json = await call_openai_api_async(payload=payload, cache_as="page")
+    return response_json['choices'][0]['message']['content']
+
+
+def gpt_page_response(page, prompt: str) -> str:
+    return openai_client.run(gpt_page_response_async(page, prompt))
+
+
+async def _gather_pages(encoded_images: list, handle_page, concurrency: int = None) -> list:
+    # Runs handle_page(encoded_image, index) for all pages with at most `concurrency` in flight.
+    # Failed pages are logged and returned as exceptions, results keep the page order.
+    semaphore = asyncio.Semaphore(concurrency or SEND_TO_GPT_CONCURRENCY)
 
-    # Using ThreadPoolExecutor to manage threads
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        for i, encoded_image in enumerate(encoded_images):
-            executor.submit(process_image, encoded_image, i)
+    async def limited(encoded_image, index):
+        async with semaphore:
+            return await handle_page(encoded_image, index)
 
+    results = await asyncio.gather(
+        *(limited(encoded_image, i) for i, encoded_image in enumerate(encoded_images)),
+        return_exceptions=True
+    )
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to process image {i + 1}: {result!r}")
+    return results
+
+
+def _page_replies(encoded_images: list, prompt) -> dict:
+    async def process_image(encoded_image, index):
+        print(f"Processing image {index + 1}")
+        return await gpt_page_response_async(encoded_image, prompt)
+
+    # All pages share the pooled client, failed pages are left out as before
+    results = openai_client.run(_gather_pages(encoded_images, process_image))
+    return {index: result for index, result in enumerate(results) if not isinstance(result, Exception)}
+
+
+def _send_stored(encoded_images: list, prompt: str, field: str, send_pages) -> list:
+    """
+    Return the replies of all pages in page order, sending only the pages that
+    have no result in the job's page store (see page_store) yet.
+
+    While the response cache is bypassed (no_cache) every page is sent again,
+    and the fresh replies replace the stored ones.
+
+    Args:
+    send_pages (callable): Sends a list of pages and returns page index -> reply.
+    field (str): Field the results are stored under, the store is not used when None.
+    """
+    store = current_page_store() if field is not None else None
+    model = page_model()
+    if store is None or response_cache.bypassed():
+        replies = send_pages(encoded_images)
+        if store is not None:
+            for index, reply in replies.items():
+                store.put(encoded_images[index], prompt, field, model, reply)
+            store.save()
+        return [replies[index] for index in sorted(replies)]
+
+    missing = store.missing(encoded_images, prompt, field, model)
+    if missing:
+        pages = [encoded_images[index] for index in missing]
+        for index, reply in send_pages(pages).items():
+            store.put(pages[index], prompt, field, model, reply)
+        store.save()
+    reused = len(encoded_images) - len(missing)
+    if reused:
+        logger.info(f"Reused {reused} of {len(encoded_images)} stored page results for {field}.")
+        job = current_job()
+        if job is not None:
+            with _api_stats_lock:
+                job["page_results_reused"] += reused
+    return store.results(encoded_images, prompt, field, model)
+
+
+def send_to_gpt(encoded_images: list, prompt, field: str = None):
+    responses = _send_stored(encoded_images, prompt, field, lambda pages: _page_replies(pages, prompt))
     logger.info("Successfully processed images and generated responses.")
     return responses
 
 
+PACKED_INSTRUCTIONS = """
+
+You will receive several pages at once, each introduced by its page number ("Page 1", "Page 2", ...).
+Answer every page on its own, as if it was the only page you received.
+Respond with a JSON object of the form {"pages": [{"page": 1, "answer": "..."}, ...]} with one entry per page.
+"""
+
+
+def page_tokens(page) -> int:
+    return estimate_tokens({"messages": [{"role": "user", "content": page_content(page)}], "max_tokens": 0})
+
+
+def pack_pages(pages: list, max_images: int = None, max_tokens: int = None) -> list:
+    """
+    Group consecutive pages into packs of at most max_images pages and max_tokens input tokens.
+
+    Returns:
+    list: packs, each a list of (page index, page)
+    """
+    max_images = max_images or PACK_MAX_IMAGES
+    max_tokens = max_tokens or PACK_MAX_TOKENS
+    packs, pack, pack_tokens = [], [], 0
+    for index, page in enumerate(pages):
+        tokens = page_tokens(page)
+        if pack and (len(pack) >= max_images or pack_tokens + tokens > max_tokens):
+            packs.append(pack)
+            pack, pack_tokens = [], 0
+        pack.append((index, page))
+        pack_tokens += tokens
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+async def gpt_pack_response_async(pack: list, prompt: str) -> dict:
+    """
+    Send a pack of pages in one request and return page index -> reply text.
+
+    Pages the reply has no answer for are missing from the result.
+    """
+    content = []
+    for number, (_, page) in enumerate(pack, start=1):
+        content.append({"type": "text", "text": f"Page {number}:"})
+        content.extend(page_content(page))
+    payload = {
+        "model": page_model(),
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {
+                "role": "system",
+                "content": prompt + PACKED_INSTRUCTIONS
+            },
+            {
+                "role": "user",
+                "content": content
+            }
+        ],
+        "max_tokens": 4095
+    }
+    response_json = await call_openai_api_async(payload=payload, cache_as="page")
+    reply = response_json['choices'][0]['message']['content']
+    try:
+        answers = json.loads(reply).get("pages") or []
+    except (ValueError, AttributeError):
+        logger.warning(f"Packed reply is not valid JSON: {reply[:200]}")
+        answers = []
+    result = {}
+    for answer in answers:
+        if not isinstance(answer, dict):
+            continue
+        number = answer.get("page")
+        if isinstance(number, int) and 1 <= number <= len(pack) and answer.get("answer") is not None:
+            value = answer["answer"]
+            result[pack[number - 1][0]] = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    return result
+
+
+def _packed_replies(encoded_images: list, prompt, max_images: int = None, max_tokens: int = None) -> dict:
+    packs = pack_pages(encoded_images, max_images, max_tokens)
+
+    async def process_pack(pack, index):
+        return await gpt_pack_response_async(pack, prompt)
+
+    async def run():
+        results = await _gather_pages(packs, process_pack)
+        replies = {}
+        for result in results:
+            if not isinstance(result, Exception):
+                replies.update(result)
+        missing = [index for index in range(len(encoded_images)) if index not in replies]
+        if missing:
+            logger.info(f"{len(missing)} pages were not answered in their pack, sending them one by one.")
+
+            async def process_image(index, _):
+                return index, await gpt_page_response_async(encoded_images[index], prompt)
+
+            for result in await _gather_pages(missing, process_image):
+                if not isinstance(result, Exception):
+                    replies[result[0]] = result[1]
+        return replies
+
+    replies = openai_client.run(run())
+    logger.info(f"Packed {len(encoded_images)} pages into {len(packs)} requests.")
+    return replies
+
+
+def send_packed_to_gpt(encoded_images: list, prompt, max_images: int = None, max_tokens: int = None, field: str = None):
+    """
+    Packed counterpart of send_to_gpt: several pages go into one request, but
+    every page is still answered on its own and the replies come back in page
+    order. Pages missing from a packed reply are sent again one by one.
+    """
+    return _send_stored(encoded_images, prompt, field, lambda pages: _packed_replies(pages, prompt, max_images, max_tokens))
+
+
+def send_field_to_gpt(encoded_images: list, field: str):
+    """
+    Send the pages with the prompt of a field, packed when the field is in PACKED_FIELDS.
+    """
+    if field in PACKED_FIELDS and len(encoded_images) > 1:
+        return send_packed_to_gpt(encoded_images, FIELD_PROMPTS[field], field=field)
+    return send_to_gpt(encoded_images, FIELD_PROMPTS[field], field=field)
+
+
 # def extract_project_title(encoded_images: list):
 #     prompt = """
 #     Extract the title of the project from the provided images. The project title should be the primary name or designation of the construction or development project.
@@ -231,120 +863,320 @@ def send_to_gpt(encoded_images: list, prompt):
 #     return send_to_gpt(encoded_images, prompt)
 
 
-# Separate prompt for each new field
-def extract_location_within_building_zone(encoded_images: list):
-    prompt = """
+# Separate prompt for each new field, keyed by the field name used in `mapping`
+FIELD_PROMPTS = {
+    "location_within_building_zone": """
     Just Extract the location of the project within the designated building zone from the images. Provide details of any specific zoning requirements or compliance factors.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    """,
+    "building_use_type": """
+    Extract the building use type from the images. Specify whether the building is residential, commercial, industrial, or mixed-use.
+    """,
+    "building_style": """
+    Extract the building style from the images. Provide information on architectural design or stylistic features.
+    """,
+    "grz": """
+    Extract information on GRZ (Ground Area Ratio) compliance from the images. Indicate whether the project adheres to zoning regulations.
+    """,
+    "gfz": """
+    Extract information on GFZ (Floor Area Ratio) compliance from the images. Indicate whether the project meets zoning requirements.
+    """,
+    "building_height": """
+    Extract the compliance status for the building height. Check if the height adheres to zoning and regulatory limits.
+    """,
+    "number_of_floors": """
+    Extract information about the compliance of the number of floors with zoning regulations. Specify any discrepancies.
+    """,
+    "roof_shape": """
+    Extract compliance details for the roof shape. Provide information on whether the roof meets zoning and design standards.
+    """,
+    "dormers": """
+    Extract details about compliance related to dormers. Indicate if they meet the relevant zoning and design criteria.
+    """,
+    "roof_orientation": """
+    Extract compliance details for roof orientation. Check if the orientation adheres to building or zoning regulations.
+    """,
+    "parking_spaces": """
+    Extract compliance information for parking spaces. Indicate whether the number and type of parking spaces meet regulations.
+    """,
+    "outdoor_space": """
+    Extract compliance information for outdoor spaces. Include details on landscaping or open space requirements.
+    """,
+    "setback_area": """
+    Extract compliance information for setback areas. Indicate whether the project adheres to setback regulations.
+    """,
+    "setback_relevant_filling_work": """
+    Extract details of any filling work relevant to setback areas. Indicate if it complies with regulations.
+    """,
+    "deviations_from_b_plan": """
+    Extract details of any deviations from the B-Plan (Building Plan). Highlight any areas of non-compliance.
+    """,
+    "exemptions_required": """
+    Extract details about any exemptions required for the project. Indicate specific regulations or codes needing exemptions.
+    """,
+    "species_protection_check": """
+    Extract information on species protection checks conducted for the project. Indicate any ecological considerations.
+    """,
+    "compliance_with_zoning_rules": """
+    Extract information on compliance with zoning rules. Specify whether the project adheres to all zoning regulations.
+    """,
+    "compliance_with_building_codes": """
+    Extract information on compliance with building codes. Highlight any specific codes or standards met or violated.
+    """,
+}
+
+# Field descriptions passed to final_fields, where they differ from the field name
+FIELD_LABELS = {
+    "grz": "grz of the building",
+    "gfz": "gfz of the building",
+}
+
+def extract_location_within_building_zone(encoded_images: list):
+    return send_field_to_gpt(encoded_images, "location_within_building_zone")
 
 def extract_building_use_type(encoded_images: list):
-    prompt = """
-    Extract the building use type from the images. Specify whether the building is residential, commercial, industrial, or mixed-use.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "building_use_type")
 
 def extract_building_style(encoded_images: list):
-    prompt = """
-    Extract the building style from the images. Provide information on architectural design or stylistic features.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "building_style")
 
 def extract_grz_compliance(encoded_images: list):
-    prompt = """
-    Extract information on GRZ (Ground Area Ratio) compliance from the images. Indicate whether the project adheres to zoning regulations.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "grz")
 
 def extract_gfz_compliance(encoded_images: list):
-    prompt = """
-    Extract information on GFZ (Floor Area Ratio) compliance from the images. Indicate whether the project meets zoning requirements.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "gfz")
 
 def extract_building_height_compliance(encoded_images: list):
-    prompt = """
-    Extract the compliance status for the building height. Check if the height adheres to zoning and regulatory limits.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "building_height")
 
 def extract_number_of_floors_compliance(encoded_images: list):
-    prompt = """
-    Extract information about the compliance of the number of floors with zoning regulations. Specify any discrepancies.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "number_of_floors")
 
 def extract_roof_shape_compliance(encoded_images: list):
-    prompt = """
-    Extract compliance details for the roof shape. Provide information on whether the roof meets zoning and design standards.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "roof_shape")
 
 def extract_dormers_compliance(encoded_images: list):
-    prompt = """
-    Extract details about compliance related to dormers. Indicate if they meet the relevant zoning and design criteria.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "dormers")
 
 def extract_roof_orientation_compliance(encoded_images: list):
-    prompt = """
-    Extract compliance details for roof orientation. Check if the orientation adheres to building or zoning regulations.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "roof_orientation")
 
 def extract_parking_spaces_compliance(encoded_images: list):
-    prompt = """
-    Extract compliance information for parking spaces. Indicate whether the number and type of parking spaces meet regulations.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "parking_spaces")
 
 def extract_outdoor_space_compliance(encoded_images: list):
-    prompt = """
-    Extract compliance information for outdoor spaces. Include details on landscaping or open space requirements.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "outdoor_space")
 
 def extract_setback_area_compliance(encoded_images: list):
-    prompt = """
-    Extract compliance information for setback areas. Indicate whether the project adheres to setback regulations.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "setback_area")
 
 def extract_setback_relevant_filling_work(encoded_images: list):
-    prompt = """
-    Extract details of any filling work relevant to setback areas. Indicate if it complies with regulations.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "setback_relevant_filling_work")
 
 def extract_deviations_from_b_plan(encoded_images: list):
-    prompt = """
-    Extract details of any deviations from the B-Plan (Building Plan). Highlight any areas of non-compliance.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "deviations_from_b_plan")
 
 def extract_exemptions_required(encoded_images: list):
-    prompt = """
-    Extract details about any exemptions required for the project. Indicate specific regulations or codes needing exemptions.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "exemptions_required")
 
 def extract_species_protection_check(encoded_images: list):
-    prompt = """
-    Extract information on species protection checks conducted for the project. Indicate any ecological considerations.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "species_protection_check")
 
 def extract_compliance_with_zoning_rules(encoded_images: list):
-    prompt = """
-    Extract information on compliance with zoning rules. Specify whether the project adheres to all zoning regulations.
-    """
-    return send_to_gpt(encoded_images, prompt)
+    return send_field_to_gpt(encoded_images, "compliance_with_zoning_rules")
 
 def extract_compliance_with_building_codes(encoded_images: list):
-    prompt = """
-    Extract information on compliance with building codes. Highlight any specific codes or standards met or violated.
+    return send_field_to_gpt(encoded_images, "compliance_with_building_codes")
+
+
+# Field -> extractor, in the order of the extracted_fields result
+FIELD_EXTRACTORS = {
+    "location_within_building_zone": extract_location_within_building_zone,
+    "building_use_type": extract_building_use_type,
+    "building_style": extract_building_style,
+    "grz": extract_grz_compliance,
+    "gfz": extract_gfz_compliance,
+    "building_height": extract_building_height_compliance,
+    "number_of_floors": extract_number_of_floors_compliance,
+    "roof_shape": extract_roof_shape_compliance,
+    "dormers": extract_dormers_compliance,
+    "roof_orientation": extract_roof_orientation_compliance,
+    "parking_spaces": extract_parking_spaces_compliance,
+    "outdoor_space": extract_outdoor_space_compliance,
+    "setback_area": extract_setback_area_compliance,
+    "setback_relevant_filling_work": extract_setback_relevant_filling_work,
+    "deviations_from_b_plan": extract_deviations_from_b_plan,
+    "exemptions_required": extract_exemptions_required,
+    "species_protection_check": extract_species_protection_check,
+    "compliance_with_zoning_rules": extract_compliance_with_zoning_rules,
+    "compliance_with_building_codes": extract_compliance_with_building_codes,
+}
+
+
+def extract_fields(pages_for_field, analysis_pages: list = None) -> tuple:
+    """
+    Run the field extractions, their reducers and optionally the analysis pass concurrently.
+
+    The fields no longer wait for each other; how many requests actually run
+    at once is left to the process-wide request_scheduler.
+
+    Args:
+    pages_for_field (callable): Returns the pages to send for a field.
+    analysis_pages (list): Pages for the SYSTEM_PROMPT analysis pass, skipped when None.
+
+    Returns:
+    tuple: (field -> reduced value, reduced analysis or None)
+    """
+    def run_field(field):
+        return reduce_field(field, FIELD_EXTRACTORS[field](pages_for_field(field)))
+
+    def run_analysis():
+        return final_response(responses=send_to_gpt(analysis_pages, prompt=SYSTEM_PROMPT, field="analysis"))
+
+    with ThreadPoolExecutor(max_workers=len(FIELD_EXTRACTORS) + 1) as executor:
+        futures = {field: submit_in_context(executor, in_field, field, run_field, field) for field in FIELD_EXTRACTORS}
+        analysis = submit_in_context(executor, in_field, "analysis", run_analysis) if analysis_pages is not None else None
+        result = {field: future.result() for field, future in futures.items()}
+        return result, analysis.result() if analysis is not None else None
+
+
+def combined_prompt(fields, analysis: bool = False) -> str:
+    """
+    Build the single-pass prompt that answers all given fields (and optionally
+    the general analysis) for one page as a JSON record.
     """
-    return send_to_gpt(encoded_images, prompt)
+    keys = list(fields) + (["analysis"] if analysis else [])
+    field_instructions = "\n".join(f'- "{field}": {" ".join(FIELD_PROMPTS[field].split())}' for field in fields)
+    prompt = f"""You are a construction compliance assistant. You will receive one page of a building application, either as an image or as its text. Extract the details this page contains for every field listed below in a single pass.
+
+Respond with a JSON object with exactly these keys: {", ".join(f'"{key}"' for key in keys)}.
+The value of every key is a string with the details this page contains for that field, following the instructions of the field. Use an empty string when the page contains nothing about a field.
+
+Fields:
+{field_instructions}"""
+    if analysis:
+        prompt += f"""
+- "analysis": The general extraction of this page as plain text, following these instructions:
+{SYSTEM_PROMPT}"""
+    return prompt
+
+
+async def gpt_page_record_async(page, fields, analysis: bool = False) -> dict:
+    """
+    Send one page with the combined prompt and return its record, field -> details.
+
+    Fields missing from the reply, or a reply that is not valid JSON, end up
+    as empty strings so that one bad page does not fail the whole run.
+    """
+    keys = list(fields) + (["analysis"] if analysis else [])
+    payload = {
+        "model": page_model(),
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {
+                "role": "system",
+                "content": combined_prompt(fields, analysis)
+            },
+            {
+                "role": "user",
+                "content": page_content(page)
+            }
+        ],
+        "max_tokens": 4095
+    }
+    response_json = await call_openai_api_async(payload=payload, cache_as="page")
+    content = response_json['choices'][0]['message']['content']
+    try:
+        reply = json.loads(content)
+    except ValueError:
+        logger.warning(f"Page record is not valid JSON, ignoring it: {content[:200]}")
+        reply = {}
+    record = {}
+    for key in keys:
+        value = reply.get(key) if isinstance(reply, dict) else None
+        if value is None:
+            value = ""
+        record[key] = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    return record
+
+
+def gpt_page_record(page, fields, analysis: bool = False) -> dict:
+    return openai_client.run(gpt_page_record_async(page, fields, analysis))
+
+
+def send_records_to_gpt(encoded_images: list, fields, analysis: bool = False) -> list:
+    """
+    Single-pass counterpart of send_to_gpt: every page is sent once and a
+    record covering all fields is returned per page, in page order.
+    """
+    def send_pages(pages):
+        async def process_image(encoded_image, index):
+            return await gpt_page_record_async(encoded_image, fields, analysis)
+
+        results = openai_client.run(_gather_pages(pages, process_image))
+        return {index: result for index, result in enumerate(results) if not isinstance(result, Exception)}
+
+    records = _send_stored(encoded_images, combined_prompt(fields, analysis), "record", send_pages)
+    logger.info(f"Extracted {len(records)} page records in a single pass.")
+    return records
+
+
+def reduce_field_responses(responses_by_field: dict) -> dict:
+    """
+    Feed the page responses of each field into the field reducer (see reduce_field).
+    The reducers of all fields run concurrently.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(responses_by_field), 1)) as executor:
+        futures = {
+            field: submit_in_context(executor, in_field, field, reduce_field, field, responses)
+            for field, responses in responses_by_field.items()
+        }
+        return {field: future.result() for field, future in futures.items()}
+
+def reduce_page_records(records: list, fields) -> dict:
+    """
+    Feed the per-page records of each field into the field reducer (final_fields).
+    """
+    return reduce_field_responses({field: [record[field] for record in records if record.get(field)] for field in fields})
+
+
+def add_page_requests(batch: BatchJob, pages_for_field, analysis_pages: list = None, prefix: str = ""):
+    """
+    Write the per_field page requests of one document into a batch job.
+
+    Args:
+    pages_for_field: Callable returning the pages to send for a field, as for extract_fields.
+    analysis_pages: Pages to send with the analysis prompt, or None to skip the analysis.
+    prefix: Prepended to every custom_id, to tell documents sharing a batch apart.
+    """
+    # Under the field, so that page_payload picks the field's page model (see model_router)
+    for field, prompt in FIELD_PROMPTS.items():
+        with ledger_field(field):
+            for index, page in enumerate(pages_for_field(field)):
+                batch.add(f"{prefix}{field}/{index}", page_payload(page, prompt))
+    with ledger_field("analysis"):
+        for index, page in enumerate(analysis_pages or []):
+            batch.add(f"{prefix}analysis/{index}", page_payload(page, SYSTEM_PROMPT))
+
+
+def collect_page_responses(results: dict, prefix: str = "") -> dict:
+    """
+    Sort the batch results of one document back into per-field reply lists in page order.
+
+    Returns:
+    dict: field (and "analysis") -> reply texts, failed requests are left out as in send_to_gpt
+    """
+    responses = {field: [] for field in list(FIELD_PROMPTS) + ["analysis"]}
+    for custom_id, response_json in results.items():
+        if not custom_id.startswith(prefix):
+            continue
+        field, index = custom_id[len(prefix):].rsplit("/", 1)
+        if field not in responses:
+            continue
+        _record_usage(response_json)
+        with ledger_field(field):
+            usage_ledger.record(response_json, stage="page", batch=True)
+        responses[field].append((int(index), response_json['choices'][0]['message']['content']))
+    return {field: [content for _, content in sorted(replies)] for field, replies in responses.items()}
 
 
 def final_response(responses:list):
@@ -363,7 +1195,7 @@ def final_response(responses:list):
     """
     responses = " ".join([response for response in responses])
     payload = {
-            "model": "gpt-4o",
+            "model": model_for("final_response"),
             "messages": [
                 {
                     "role": "system",
@@ -382,103 +1214,170 @@ def final_response(responses:list):
             "max_tokens": 4095
         }
     # Send the request to the OpenAI API
-    response_json = call_openai_api(payload=payload)
+    with ledger_field("analysis"):
+        summary = call_routed(payload, AnalysisSummary, cache_as="final_response")
+
+    # Keyed by the labels of the format above, as stored in the analysis result
+    return {ANALYSIS_LABELS[key]: value for key, value in summary.model_dump().items()}
+
+def text_tokens(text: str) -> int:
+    return estimate_tokens({"messages": [{"role": "user", "content": text}], "max_tokens": 0})
+
+
+def chunk_responses(responses: list, max_tokens: int = None, fan_in: int = None) -> list:
+    """
+    Group consecutive replies into chunks of at most fan_in replies and max_tokens tokens.
+    """
+    max_tokens = max_tokens or REDUCE_CHUNK_TOKENS
+    fan_in = max(fan_in or REDUCE_FAN_IN, 2)
+    chunks, chunk, chunk_tokens = [], [], 0
+    for response in responses:
+        tokens = text_tokens(response)
+        if chunk and (len(chunk) >= fan_in or chunk_tokens + tokens > max_tokens):
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(response)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def tree_reduce(responses: list, reduce_chunk, max_tokens: int = None, fan_in: int = None):
+    """
+    Reduce page replies hierarchically so that no reducer request outgrows its token budget.
+
+    The replies are split into chunks (see chunk_responses) that are reduced
+    concurrently, then the partial results are chunked and reduced the same
+    way, until everything fits into one request. Replies that fit into one
+    chunk are reduced with a single request, as before.
+
+    Args:
+    reduce_chunk (callable): Reduces a chunk, called as reduce_chunk(replies, level) where
+        level is 0 for page replies and counts up for partial results. Returns a string.
+
+    Returns:
+    The result of the last reduce_chunk call.
+    """
+    level = 0
+    while True:
+        chunks = chunk_responses(responses, max_tokens, fan_in)
+        if len(chunks) <= 1:
+            return reduce_chunk(chunks[0] if chunks else [], level)
+        if len(chunks) == len(responses):
+            # Every reply fills a chunk on its own, pair them up so the tree still shrinks
+            chunks = [responses[index:index + 2] for index in range(0, len(responses), 2)]
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [submit_in_context(executor, reduce_chunk, chunk, level) for chunk in chunks]
+            responses = [future.result() for future in futures]
+        logger.info(f"Reduced {sum(len(chunk) for chunk in chunks)} replies to {len(responses)} partial results (level {level}).")
+        level += 1
+
+
+def reduce_field(field: str, responses: list) -> str:
+    """
+    Reduce the page replies of a field to one value.
+
+    Numeric fields whose replies agree on a value (see numeric_reducer) are
+    consolidated locally, everything else goes to the final_fields reducer.
+    """
+    value = consolidate_numeric(field, responses)
+    if value is None:
+        return final_fields(responses=responses, field=FIELD_LABELS.get(field, field))
+    logger.info(f"Consolidated {field} locally from {len(responses)} page replies: {value}")
+    job = current_job()
+    if job is not None:
+        with _api_stats_lock:
+            job["reducer_calls_skipped"] += 1
+    return value
+
+
+# The field goes into the user message, so the system prompt is the same for every
+# field and the provider's prompt cache can reuse it
+FINAL_FIELDS_PROMPT = "You will recieve the name of a field and a list of responses realted to it. Your task is to select the most appropriate and accurate detail from it. Choose only an accurate single value based on details instead of multiple. I don't need extra details just provide the important details without providing extra explanation."
 
-    # Extract the assistant's message from the response
-    assistant_message = response_json['choices'][0]['message']['content']
-    response = parse_response_data(assistant_message.replace("**",""))
-    return response
 
 def final_fields(responses:list, field:str):
-    prompt = f"You will recieve a list of responses realted to {field}. Your task is to select the most appropriate and accurate detail from it. Choose only an accurate single value based on details instead of multiple. I don't need extra details just provide the important details without providing extra explanation."
-    responses = " ".join([response for response in responses])
-    payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": prompt
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": responses
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 4095
-        }
-    # Send the request to the OpenAI API
-    response_json = call_openai_api(payload=payload)
+    def reduce_chunk(chunk, level):
+        payload = {
+                "model": model_for("final_fields"),
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": FINAL_FIELDS_PROMPT
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": f"Field: {field}"
+                            },
+                            {
+                                "type": "text",
+                                "text": " ".join([response for response in chunk])
+                            }
+                        ]
+                    }
+                ],
+                "max_tokens": 4095
+            }
+        # Send the request to the OpenAI API
+        return call_routed(payload, FieldValue, cache_as="final_fields").value
 
-    # Extract the assistant's message from the response
-    assistant_message = response_json['choices'][0]['message']['content']
-    # response = parse_response_data(assistant_message.replace("**",""))
-    return assistant_message
+    # Partial results are selections themselves, so every level uses the same prompt
+    return tree_reduce(responses, reduce_chunk)
+
+
+def triage_candidates(images_path: str, page_files: list, encoded_images: list):
+    """
+    Return a pages_for_field callable that only sends each field's prompt to the pages that are candidates for it.
+    """
+    triage = load_triage_index(images_path)
+    log_triage_savings(triage, page_files, FIELD_PROMPTS)
+
+    def candidates(field):
+        return select_pages(triage, field, page_files, encoded_images)
+    return candidates
 
 
 # Final method 
-def extracting_project_details(images_path=None):
+@with_job("project-details")
+def extracting_project_details(images_path=None, mode: str = None):
+    mode = resolve_extraction_mode(mode)
     try:
+        start_time = time.time()
+        stats_before = api_stats_snapshot()
+
         # Ensure the image directory exists
         if not os.path.exists(images_path):
             raise HTTPException(status_code=404, detail="No images found for analysis.")
        
+        # Drop blank pages and near-duplicates, the dedup map in the folder keeps
+        # track of which original pages each remaining page stands for
+        dedup_map = load_dedup_map(images_path, list_page_files(images_path))
+        page_files = dedup_map["kept"]
+
         # Convert each image to base64
-        encoded_images = encode_images_to_base64(images_path=images_path)
+        encoded_images = encode_pages(images_path=images_path, files=page_files)
         logger.info(f"Encoded {len(encoded_images)} images.")
-        
-        print("Extracting info for fields")
-        # Define variables using the specified structure
-        location_within_building_zone = final_fields(responses=extract_location_within_building_zone(encoded_images), field="location_within_building_zone")
-        building_use_type = final_fields(responses=extract_building_use_type(encoded_images), field="building_use_type")
-        building_style = final_fields(responses=extract_building_style(encoded_images), field="building_style")
-        grz = final_fields(responses=extract_grz_compliance(encoded_images), field="grz of the building")
-        gfz = final_fields(responses=extract_gfz_compliance(encoded_images), field="gfz of the building")
-        building_height = final_fields(responses=extract_building_height_compliance(encoded_images), field="building_height")
-        number_of_floors = final_fields(responses=extract_number_of_floors_compliance(encoded_images), field="number_of_floors")
-        roof_shape = final_fields(responses=extract_roof_shape_compliance(encoded_images), field="roof_shape")
-        dormers = final_fields(responses=extract_dormers_compliance(encoded_images), field="dormers")
-        roof_orientation = final_fields(responses=extract_roof_orientation_compliance(encoded_images), field="roof_orientation")
-        parking_spaces = final_fields(responses=extract_parking_spaces_compliance(encoded_images), field="parking_spaces")
-        outdoor_space = final_fields(responses=extract_outdoor_space_compliance(encoded_images), field="outdoor_space")
-        setback_area = final_fields(responses=extract_setback_area_compliance(encoded_images), field="setback_area")
-        setback_relevant_filling_work = final_fields(responses=extract_setback_relevant_filling_work(encoded_images), field="setback_relevant_filling_work")
-        deviations_from_b_plan = final_fields(responses=extract_deviations_from_b_plan(encoded_images), field="deviations_from_b_plan")
-        exemptions_required = final_fields(responses=extract_exemptions_required(encoded_images), field="exemptions_required")
-        species_protection_check = final_fields(responses=extract_species_protection_check(encoded_images), field="species_protection_check")
-        compliance_with_zoning_rules = final_fields(responses=extract_compliance_with_zoning_rules(encoded_images), field="compliance_with_zoning_rules")
-        compliance_with_building_codes = final_fields(responses=extract_compliance_with_building_codes(encoded_images), field="compliance_with_building_codes")
-        
-        # Combine into a dictionary if needed
-        result = {
-            "location_within_building_zone": location_within_building_zone,
-            "building_use_type": building_use_type,
-            "building_style": building_style,
-            "grz": grz,
-            "gfz": gfz,
-            "building_height": building_height,
-            "number_of_floors": number_of_floors,
-            "roof_shape": roof_shape,
-            "dormers": dormers,
-            "roof_orientation": roof_orientation,
-            "parking_spaces": parking_spaces,
-            "outdoor_space": outdoor_space,
-            "setback_area": setback_area,
-            "setback_relevant_filling_work": setback_relevant_filling_work,
-            "deviations_from_b_plan": deviations_from_b_plan,
-            "exemptions_required": exemptions_required,
-            "species_protection_check": species_protection_check,
-            "compliance_with_zoning_rules": compliance_with_zoning_rules,
-            "compliance_with_building_codes": compliance_with_building_codes,
-        }
-        print("\n\nNow extracting Analysis info")
-        # Extract analysis info
-        analysis_info = send_to_gpt(encoded_images, prompt=SYSTEM_PROMPT)
-        response = final_response(responses=analysis_info)
+        set_page_store(images_path, page_files, encoded_images, dedup_map)
+
+        if mode == "single_pass":
+            print("Extracting info for all fields in a single pass")
+            records = send_records_to_gpt(encoded_images, FIELD_PROMPTS, analysis=True)
+            result = reduce_page_records(records, FIELD_PROMPTS)
+            response = final_response(responses=[record["analysis"] for record in records if record["analysis"]])
+            return {
+                "extracted_fields": result,
+                "analysis": response,
+                "stats": extraction_stats(stats_before, start_time, mode)
+            }
+
+        candidates = triage_candidates(images_path, page_files, encoded_images)
+
+        print("Extracting info for fields and analysis")
+        result, response = extract_fields(candidates, analysis_pages=encoded_images)
         
         # results.append(str(result))
         # print(results)
@@ -486,7 +1385,8 @@ def extracting_project_details(images_path=None):
         # print("Final response is:\n", response)
         return {
             "extracted_fields": result,
-            "analysis": response
+            "analysis": response,
+            "stats": extraction_stats(stats_before, start_time, mode)
         }
     
     except Exception as e:
@@ -494,12 +1394,206 @@ def extracting_project_details(images_path=None):
         raise HTTPException(status_code=500, detail="An error occurred while processing the image.")
        
 
-def extracting_bplan_details(db, user_id, doc_id, b_plan_path: str = None):
+@with_job("project-details")
+def extracting_project_details_streaming(pdf_paths: list, project_name: str, images_path: str = None, persist_images: bool = False,
+                                         mode: str = None):
+    """
+    Streaming variant of extracting_project_details that starts from the PDFs.
+
+    Rendered pages flow straight into base64 encoding and on to the OpenAI
+    requests for every field, connected by bounded queues. The first request
+    goes out as soon as the first page is rendered, and a slow API slows down
+    rendering instead of piling up images in memory. Page images are only
+    written to images_path when persist_images is set.
+
+    Blank pages and near-duplicates of pages already dispatched are dropped
+    before encoding; with persist_images the dedup map is saved as well.
+    In "single_pass" mode every page is dispatched once with the combined prompt.
+    """
+    mode = resolve_extraction_mode(mode)
+    done = object()
+    stop = threading.Event()
+    errors = []
+    encode_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    dispatch_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    kept, labels = {}, []
+    dedup_map = {"threshold": DEDUP_HAMMING_THRESHOLD, "kept": [], "blank": [], "duplicates": {}}
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return done
+
+    def render_stage():
+        rendered = []
+        try:
+            pages = iter_pdf_pages(
+                pdf_paths,
+                folder_path=images_path if persist_images else None,
+                project_name=project_name,
+                return_bytes=True
+            )
+            for record in pages:
+                if record["error"]:
+                    continue
+                if persist_images:
+                    rendered.append({key: value for key, value in record.items() if key != "image_bytes"})
+                if not put(encode_queue, record):
+                    break
+            if persist_images:
+                update_page_manifest(images_path, rendered)
+                load_triage_index(images_path)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(encode_queue, done)
+
+    def page_label(record):
+        if record.get("image_path"):
+            return os.path.basename(record["image_path"])
+        return f"{os.path.basename(record['pdf_path'])}#page={record['page_index'] + 1}"
+
+    def encode_stage():
+        try:
+            while (record := get(encode_queue)) is not done:
+                label = page_label(record)
+                labels.append(label)
+                if is_blank(record):
+                    dedup_map["blank"].append(label)
+                    continue
+                original = find_duplicate(record, kept)
+                if original is not None:
+                    dedup_map["duplicates"].setdefault(original, []).append(label)
+                    continue
+                kept[label] = {key: record.get(key) for key in ("phash", "text", "chars")}
+                dedup_map["kept"].append(label)
+                if record.get("text_rich"):
+                    page = {"text": record["text"]}
+                else:
+                    page = image_data_url(record["image_bytes"], record["mime"])
+                if not put(dispatch_queue, (page, page_relevant_fields(record))):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(dispatch_queue, done)
+
+    try:
+        start_time = time.time()
+        stats_before = api_stats_snapshot()
+        prompts = dict(FIELD_PROMPTS, analysis=SYSTEM_PROMPT)
+        futures = {field: [] for field in list(prompts) + ["records"]}
+        slots = threading.BoundedSemaphore(PIPELINE_MAX_IN_FLIGHT)
+        stages = [threading.Thread(target=render_stage, daemon=True), threading.Thread(target=encode_stage, daemon=True)]
+        for stage in stages:
+            stage.start()
+
+        # Pages a field was skipped for are kept until the field has a candidate page,
+        # so that a field without any candidate still falls back to all pages
+        fallback = {field: [] for field in prompts}
+        avoided = 0
+
+        def dispatch(field, encoded_image):
+            # Blocks while PIPELINE_MAX_IN_FLIGHT requests are pending, which backs up the queues
+            while not slots.acquire(timeout=0.5):
+                if stop.is_set():
+                    return
+            if field == "records":
+                future = submit_in_context(executor, gpt_page_record, encoded_image, FIELD_PROMPTS, True)
+            else:
+                future = submit_in_context(executor, in_field, field, gpt_page_response, encoded_image, prompts[field])
+            future.add_done_callback(lambda _: slots.release())
+            futures[field].append(future)
+
+        with ThreadPoolExecutor(max_workers=PIPELINE_MAX_IN_FLIGHT) as executor:
+            pages = 0
+            while (item := get(dispatch_queue)) is not done:
+                encoded_image, relevant = item
+                pages += 1
+                if pages == 1:
+                    logger.info(f"First page ready for dispatch after {time.time() - start_time:.2f}s")
+                if mode == "single_pass":
+                    dispatch("records", encoded_image)
+                    continue
+                for field in prompts:
+                    if field != "analysis" and field not in relevant:
+                        avoided += 1
+                        if not futures[field]:
+                            fallback[field].append(encoded_image)
+                        continue
+                    fallback[field] = []
+                    dispatch(field, encoded_image)
+            for field, skipped in fallback.items():
+                if skipped and not futures[field]:
+                    avoided -= len(skipped)
+                    for encoded_image in skipped:
+                        dispatch(field, encoded_image)
+            if mode == "per_field":
+                logger.info(f"Page triage avoided {avoided} field requests.")
+            # Failed pages are left out as in send_to_gpt, the analysis only fails without any reply
+            responses = {field: [] for field in futures}
+            for field, field_futures in futures.items():
+                for index, future in enumerate(field_futures):
+                    try:
+                        responses[field].append(future.result())
+                    except Exception as e:
+                        logger.error(f"Failed to process page {index + 1} for {field}: {e!r}")
+
+        for stage in stages:
+            stage.join()
+        if errors:
+            raise errors[0]
+        if not labels:
+            raise HTTPException(status_code=404, detail="No images found for analysis.")
+        if any(futures.values()) and not any(responses.values()):
+            raise HTTPException(status_code=502, detail="No page could be analyzed.")
+        log_dedup_savings(dedup_map, labels)
+        if persist_images:
+            save_dedup_map(images_path, dedup_map)
+        logger.info(f"Streamed {pages} pages through the extraction pipeline in {time.time() - start_time:.2f}s.")
+
+        if mode == "single_pass":
+            records = responses["records"]
+            result = reduce_page_records(records, FIELD_PROMPTS)
+            response = final_response(responses=[record["analysis"] for record in records if record["analysis"]])
+        else:
+            result = reduce_field_responses({field: responses[field] for field in FIELD_PROMPTS})
+            response = final_response(responses=responses["analysis"])
+        return {
+            "extracted_fields": result,
+            "analysis": response,
+            "stats": extraction_stats(stats_before, start_time, mode)
+        }
+
+    except Exception as e:
+        stop.set()
+        logger.error(f"Error processing image: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while processing the image.")
+
+
+@with_job("bplan-details")
+def extracting_bplan_details(db, user_id, doc_id, b_plan_path: str = None, mode: str = None):
     """
     method to analyze images that were converted from PDFs.
     """
+    mode = resolve_extraction_mode(mode)
     try:
         start_time = time.time()
+        stats_before = api_stats_snapshot()
         logging.info(start_time)
         images_path = b_plan_path
 
@@ -512,66 +1606,37 @@ def extracting_bplan_details(db, user_id, doc_id, b_plan_path: str = None):
         
         encoded_images = encode_images_to_base64(images_path=images_path)
         logger.info(f"Encoded {len(encoded_images)} images.")
+        set_page_store(images_path, list_page_files(images_path), encoded_images)
+
+        if mode == "single_pass":
+            print("Extracting info for all fields in a single pass")
+            result = reduce_page_records(send_records_to_gpt(encoded_images, FIELD_PROMPTS), FIELD_PROMPTS)
+            total_time = (time.time() - start_time) / 60
+            logging.info(f"Total processing time: {total_time:.2f} minutes")
+            return {
+                "result": result,
+                "total_time": total_time,
+                "stats": extraction_stats(stats_before, start_time, mode)
+            }
         
         print("Extracting info for fields")
-        # Define variables using the specified structure
-        location_within_building_zone = final_fields(responses=extract_location_within_building_zone(encoded_images), field="location_within_building_zone")
-        building_use_type = final_fields(responses=extract_building_use_type(encoded_images), field="building_use_type")
-        building_style = final_fields(responses=extract_building_style(encoded_images), field="building_style")
-        grz = final_fields(responses=extract_grz_compliance(encoded_images), field="grz of the building")
-        gfz = final_fields(responses=extract_gfz_compliance(encoded_images), field="gfz of the building")
-        building_height = final_fields(responses=extract_building_height_compliance(encoded_images), field="building_height")
-        number_of_floors = final_fields(responses=extract_number_of_floors_compliance(encoded_images), field="number_of_floors")
-        roof_shape = final_fields(responses=extract_roof_shape_compliance(encoded_images), field="roof_shape")
-        dormers = final_fields(responses=extract_dormers_compliance(encoded_images), field="dormers")
-        roof_orientation = final_fields(responses=extract_roof_orientation_compliance(encoded_images), field="roof_orientation")
-        parking_spaces = final_fields(responses=extract_parking_spaces_compliance(encoded_images), field="parking_spaces")
-        outdoor_space = final_fields(responses=extract_outdoor_space_compliance(encoded_images), field="outdoor_space")
-        setback_area = final_fields(responses=extract_setback_area_compliance(encoded_images), field="setback_area")
-        setback_relevant_filling_work = final_fields(responses=extract_setback_relevant_filling_work(encoded_images), field="setback_relevant_filling_work")
-        deviations_from_b_plan = final_fields(responses=extract_deviations_from_b_plan(encoded_images), field="deviations_from_b_plan")
-        exemptions_required = final_fields(responses=extract_exemptions_required(encoded_images), field="exemptions_required")
-        species_protection_check = final_fields(responses=extract_species_protection_check(encoded_images), field="species_protection_check")
-        compliance_with_zoning_rules = final_fields(responses=extract_compliance_with_zoning_rules(encoded_images), field="compliance_with_zoning_rules")
-        compliance_with_building_codes = final_fields(responses=extract_compliance_with_building_codes(encoded_images), field="compliance_with_building_codes")
+        result, _ = extract_fields(lambda field: encoded_images)
         
         end_time = time.time()  # Record end time
         total_time = (end_time - start_time) / 60
         print("Total Time: ", total_time)
         logging.info(f"Total processing time: {total_time:.2f} minutes")
         
-        # Combine into a dictionary
-        result = {
-            "location_within_building_zone": location_within_building_zone,
-            "building_use_type": building_use_type,
-            "building_style": building_style,
-            "grz": grz,
-            "gfz": gfz,
-            "building_height": building_height,
-            "number_of_floors": number_of_floors,
-            "roof_shape": roof_shape,
-            "dormers": dormers,
-            "roof_orientation": roof_orientation,
-            "parking_spaces": parking_spaces,
-            "outdoor_space": outdoor_space,
-            "setback_area": setback_area,
-            "setback_relevant_filling_work": setback_relevant_filling_work,
-            "deviations_from_b_plan": deviations_from_b_plan,
-            "exemptions_required": exemptions_required,
-            "species_protection_check": species_protection_check,
-            "compliance_with_zoning_rules": compliance_with_zoning_rules,
-            "compliance_with_building_codes": compliance_with_building_codes,
-        }
-        
         return {
             "result": result,
-            "total_time": total_time
+            "total_time": total_time,
+            "stats": extraction_stats(stats_before, start_time, mode)
         }
     except Exception as e:
         logger.error(f"Error processing image: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while processing the image.")
 
-def comparison(project_details, bplan_details):
+def comparison(project_details, bplan_details, on_delta=None):
 #     prompt = """  
 # You will receive two inputs:  
 # 1. **Extracted details of the BPlan:** An dict which consists of details like:   
@@ -627,7 +1692,7 @@ Your task is to:
 
 ### **Key Guidelines:**
 1. **Strictly Adhere to the key-value Structure**:
-   - Ensure that each field in the JSON (`compliance_status`, `issues`, `recommended_actions`, `additional_checks`) is provided, even if empty then just say no any.
+   - Ensure that each field in the JSON (`compliance_status`, `issues`, `recommended_actions`, `additional_checks`) is provided, use an empty list when there is nothing to list.
 2. **Use Bullet Points for Lists**:
    - Represent all issues, recommended actions, and additional checks as individual bullet points in JSON array format.
 3. **Be Specific**:
@@ -665,7 +1730,7 @@ Your task is to:
     "recommended_actions": [
       "Reduce the building height to meet the 10-meter height restriction"
     ],
-    "additional_checks": "no any"
+    "additional_checks": []
   },
   "grz": {
     "compliance_status": "non_compliant",
@@ -675,7 +1740,7 @@ Your task is to:
     "recommended_actions": [
       "Reduce the ground area ratio to meet the 0.4 limit"
     ],
-    "additional_checks": "no any"
+    "additional_checks": []
   },
   "roof_shape": {
     "compliance_status": "non_compliant",
@@ -685,7 +1750,7 @@ Your task is to:
     "recommended_actions": [
       "Modify the roof shape to comply with the gable requirement"
     ],
-    "additional_checks": "no any"
+    "additional_checks": []
   },
   "setback_area": {
     "compliance_status": "non_compliant",
@@ -695,7 +1760,7 @@ Your task is to:
     "recommended_actions": [
       "Increase the setback area to at least 5 meters"
     ],
-    "additional_checks": "no any"
+    "additional_checks": []
   }
 }
 
@@ -708,7 +1773,7 @@ Your task is to:
 # - Must provide all details in German Language.
     # building_details = " ".join([response for response in building_details])
     payload = {
-        "model": "gpt-4o",
+        "model": model_for("comparison"),
         "messages": [
             {
                 "role": "system",
@@ -730,16 +1795,16 @@ Your task is to:
         ],
         "max_tokens": 4095
     }
-    response_json = call_openai_api(payload=payload)
+    report = call_routed(payload, compliance_report_model(FIELD_PROMPTS), cache_as="comparison", on_delta=on_delta)
 
-    # Extract the assistant's message from the response
-    assistant_message = response_json['choices'][0]['message']['content']
+    # Callers parse the reply with json.loads
+    assistant_message = json.dumps(report.model_dump(), ensure_ascii=False)
     print("Final compliance status:\n\n\n",assistant_message)
 
     logger.info("Successfully processed.")
     return assistant_message
         
-def PdfReport(results):
+def PdfReport(results, on_delta=None):
     prompt = """  
 I will provide you the result in a json format. Your task is to convert the json response in  an structred pdf with proper headings. 
 So, you should format it in that way that it should look like a pdf report! So that I can use that for future work!
@@ -749,7 +1814,7 @@ So, you should format it in that way that it should look like a pdf report! So t
 - Try not add additional details.
 """
     payload = {
-        "model": "gpt-4o",
+        "model": model_for("PdfReport"),
         "messages": [
             {
                 "role": "system",
@@ -767,7 +1832,7 @@ So, you should format it in that way that it should look like a pdf report! So t
         ],
         "max_tokens": 4095
     }
-    response_json = call_openai_api(payload=payload)
+    response_json = call_openai_api(payload=payload, cache_as="PdfReport", on_delta=on_delta)
 
     # Extract the assistant's message from the response
     assistant_message = response_json['choices'][0]['message']['content']
@@ -784,7 +1849,7 @@ You will recieve a location with some other details. Your task is to extract onl
 - Try not add additional details.
 """
     payload = {
-        "model": "gpt-4o",
+        "model": model_for("extract_location"),
         "messages": [
             {
                 "role": "system",
@@ -802,15 +1867,13 @@ You will recieve a location with some other details. Your task is to extract onl
         ],
         "max_tokens": 4095
     }
-    response_json = call_openai_api(payload=payload)
-
-    # Extract the assistant's message from the response
-    assistant_message = response_json['choices'][0]['message']['content']
+    assistant_message = call_routed(payload, LocationValue, cache_as="extract_location").location
 
     logger.info("Successfully processed.")
     return assistant_message
 
 
+@with_job("completeness-check")
 def completeness_check(images_path=None):
     prompt = """" 
 ### **System Prompt: Completeness Check Assistant**  
@@ -925,12 +1988,18 @@ Below is a **plain-English explanation** of what each row means—so that someon
         if not os.path.exists(images_path):
             raise HTTPException(status_code=404, detail="No images found for analysis.")
        
+        # Blank pages carry nothing to check, duplicates are kept since copies count here
+        page_files = list_page_files(images_path)
+        blank = set(load_dedup_map(images_path, page_files)["blank"])
+        page_files = [file for file in page_files if file not in blank]
+
         # Convert each image to base64
-        encoded_images = encode_images_to_base64(images_path=images_path)
+        encoded_images = encode_pages(images_path=images_path, files=page_files)
         logger.info(f"Encoded {len(encoded_images)} images.")
+        set_page_store(images_path, page_files, encoded_images)
         
         print("Checking completeness of the documnets..")
-        analysis_info = send_to_gpt(encoded_images, prompt=prompt)
+        analysis_info = send_to_gpt(encoded_images, prompt=prompt, field="completeness")
         print("compltenesss check info: ", analysis_info)
         result = final_response_cmply_check(analysis_info)
         return result
@@ -1059,30 +2128,37 @@ You are an AI assistant responsible for verifying the **completeness of required
 - Ensure **all required documents** are present before marking the status as "Complete".  
 - If **any document is missing**, the status **must be "Incomplete"** with an explanation.  
 """
-    responses = " ".join([response for response in responses])
-    payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": prompt
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": responses
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 4095
-        }
-    # Send the request to the OpenAI API
-    response_json = call_openai_api(payload=payload)
 
-    # Extract the assistant's message from the response
-    assistant_message = response_json['choices'][0]['message']['content']
-    # response = parse_response_data(assistant_message.replace("**",""))
-    return assistant_message
\ No newline at end of file
+    def reduce_chunk(chunk, level):
+        payload = {
+                "model": model_for("completeness_check"),
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": prompt if level == 0 else prompt + PARTIAL_REPORTS_NOTE
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": " ".join([response for response in chunk])
+                            }
+                        ]
+                    }
+                ],
+                "max_tokens": 4095
+            }
+        # Send the request to the OpenAI API
+        report = call_routed(payload, CompletenessReport, cache_as="completeness_check")
+
+        # Callers parse the reply with json.loads
+        return json.dumps(report.model_dump(), ensure_ascii=False)
+
+    return tree_reduce(responses, reduce_chunk)
+
+
+PARTIAL_REPORTS_NOTE = """
+The input consists of completeness reports, each covering only part of the submitted pages.
+Merge them into one report: a document counts as provided when any of the reports lists it as provided.
+"""
\ No newline at end of file
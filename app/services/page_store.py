@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from .dedup_service import original_pages
+
+logger = logging.getLogger(__name__)
+
+# Page-level extraction results, persisted next to the page manifest so that
+# re-analysis only sends the pages/prompts that have no stored result yet
+PAGE_STORE_FILE = "page_results.json"
+PAGE_STORE_ENABLED = os.getenv("PAGE_STORE", "true").lower() in ("1", "true", "yes")
+# Part of every prompt version, bump it to invalidate all stored results
+PAGE_STORE_VERSION = os.getenv("PAGE_STORE_VERSION", "1")
+
+_store = contextvars.ContextVar("page_store", default=None)
+
+
+def page_hash(page) -> str:
+    """
+    Hash of what is sent for a page: its text layer or its image data URL.
+    """
+    data = page["text"] if isinstance(page, dict) else page
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def prompt_version(prompt: str, model: str) -> str:
+    """
+    Hash of the prompt and the model it is sent to, so a routing change does not reuse another model's replies.
+    """
+    return hashlib.sha256(f"{PAGE_STORE_VERSION}:{model}:{prompt}".encode("utf-8")).hexdigest()[:12]
+
+
+class PageResultStore:
+    """
+    Per-document store of page results keyed by (page hash, prompt version, field).
+    The prompt version covers the prompt and the model (see prompt_version).
+
+    Every entry keeps the page number and image file it came from, so results
+    can always be read back in page order, whichever request finished first.
+    With a dedup map, an entry also lists every original page its (kept) page
+    stands for under "pages", so its result applies to the collapsed copies too.
+    The store is a JSON file in the image folder and is rewritten atomically
+    after every save().
+    """
+
+    def __init__(self, images_path: str, files: list, pages: list, dedup_map: dict = None):
+        self.path = os.path.join(images_path, PAGE_STORE_FILE)
+        self.files = list(files)
+        self.dedup_map = dedup_map or {}
+        self.order = {}
+        for index, page in enumerate(pages):
+            self.order.setdefault(page_hash(page), index)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f).get("entries", {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable page result store {self.path}: {e}")
+            return {}
+
+    def key(self, page, prompt: str, field: str, model: str) -> str:
+        return f"{page_hash(page)}:{prompt_version(prompt, model)}:{field}"
+
+    def missing(self, pages: list, prompt: str, field: str, model: str) -> list:
+        """
+        Return the indexes (into pages) of the pages without a stored result.
+        """
+        with self._lock:
+            return [index for index, page in enumerate(pages) if self.key(page, prompt, field, model) not in self.entries]
+
+    def put(self, page, prompt: str, field: str, model: str, result):
+        digest = page_hash(page)
+        index = self.order.get(digest)
+        file = self.files[index] if index is not None and index < len(self.files) else None
+        entry = {
+            "page": index + 1 if index is not None else None,
+            "file": file,
+            "pages": original_pages(self.dedup_map, file) if file is not None else [],
+            "field": field,
+            "model": model,
+            "prompt_version": prompt_version(prompt, model),
+            "result": result,
+            "created": time.time(),
+        }
+        with self._lock:
+            self.entries[self.key(page, prompt, field, model)] = entry
+            self._dirty = True
+
+    def results(self, pages: list, prompt: str, field: str, model: str) -> list:
+        """
+        Return the stored results of the pages in page order, pages without a result are left out.
+        """
+        with self._lock:
+            entries = [self.entries.get(self.key(page, prompt, field, model)) for page in pages]
+        entries = [entry for entry in entries if entry is not None]
+        entries.sort(key=lambda entry: entry["page"] if entry["page"] is not None else float("inf"))
+        return [entry["result"] for entry in entries]
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps({"version": PAGE_STORE_VERSION, "entries": self.entries}, ensure_ascii=False)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+
+def set_page_store(images_path: str, files: list, pages: list, dedup_map: dict = None):
+    """
+    Use the page result store of images_path for the rest of the current job (context).
+    """
+    _store.set(PageResultStore(images_path, files, pages, dedup_map) if PAGE_STORE_ENABLED else None)
+
+
+def current_page_store():
+    return _store.get()
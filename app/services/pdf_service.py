@@ -1,9 +1,17 @@
-import os
+import os, time, math, json
 import fitz  # PyMuPDF
 from PIL import Image
 import unicodedata
 import logging
 import traceback
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from .image_service import (
+    VISION_MAX_PIXELS, IMAGE_MAX_PIXELS, PAGE_IMAGE_FORMATS, update_page_manifest, page_fingerprint, page_image_settings, save_page_image
+)
+from .render_cache import render_cache, file_hash, profile_key
 
 # Normalize filenames to ensure special characters are handled consistently
 def normalize_filename(filename):
@@ -47,93 +55,490 @@ def formal_checking(docs: list):
         return "All files are present."
     
 
-def process_pdf(pdf_path, dpi=300, folder_path: str = None, project_name: str = None):
+# Number of worker processes used to rasterize PDF pages. PyMuPDF is not
+# thread-safe, so pages are spread across processes instead of threads.
+RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", os.cpu_count() or 1))
+
+# Render profiles. "vision" rasterizes every output image directly at the pixel
+# budget of the vision payload, so nothing has to be downscaled afterwards.
+# "archive" is the former 300 DPI render and has to be requested explicitly.
+RENDER_PROFILES = {
+    "vision": {"max_pixels": VISION_MAX_PIXELS, "max_dpi": 300},
+    "archive": {"dpi": 300},
+}
+DEFAULT_RENDER_PROFILE = os.getenv("PDF_RENDER_PROFILE", "vision")
+
+# Text-layer fast path: pages with enough extractable text and little vector or
+# raster artwork are classified as text-rich and sent to gpt as text.
+TEXT_PAGE_MIN_CHARS = int(os.getenv("TEXT_PAGE_MIN_CHARS", 400))
+TEXT_PAGE_MAX_DRAWINGS = int(os.getenv("TEXT_PAGE_MAX_DRAWINGS", 500))
+TEXT_PAGE_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_PAGE_MAX_IMAGE_COVERAGE", 0.3))
+
+# B-plan tiling: physical size covered by one tile, overlap between neighbouring
+# tiles as a fraction of the tile size, and the memory ceiling of one tile render.
+PLAN_TILE_SIZE_MM = float(os.getenv("PLAN_TILE_SIZE_MM", 297))
+PLAN_TILE_OVERLAP = float(os.getenv("PLAN_TILE_OVERLAP", 0.1))
+PLAN_TILE_MAX_BYTES = int(os.getenv("PLAN_TILE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Cumulative rasterization counters, used to size the analysis nodes.
+RENDER_STATS = {"pdfs": 0, "pages": 0, "cached_pages": 0, "failed_pages": 0, "seconds": 0.0}
+
+_render_pools = {}
+_render_pools_lock = threading.Lock()
+
+
+def _get_render_pool(workers: int):
+    """
+    Return a shared process pool with the given number of workers.
+
+    Pools are created lazily with the "spawn" start method, forking a process
+    that already runs the web server threads is not safe.
+    """
+    with _render_pools_lock:
+        pool = _render_pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _render_pools[workers] = pool
+        return pool
+
+
+def _reset_render_pool(workers: int):
+    with _render_pools_lock:
+        pool = _render_pools.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def resolve_render_profile(profile=None, dpi=None):
+    """
+    Return the render profile settings for a profile name or a fixed dpi.
+
+    An explicit dpi always wins, so existing callers passing dpi=300 keep the
+    archival render.
+    """
+    if dpi:
+        return {"dpi": dpi}
+    if isinstance(profile, dict):
+        return profile
+    profile = profile or DEFAULT_RENDER_PROFILE
+    if profile not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile: {profile}")
+    return RENDER_PROFILES[profile]
+
+
+def profile_zoom(width: float, height: float, profile: dict) -> float:
+    """
+    Compute the zoom factor for an output image of width x height points.
+
+    For pixel-budget profiles the zoom is chosen so that the rendered pixmap,
+    whose sides are rounded up to whole pixels, stays within max_pixels:
+    (width * zoom + 1) * (height * zoom + 1) <= max_pixels.
+    """
+    if "dpi" in profile:
+        return profile["dpi"] / 72
+    return min(_zoom_for_pixels(width, height, profile["max_pixels"]), profile.get("max_dpi", 300) / 72)
+
+
+def _zoom_for_pixels(width: float, height: float, max_pixels: int) -> float:
+    # Largest zoom with (width * zoom + 1) * (height * zoom + 1) <= max_pixels
+    area, perimeter = width * height, width + height
+    return (math.sqrt(perimeter ** 2 + 4 * area * (max_pixels - 1)) - perimeter) / (2 * area)
+
+
+def _pixmap_image(pix):
+    """
+    Wrap a pixmap's sample buffer in a PIL image.
+
+    pix.samples_mv is a view of the pixmap memory, unlike pix.samples which
+    copies it into a bytes object first. Grayscale images share the buffer
+    outright, so the image must not be used after the pixmap is gone.
+    """
+    mode = "L" if pix.n == 1 else "RGB"
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+
+
+def _doc_name(pdf_path, project_name):
+    # PDFs live under uploads/<user>/<project>/pdfs/<project>/<file>.pdf, other paths use the file name
+    parts = pdf_path.split(f"{project_name}{os.path.sep}") if project_name else []
+    if len(parts) < 3:
+        return os.path.splitext(os.path.basename(pdf_path))[0]
+    return parts[2].split(".pdf")[0]
+
+
+def page_text_info(page) -> dict:
+    """
+    Extract the text layer of a page and classify it as text-rich or drawing-heavy.
+
+    Returns:
+    dict: "text", "text_rich" and the page features: "chars", "drawings"
+    (vector paths), "images" (raster images), "image_coverage" (share of the
+    page covered by raster images) and the page size in millimetres.
+    """
+    text = page.get_text("text").strip()
+    drawings = len(page.get_cdrawings())
+    image_info = page.get_image_info()
+    page_area = abs(page.rect)
+    image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in image_info)
+    image_coverage = min(image_area / page_area, 1.0) if page_area else 0.0
+    text_rich = (
+        len(text) >= TEXT_PAGE_MIN_CHARS
+        and drawings <= TEXT_PAGE_MAX_DRAWINGS
+        and image_coverage <= TEXT_PAGE_MAX_IMAGE_COVERAGE
+    )
+    return {
+        "text": text,
+        "text_rich": text_rich,
+        "chars": len(text),
+        "drawings": drawings,
+        "images": len(image_info),
+        "image_coverage": round(image_coverage, 3),
+        "width_mm": round(page.rect.width * 25.4 / 72),
+        "height_mm": round(page.rect.height * 25.4 / 72),
+    }
+
+
+def _page_image_path(folder_path, doc_name, page_index, image_settings):
+    ext = PAGE_IMAGE_FORMATS[image_settings["format"]]["ext"]
+    return os.path.join(folder_path, f"{doc_name}_page_{page_index + 1}{ext}")
+
+
+def _write_page_image(img_path, img_data):
+    # A page rendered earlier in another format would otherwise be picked up twice
+    stem = os.path.splitext(img_path)[0]
+    for image_format in PAGE_IMAGE_FORMATS.values():
+        if stem + image_format["ext"] != img_path and os.path.exists(stem + image_format["ext"]):
+            os.remove(stem + image_format["ext"])
+    with open(img_path, "wb") as f:
+        f.write(img_data)
+
+
+def _image_format_info(image_settings):
+    return {"format": image_settings["format"], "mime": PAGE_IMAGE_FORMATS[image_settings["format"]]["mime"]}
+
+
+def _render_page(pdf_path, page_index, profile, folder_path, doc_name, return_bytes=False, image_settings=None):
+    """
+    Render a single PDF page to an image. Runs inside a render worker.
+
+    The image is written to folder_path when one is given, and returned in
+    "image_bytes" when return_bytes is set (or no folder is given).
+    Errors are caught and reported in the returned record so that one broken
+    page does not fail the whole document.
+    """
+    image_settings = image_settings or page_image_settings()
+    record = {"pdf_path": pdf_path, "page_index": page_index, "image_path": None, "error": None}
+    record.update(_image_format_info(image_settings))
     try:
-        logging.info(f"Opening PDF: {pdf_path}")
         doc = fitz.open(pdf_path)
+        try:
+            page = doc[page_index]
+            record.update(page_text_info(page))
+            zoom = profile_zoom(page.rect.width, page.rect.height, profile)
+            zoom = min(zoom, _zoom_for_pixels(page.rect.width, page.rect.height, IMAGE_MAX_PIXELS))
+            dpi = round(zoom * 72)
+            mat = fitz.Matrix(zoom, zoom)
+
+            # Grayscale pages are rendered as such, which also cuts the pixmap to a third
+            colorspace = fitz.csGRAY if image_settings["grayscale"] else fitz.csRGB
+            pix = page.get_pixmap(matrix=mat, colorspace=colorspace, alpha=False)
+            img = _pixmap_image(pix)
+            record.update(page_fingerprint(img))
+
+            img_data = save_page_image(img, image_settings, dpi)
+            del img, pix
+
+            if folder_path:
+                img_path = _page_image_path(folder_path, doc_name, page_index, image_settings)
+                _write_page_image(img_path, img_data)
+                record["image_path"] = img_path
+            if return_bytes or not folder_path:
+                record["image_bytes"] = img_data
+        finally:
+            doc.close()
     except Exception as e:
-        logging.error(f"Failed to open PDF: {str(e)}")
+        logging.error(f"Error processing page {page_index + 1} of {pdf_path}: {str(e)}")
         logging.error(traceback.format_exc())
-        return []
+        record["error"] = str(e)
+    return record
 
-    image_paths = []
-    logging.info(f"Number of pages: {len(doc)}")
 
-    for i in range(len(doc)):
-        try:
-            page = doc[i]
-            zoom = dpi / 72
-            mat = fitz.Matrix(zoom, zoom)
+# Page record fields that are derived from the PDF alone and cached next to the image
+PAGE_INFO_KEYS = ("text", "text_rich", "chars", "drawings", "images", "image_coverage", "width_mm", "height_mm", "phash", "ink")
 
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
 
-            doc_name = doc.name.split(f"{project_name}{os.path.sep}")[2].split(".pdf")[0]
-            img_path = os.path.join(folder_path, f"{doc_name}_page_{i + 1}.png")
+def iter_pdf_pages(pdf_paths: list, dpi=None, folder_path: str = None, project_name: str = None,
+                   workers: int = None, profile=None, return_bytes: bool = False, image_settings: dict = None):
+    """
+    Render the pages of several PDFs and yield one page record at a time.
 
-            logging.info(f"Saving image to {img_path}")
-            img.save(img_path, format="PNG", dpi=(dpi, dpi), quality=95)
+    Records are yielded in document and page order as soon as they are ready,
+    so consumers can start working on the first pages while later pages are
+    still being rasterized. At most two pages per worker are in flight, a slow
+    consumer therefore also slows down rendering.
 
-            image_paths.append(img_path)
+    Args:
+    pdf_paths (list): Paths to the PDF files.
+    dpi (int): Fixed render resolution. Overrides the profile when given.
+    folder_path (str): Directory where images are saved. When None, images stay in memory.
+    project_name (str): Project name, used to derive the image file names.
+    workers (int): Number of worker processes (default: PDF_RENDER_WORKERS).
+    profile (str): Render profile name from RENDER_PROFILES (default: PDF_RENDER_PROFILE).
+    return_bytes (bool): Also return the image data when images are saved to folder_path.
+    image_settings (dict): Page image format, quality and grayscale (default: page_image_settings()).
+
+    Yields:
+    dict: Page record with "pdf_index", "pdf_path", "page_index", "image_path",
+    "image_bytes" (in memory mode), "error" and the text layer info from
+    page_text_info.
+    """
+    workers = workers or RENDER_WORKERS
+    profile = resolve_render_profile(profile, dpi)
+    image_settings = image_settings or page_image_settings()
+    pkey = profile_key(profile, profile_key(image_settings))
+    want_bytes = return_bytes or not folder_path
+    start_time = time.time()
 
+    tasks = []
+    for pdf_index, pdf_path in enumerate(pdf_paths):
+        try:
+            logging.info(f"Opening PDF: {pdf_path}")
+            with fitz.open(pdf_path) as doc:
+                page_count = len(doc)
+            content_hash = file_hash(pdf_path)
+            doc_name = _doc_name(pdf_path, project_name)
         except Exception as e:
-            logging.error(f"Error processing page {i + 1}: {str(e)}")
+            logging.error(f"Failed to open PDF: {str(e)}")
             logging.error(traceback.format_exc())
+            continue
+        logging.info(f"Number of pages: {page_count}")
+        for i in range(page_count):
+            cache_keys = (render_cache.key(content_hash, i, pkey), render_cache.key(content_hash, i, "page-info-v4"))
+            tasks.append((pdf_index, cache_keys, (pdf_path, i, profile, folder_path, doc_name, want_bytes, image_settings)))
 
-    doc.close()
+    def _from_cache(cache_keys, args):
+        # Pages found in the render cache are copied into place instead of being rasterized
+        pdf_path, page_index, _, folder_path, doc_name, _, _ = args
+        # One hit or miss per page, although the image and its page info are looked up separately
+        img_data = render_cache.get_bytes(cache_keys[0], count=False)
+        page_info = render_cache.get_bytes(cache_keys[1], count=False) if img_data is not None else None
+        render_cache.record_lookup(page_info is not None)
+        if page_info is None:
+            return None
+        record = {"pdf_path": pdf_path, "page_index": page_index, "image_path": None, "error": None, "cached": True}
+        record.update(json.loads(page_info))
+        record.update(_image_format_info(image_settings))
+        if folder_path:
+            record["image_path"] = _page_image_path(folder_path, doc_name, page_index, image_settings)
+            _write_page_image(record["image_path"], img_data)
+        if want_bytes:
+            record["image_bytes"] = img_data
+        return record
+
+    def _finish(pdf_index, cache_keys, record):
+        if record.get("image_bytes") is not None:
+            render_cache.put(cache_keys[0], data=record["image_bytes"])
+        elif record["image_path"]:
+            render_cache.put(cache_keys[0], record["image_path"])
+        if not record["error"]:
+            page_info = {key: record[key] for key in PAGE_INFO_KEYS if key in record}
+            render_cache.put(cache_keys[1], data=json.dumps(page_info).encode("utf-8"))
+        record["pdf_index"] = pdf_index
+        return record
+
+    rendered = cached = failed = 0
+    pool = _get_render_pool(workers) if workers > 1 and len(tasks) > 1 else None
+    in_flight = deque()
+    next_task = 0
+    try:
+        while next_task < len(tasks) or in_flight:
+            # Keep the workers busy, but never more than two pages per worker ahead of the consumer
+            while next_task < len(tasks) and len(in_flight) < max(workers * 2, 1):
+                pdf_index, cache_keys, args = tasks[next_task]
+                next_task += 1
+                record = _from_cache(cache_keys, args)
+                if record is not None:
+                    in_flight.append((pdf_index, cache_keys, args, record))
+                elif pool is not None:
+                    in_flight.append((pdf_index, cache_keys, args, pool.submit(_render_page, *args)))
+                else:
+                    in_flight.append((pdf_index, cache_keys, args, None))
+                    break
+
+            pdf_index, cache_keys, args, result = in_flight.popleft()
+            if isinstance(result, dict):
+                record = result
+                record["pdf_index"] = pdf_index
+                cached += 1
+            else:
+                if result is None:
+                    record = _render_page(*args)
+                else:
+                    try:
+                        record = result.result()
+                    except Exception as e:
+                        # A crashed worker breaks the whole pool; drop it so the next call starts fresh.
+                        logging.error(f"Render worker failed on page {args[1] + 1} of {args[0]}: {e}")
+                        _reset_render_pool(workers)
+                        pool = None
+                        record = {"pdf_path": args[0], "page_index": args[1], "image_path": None, "error": str(e)}
+                record = _finish(pdf_index, cache_keys, record)
+                rendered += 1
+            if record["error"]:
+                failed += 1
+            yield record
+    finally:
+        for _, _, _, result in in_flight:
+            if hasattr(result, "cancel"):
+                result.cancel()
+        elapsed = time.time() - start_time
+        RENDER_STATS["pdfs"] += len(pdf_paths)
+        RENDER_STATS["pages"] += rendered
+        RENDER_STATS["cached_pages"] += cached
+        RENDER_STATS["failed_pages"] += failed
+        RENDER_STATS["seconds"] += elapsed
+        pages_per_second = rendered / elapsed if elapsed > 0 else 0.0
+        logging.info(
+            f"Rendered {rendered} pages from {len(pdf_paths)} PDFs in {elapsed:.2f}s "
+            f"({pages_per_second:.2f} pages/s, {workers} workers, {failed} failed, {cached} from cache)"
+        )
+
+
+def process_pdfs(pdf_paths: list, dpi=None, folder_path: str = None, project_name: str = None, workers: int = None, profile=None,
+                 image_settings: dict = None):
+    """
+    Convert the pages of several PDFs into images using a pool of worker processes.
+
+    All pages of all PDFs are rendered in one go, so a project with many small
+    PDFs keeps every worker busy.
+
+    Args:
+    pdf_paths (list): Paths to the PDF files.
+    dpi (int): Fixed render resolution. Overrides the profile when given.
+    folder_path (str): Directory where images will be saved.
+    project_name (str): Project name, used to derive the image file names.
+    workers (int): Number of worker processes (default: PDF_RENDER_WORKERS).
+    profile (str): Render profile name from RENDER_PROFILES (default: PDF_RENDER_PROFILE).
+    image_settings (dict): Page image format, quality and grayscale (default: page_image_settings()).
+
+    Returns:
+    list: One list of page records per PDF, in page order. Each record holds the
+    "image_path" of the rendered page, or the "error" that occurred.
+    """
+    results = [[] for _ in pdf_paths]
+    for record in iter_pdf_pages(pdf_paths, dpi=dpi, folder_path=folder_path, project_name=project_name,
+                                 workers=workers, profile=profile, image_settings=image_settings):
+        results[record["pdf_index"]].append(record)
+    if folder_path:
+        update_page_manifest(folder_path, [record for records in results for record in records])
+    return results
+
+
+def process_pdf(pdf_path, dpi=None, folder_path: str = None, project_name: str = None, workers: int = None, profile=None,
+                image_settings: dict = None):
+    records = process_pdfs([pdf_path], dpi=dpi, folder_path=folder_path, project_name=project_name, workers=workers, profile=profile,
+                           image_settings=image_settings)[0]
     logging.info("PDF to image conversion complete.")
-    return image_paths
+    return [record["image_path"] for record in records if record["image_path"]]
+
+
+def plan_grid(width: float, height: float, tile_size_mm: float = None):
+    """
+    Pick the (columns, rows) tile grid for a page of width x height points.
+
+    Each tile covers roughly tile_size_mm on its sides, so an A4 page stays in
+    one piece, A3 is split in two and an A0 sheet into a 4x3 grid.
+    """
+    tile_size_mm = tile_size_mm or PLAN_TILE_SIZE_MM
+    mm_per_point = 25.4 / 72
+    # Allow 5% slack so that sheets just above the tile size are not split
+    cols = max(1, math.ceil(width * mm_per_point / (tile_size_mm * 1.05)))
+    rows = max(1, math.ceil(height * mm_per_point / (tile_size_mm * 1.05)))
+    return cols, rows
+
+
+def plan_tiles(rect, cols: int, rows: int, overlap: float):
+    """
+    Split a page rectangle into cols x rows overlapping clip rectangles, row by row.
+    """
+    # n tiles overlapping by a fraction of their size cover n - (n - 1) * overlap tile sizes
+    tile_width = rect.width / (cols - (cols - 1) * overlap)
+    tile_height = rect.height / (rows - (rows - 1) * overlap)
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            x0 = rect.x0 + col * tile_width * (1 - overlap)
+            y0 = rect.y0 + row * tile_height * (1 - overlap)
+            tiles.append((row, col, fitz.Rect(x0, y0, min(x0 + tile_width, rect.x1), min(y0 + tile_height, rect.y1))))
+    return tiles
 
 
-def process_plan_pdf(pdf_path, dpi=300, folder_path: str = None, project_name: str = None):
+def process_plan_pdf(pdf_path, dpi=None, folder_path: str = None, project_name: str = None, profile=None,
+                     grid: tuple = None, overlap: float = None, tile_size_mm: float = None, max_render_bytes: int = None,
+                     image_settings: dict = None):
     """
-    Convert each page of the PDF into high-quality images split into left and right halves.
+    Convert each page of the PDF into overlapping image tiles.
+
+    The tile grid follows the physical sheet size (see plan_grid), so large
+    format B-plans stay legible after they are scaled to the vision payload
+    size, while A4 pages are kept whole. Every tile is rendered on its own with
+    a clip rectangle, the full-page pixmap is never created.
 
     Args:
     pdf_path (str): Path to the PDF file.
-    dpi (int): Dots per inch for image resolution (default: 300).
-    current_dir (str): Directory where images will be saved.
+    dpi (int): Fixed render resolution. Overrides the profile when given.
+    profile (str): Render profile name. Pixel budgets apply to each tile.
+    folder_path (str): Directory where images will be saved.
     project_name (str): Optional project name for organizing output files.
+    grid (tuple): Fixed (columns, rows) grid instead of the size-based one.
+    overlap (float): Overlap between neighbouring tiles as a fraction of the tile size.
+    tile_size_mm (float): Physical size covered by one tile (default: PLAN_TILE_SIZE_MM).
+    max_render_bytes (int): Memory ceiling for a single tile pixmap (default: PLAN_TILE_MAX_BYTES).
+    image_settings (dict): Tile image format, quality and grayscale (default: page_image_settings()).
 
     Returns:
-    list: Paths to the extracted images (both left and right halves).
+    str: The folder the tile images were written to.
     """
-    # folder_path = os.path.join(current_dir, "images")
-    # os.makedirs(folder_path, exist_ok=True)
     doc = fitz.open(pdf_path)
     image_paths = []
 
     logging.info(f"Number of pages: {len(doc)}")
-    logging.info("Converting PDF pages to images with left and right splits.")
+    logging.info("Converting PDF pages to image tiles.")
+
+    profile = resolve_render_profile(profile, dpi)
+    overlap = PLAN_TILE_OVERLAP if overlap is None else overlap
+    max_render_bytes = max_render_bytes or PLAN_TILE_MAX_BYTES
+    image_settings = image_settings or page_image_settings()
+    ext = PAGE_IMAGE_FORMATS[image_settings["format"]]["ext"]
+    content_hash = file_hash(pdf_path)
 
     for i in range(len(doc)):
         page = doc[i]
+        cols, rows = grid or plan_grid(page.rect.width, page.rect.height, tile_size_mm)
+        logging.info(f"Page {i + 1}: {cols}x{rows} tiles")
 
-        # Set the matrix for higher resolution
-        zoom = dpi / 72  # 72 is the default PDF resolution
-        mat = fitz.Matrix(zoom, zoom)
-
-        # Get the pixmap with higher resolution
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-
-        # Convert pixmap to PIL Image
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        for row, col, clip in plan_tiles(page.rect, cols, rows, overlap if cols * rows > 1 else 0):
+            img_path = os.path.join(folder_path, f"{project_name}_page_{i + 1}_tile_{row + 1}_{col + 1}{ext}")
+            cache_key = render_cache.key(
+                content_hash, i, profile_key(profile, f"tile:{cols}x{rows}:{overlap}:{row},{col}:{max_render_bytes}:{profile_key(image_settings)}")
+            )
+            if render_cache.copy_to(cache_key, img_path):
+                image_paths.append(img_path)
+                continue
 
-        # Calculate dimensions for the left and right halves
-        width, height = img.size
-        mid_width = width // 2
-
-        # Crop the left half
-        left_half = img.crop((0, 0, mid_width, height))
-        left_img_path = os.path.join(folder_path, f"{project_name}_page_{i + 1}_left.png")
-        left_half.save(left_img_path, format="PNG", dpi=(dpi, dpi), quality=95)
-        image_paths.append(left_img_path)
+            # Size the render for the tile, but never above the memory ceiling (3 bytes per RGB, 1 per gray pixel)
+            bytes_per_pixel = 1 if image_settings["grayscale"] else 3
+            zoom = profile_zoom(clip.width, clip.height, profile)
+            zoom = min(zoom, _zoom_for_pixels(clip.width, clip.height, min(max_render_bytes // bytes_per_pixel, IMAGE_MAX_PIXELS)))
+            tile_dpi = round(zoom * 72)
+            mat = fitz.Matrix(zoom, zoom)
 
-        # Crop the right half
-        right_half = img.crop((mid_width, 0, width, height))
-        right_img_path = os.path.join(folder_path, f"{project_name}_page_{i + 1}_right.png")
-        right_half.save(right_img_path, format="PNG", dpi=(dpi, dpi), quality=95)
-        image_paths.append(right_img_path)
+            colorspace = fitz.csGRAY if image_settings["grayscale"] else fitz.csRGB
+            pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=colorspace, alpha=False)
+            _write_page_image(img_path, save_page_image(_pixmap_image(pix), image_settings, tile_dpi))
+            del pix
+            render_cache.put(cache_key, img_path)
+            image_paths.append(img_path)
 
     doc.close()
-    return folder_path
\ No newline at end of file
+    logging.info(f"Rendered {len(image_paths)} tiles. Render cache: {render_cache.stats()}")
+    return folder_path
@@ -0,0 +1,179 @@
+import os
+import time
+import json
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Organisation-wide OpenAI budgets shared by every analysis in this process (0 disables a limit)
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", 500))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", 800000))
+# Requests in flight at once across all analyses
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 20))
+
+# Rough token cost of one image at 1024x1024 with detail "high" (4 tiles of 170 + 85)
+IMAGE_TOKENS = 765
+
+
+def estimate_tokens(payload: dict) -> int:
+    """
+    Estimate how many tokens a chat completion request counts against the TPM limit.
+
+    OpenAI counts the prompt plus max_tokens, text is estimated at 4 characters per token.
+    """
+    chars = 0
+    images = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                images += 1
+            else:
+                chars += len(part.get("text", ""))
+    if "response_format" in payload:
+        chars += len(json.dumps(payload["response_format"]))
+    return chars // 4 + images * IMAGE_TOKENS + payload.get("max_tokens", 1000)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at limit_per_minute, holding at most one minute of budget.
+    """
+
+    def __init__(self, limit_per_minute: int):
+        self.capacity = float(limit_per_minute)
+        self.rate = limit_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until amount can be taken from the bucket.
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        # Positive amounts take more, negative ones give back (e.g. after the real usage is known)
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class RequestScheduler:
+    """
+    Process-wide scheduler for OpenAI requests.
+
+    Every request waits for a requests-per-minute and a tokens-per-minute
+    token bucket and for a free concurrency slot. Waiters are admitted in
+    arrival order, so one large analysis cannot starve the others. All methods
+    run on the event loop of the shared OpenAI client.
+    """
+
+    def __init__(self, rpm_limit: int = OPENAI_RPM_LIMIT, tpm_limit: int = OPENAI_TPM_LIMIT,
+                 max_concurrency: int = OPENAI_MAX_CONCURRENCY):
+        self.rpm = TokenBucket(rpm_limit) if rpm_limit else None
+        self.tpm = TokenBucket(tpm_limit) if tpm_limit else None
+        self.max_concurrency = max_concurrency
+        self._lock = None
+        self._slots = None
+        self.paused_until = 0.0
+        self.waiting = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = []
+
+    def _primitives(self):
+        # Created lazily so they bind to the loop the scheduler is used on
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._lock, self._slots
+
+    async def acquire(self, tokens: int) -> float:
+        """
+        Wait until the request fits into the budgets and return the seconds waited.
+        """
+        lock, slots = self._primitives()
+        start_time = time.monotonic()
+        self.waiting += 1
+        try:
+            async with lock:
+                while True:
+                    wait = max(
+                        self.paused_until - time.monotonic(),
+                        self.rpm.wait_time(1) if self.rpm else 0.0,
+                        self.tpm.wait_time(tokens) if self.tpm else 0.0
+                    )
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                if self.rpm:
+                    self.rpm.consume(1)
+                if self.tpm:
+                    self.tpm.consume(tokens)
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+        waited = time.monotonic() - start_time
+        self.requests += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.recent_waits = (self.recent_waits + [waited])[-100:]
+        if waited > 1:
+            logger.info(f"OpenAI request waited {waited:.2f}s for rate limits ({self.waiting} still queued).")
+        return waited
+
+    def pause(self, seconds: float):
+        """
+        Hold back every new request for the given time, e.g. after a 429 with Retry-After.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def release(self, estimated_tokens: int, used_tokens: int = None):
+        """
+        Free the concurrency slot and correct the TPM bucket by the real usage when known.
+        """
+        self.in_flight -= 1
+        self._primitives()[1].release()
+        if self.tpm and used_tokens is not None:
+            self.tpm.adjust(used_tokens - estimated_tokens)
+
+    def stats(self) -> dict:
+        recent = sorted(self.recent_waits)
+        return {
+            "queue_depth": self.waiting,
+            "paused_seconds": round(max(self.paused_until - time.monotonic(), 0.0), 1),
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "avg_wait_seconds": round(self.total_wait / self.requests, 3) if self.requests else 0.0,
+            "p95_wait_seconds": round(recent[int(len(recent) * 0.95)] if recent else 0.0, 3),
+            "max_wait_seconds": round(self.max_wait, 3),
+            "rpm_limit": int(self.rpm.capacity) if self.rpm else None,
+            "rpm_available": int(self.rpm.level) if self.rpm else None,
+            "tpm_limit": int(self.tpm.capacity) if self.tpm else None,
+            "tpm_available": int(self.tpm.level) if self.tpm else None,
+        }
+
+
+request_scheduler = RequestScheduler()
@@ -0,0 +1,176 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Rendered pages are shared between /analyze/, /completeness-check/ and re-runs,
+# so they live in one cache folder for all projects.
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", os.path.join(os.getcwd(), "uploads", ".render_cache"))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+
+def file_hash(path: str) -> str:
+    """
+    Return the SHA-256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def profile_key(profile, variant: str = "") -> str:
+    """
+    Return a stable string for a render profile (and optional variant such as a plan half).
+    """
+    key = json.dumps(profile, sort_keys=True) if isinstance(profile, dict) else str(profile)
+    return f"{key}|{variant}" if variant else key
+
+
+class RenderCache:
+    """
+    Content-addressed store of rendered page images.
+
+    Entries are keyed by (PDF content hash, page index, render profile) and
+    evicted least-recently-used first once the folder grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir: str = RENDER_CACHE_DIR, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = None  # key -> size, oldest first
+        self._size = 0
+
+    @staticmethod
+    def key(content_hash: str, page_index: int, profile: str) -> str:
+        return hashlib.sha256(f"{content_hash}:{page_index}:{profile}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load_index(self):
+        # Called with the lock held. Rebuilds the LRU order from file mtimes.
+        if self._entries is not None:
+            return
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith(".tmp"):
+                        continue
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name, stat.st_size))
+        entries.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in entries)
+        self._size = sum(self._entries.values())
+
+    def get(self, key: str, count: bool = True):
+        """
+        Return the path of a cached entry, or None on a miss.
+
+        With count=False the lookup is left out of the hit/miss counters, for
+        callers that look up several entries per item and count it themselves
+        (see record_lookup).
+        """
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+            if key in self._entries and os.path.exists(path):
+                if count:
+                    self.hits += 1
+                self._entries.move_to_end(key)
+                os.utime(path)
+                return path
+            self._entries.pop(key, None)
+            if count:
+                self.misses += 1
+            return None
+
+    def record_lookup(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_bytes(self, key: str, count: bool = True):
+        path = self.get(key, count)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def copy_to(self, key: str, destination: str) -> bool:
+        """
+        Copy a cached entry to destination. Returns False on a miss.
+        """
+        path = self.get(key)
+        if path is None:
+            return False
+        shutil.copyfile(path, destination)
+        return True
+
+    def put(self, key: str, source_path: str = None, data: bytes = None):
+        """
+        Store a file or raw bytes under key and evict old entries if needed.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if data is not None:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+            else:
+                shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Failed to write render cache entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        size = os.path.getsize(path)
+        with self._lock:
+            self._load_index()
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held.
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+render_cache = RenderCache()
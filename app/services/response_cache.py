@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+# On-disk cache of OpenAI responses, keyed by a hash of the full request payload
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", 500))
+# Call sites that may use the cache (comma separated, empty disables the cache)
+LLM_CACHE_FUNCTIONS = {
+    name.strip()
+    for name in os.getenv("LLM_CACHE_FUNCTIONS", "page,final_fields,comparison,extract_location,PdfReport").split(",")
+    if name.strip()
+}
+# Skip lookups (responses are still stored) for every request of this process
+LLM_CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "false").lower() in ("1", "true", "yes")
+
+# Eviction runs every this many stores
+EVICT_EVERY = 100
+
+_bypass = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+def set_cache_bypass(bypass: bool = True):
+    """
+    Skip cache lookups for the rest of the current request (context), e.g. to force a fresh analysis.
+    Fresh responses are still written to the cache.
+    """
+    _bypass.set(bypass)
+
+
+def cache_key(payload: dict) -> str:
+    """
+    Hash of model, messages and all other request parameters.
+    """
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite cache of chat completion responses with a TTL and a size limit.
+
+    Entries older than ttl are ignored and deleted. When the stored responses
+    grow past max_mb, the least recently used ones are evicted. Hits and the
+    latency they saved (the original request time) are counted per call site.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL, max_mb: float = LLM_CACHE_MAX_MB,
+                 functions: set = LLM_CACHE_FUNCTIONS):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.functions = set(functions)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._stores = 0
+        self.counters = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, function TEXT, response TEXT, latency REAL, "
+                "size INTEGER, created REAL, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+        return self._conn
+
+    def enabled(self, function: str) -> bool:
+        return function in self.functions
+
+    def bypassed(self) -> bool:
+        return LLM_CACHE_BYPASS or _bypass.get()
+
+    def _count(self, function: str, key: str, amount=1):
+        counters = self.counters.setdefault(function, {"hits": 0, "misses": 0, "saved_seconds": 0.0})
+        counters[key] += amount
+
+    def get(self, function: str, key: str):
+        """
+        Return the cached response json, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute("SELECT response, latency, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[2] > self.ttl:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    row = None
+                if row is None:
+                    self._count(function, "misses")
+                    return None
+                conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache lookup failed: {e}")
+                return None
+            self._count(function, "hits")
+            self._count(function, "saved_seconds", row[1])
+        return json.loads(row[0])
+
+    def put(self, function: str, key: str, response_json: dict, latency: float):
+        data = json.dumps(response_json, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, function, response, latency, size, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, function, data, latency, len(data), now, now)
+                )
+                self._stores += 1
+                if self._stores % EVICT_EVERY == 0:
+                    self._evict(conn)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache write failed: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        expired = conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        evicted = 0
+        if total > self.max_bytes:
+            # Drop the least recently used entries until the cache is 10% below the limit
+            excess = total - int(self.max_bytes * 0.9)
+            freed = 0
+            keys = []
+            for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used"):
+                if freed >= excess:
+                    break
+                keys.append((key,))
+                freed += size
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", keys)
+            evicted = len(keys)
+        if expired or evicted:
+            logger.info(f"LLM cache: removed {expired} expired and evicted {evicted} entries.")
+
+    def evict(self):
+        with self._lock:
+            self._evict(self._connect())
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM llm_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            try:
+                entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+            except sqlite3.Error:
+                entries, size = None, None
+            functions = {name: dict(counters) for name, counters in self.counters.items()}
+        hits = sum(counters["hits"] for counters in functions.values())
+        lookups = hits + sum(counters["misses"] for counters in functions.values())
+        for counters in functions.values():
+            counters["saved_seconds"] = round(counters["saved_seconds"], 2)
+        return {
+            "enabled_functions": sorted(self.functions),
+            "entries": entries,
+            "size_mb": round(size / 1024 / 1024, 2) if size is not None else None,
+            "hits": hits,
+            "lookups": lookups,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(sum(counters["saved_seconds"] for counters in functions.values()), 2),
+            "functions": functions,
+        }
+
+
+response_cache = ResponseCache()
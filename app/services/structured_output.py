@@ -0,0 +1,110 @@
+from typing import List, Literal
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
+
+# Reply models of the reducer and comparison calls. They are sent to OpenAI as
+# strict JSON schemas (response_format "json_schema") and replies are validated
+# against them, so a malformed reply is caught right at the call that made it.
+
+
+class StrictModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+class FieldValue(StrictModel):
+    value: str
+
+
+class LocationValue(StrictModel):
+    location: str
+
+
+class AnalysisSummary(StrictModel):
+    project_title: str
+    project_location: str
+    client_applicant: str
+    project_type: str
+    building_class: str
+    building_usage: str
+    number_of_floors: str
+    gross_floor_area: str
+    volume_of_the_building: str
+    technical_data: str
+    relevant_authorities: str
+
+
+# Keys of the analysis result as stored in AnalysisResult.result_data
+ANALYSIS_LABELS = {
+    "project_title": "Project title",
+    "project_location": "Project location",
+    "client_applicant": "client/Applicant",
+    "project_type": "Project type",
+    "building_class": "Building class",
+    "building_usage": "building usage",
+    "number_of_floors": "number of floors",
+    "gross_floor_area": "Gross floor area",
+    "volume_of_the_building": "volume of the building",
+    "technical_data": "Technical Data",
+    "relevant_authorities": "Relevant authorities",
+}
+
+
+class FieldCompliance(StrictModel):
+    compliance_status: Literal["compliant", "non_compliant"]
+    issues: List[str]
+    recommended_actions: List[str]
+    additional_checks: List[str]
+
+
+def compliance_report_model(fields) -> type:
+    """
+    Reply model of the comparison: the overall status plus one FieldCompliance per field.
+    """
+    return create_model(
+        "ComplianceReport",
+        __base__=StrictModel,
+        overall_status=(Literal["compliant", "non_compliant"], ...),
+        **{field: (FieldCompliance, ...) for field in fields}
+    )
+
+
+class RequiredDocumentStatus(StrictModel):
+    name: str
+    status: str
+    action_needed: str
+
+
+class CompletenessConclusion(StrictModel):
+    complete: List[str]
+    missing: List[str]
+
+
+class CompletenessReport(StrictModel):
+    application_type: str
+    status: Literal["Complete", "Incomplete"]
+    required_documents: List[RequiredDocumentStatus]
+    conclusion: CompletenessConclusion
+
+
+def response_format(model: type) -> dict:
+    """
+    OpenAI response_format asking for a reply matching the model's JSON schema.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": model.__name__,
+            "strict": True,
+            "schema": model.model_json_schema()
+        }
+    }
+
+
+def validation_summary(error: ValidationError, limit: int = 5) -> str:
+    """
+    Short description of what is wrong with a reply, to send back with the re-ask.
+    """
+    problems = [
+        f"{'.'.join(str(part) for part in item['loc']) or 'reply'}: {item['msg']}"
+        for item in error.errors()[:limit]
+    ]
+    return "; ".join(problems)
@@ -0,0 +1,139 @@
+import os
+import json
+import hashlib
+import logging
+from .image_service import read_page_manifest
+
+logger = logging.getLogger(__name__)
+
+# Persisted next to the page manifest so that re-runs reuse it
+TRIAGE_INDEX = "triage.json"
+
+# Pages with less text than this cannot be triaged by keywords (scans, pure drawings)
+TRIAGE_MIN_CHARS = int(os.getenv("TRIAGE_MIN_CHARS", 40))
+
+# Keywords (lower case, German and English) that make a page relevant for a field
+FIELD_KEYWORDS = {
+    "location_within_building_zone": ["lage", "grundstück", "flurstück", "gemarkung", "baugebiet", "bebauungsplan", "straße", "location", "zone"],
+    "building_use_type": ["nutzung", "wohn", "gewerbe", "kindergarten", "kinderkrippe", "büro", "building use"],
+    "building_style": ["bauweise", "fassade", "ansicht", "architekt", "building style"],
+    "grz": ["grz", "grundflächenzahl", "grundfläche", "ground area ratio"],
+    "gfz": ["gfz", "geschossflächenzahl", "geschossfläche", "floor area ratio"],
+    "building_height": ["höhe", "firsthöhe", "traufhöhe", "oberkante", "schnitt", "ansicht", "height"],
+    "number_of_floors": ["geschoss", "erdgeschoss", "obergeschoss", "dachgeschoss", "grundriss", "floors", "storey"],
+    "roof_shape": ["dach", "satteldach", "flachdach", "pultdach", "walmdach", "dachneigung", "roof"],
+    "dormers": ["gaube", "dachgaube", "dormer"],
+    "roof_orientation": ["firstrichtung", "dachausrichtung", "ausrichtung", "lageplan", "orientation"],
+    "parking_spaces": ["stellplatz", "stellplätze", "garage", "carport", "parken", "parking"],
+    "outdoor_space": ["freifläche", "freiflächen", "außenanlage", "grünfläche", "spielplatz", "outdoor"],
+    "setback_area": ["abstandsfläche", "abstandsflächen", "grenzabstand", "setback"],
+    "setback_relevant_filling_work": ["aufschüttung", "abgrabung", "geländeoberfläche", "gelände", "filling"],
+    "deviations_from_b_plan": ["abweichung", "befreiung", "bebauungsplan", "b-plan", "deviation"],
+    "exemptions_required": ["befreiung", "ausnahme", "abweichung", "exemption"],
+    "species_protection_check": ["artenschutz", "naturschutz", "baum", "fledermaus", "vögel", "species"],
+    "compliance_with_zoning_rules": ["bebauungsplan", "baunvo", "baugb", "festsetzung", "zoning"],
+    "compliance_with_building_codes": ["bauordnung", "hbo", "sächsbo", "brandschutz", "din ", "building code"],
+}
+
+# Fields that are usually read off plans, sections and elevations rather than text.
+# Drawing-heavy pages are always candidates for them.
+DRAWING_FIELDS = {
+    "building_style", "building_height", "number_of_floors", "roof_shape", "dormers",
+    "roof_orientation", "parking_spaces", "outdoor_space", "setback_area",
+    "setback_relevant_filling_work", "grz", "gfz",
+}
+
+
+def page_relevant_fields(page_info: dict) -> dict:
+    """
+    Return the fields a page is a candidate for, with the keywords that matched.
+
+    Pages without enough text to decide on are candidates for every field.
+    Drawing-heavy pages are candidates for DRAWING_FIELDS and for every field
+    whose keywords appear on them. Text-rich pages only for matching fields.
+    """
+    text = (page_info.get("text") or "").lower()
+    if page_info.get("chars", len(text)) < TRIAGE_MIN_CHARS:
+        return {field: [] for field in FIELD_KEYWORDS}
+    relevant = {}
+    for field, keywords in FIELD_KEYWORDS.items():
+        hits = [keyword for keyword in keywords if keyword in text]
+        if hits or (not page_info.get("text_rich") and field in DRAWING_FIELDS):
+            relevant[field] = hits
+    return relevant
+
+
+def _fingerprint(manifest: dict) -> str:
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def build_triage_index(manifest: dict) -> dict:
+    """
+    Build the field -> page relevance index from a page manifest.
+
+    Returns:
+    dict: "pages" with the features and matched keywords of every page, and
+    "fields" mapping each field to its candidate image files.
+    """
+    pages = {}
+    fields = {field: [] for field in FIELD_KEYWORDS}
+    for file, page_info in sorted(manifest.items()):
+        relevant = page_relevant_fields(page_info)
+        pages[file] = {
+            "chars": page_info.get("chars"),
+            "drawings": page_info.get("drawings"),
+            "images": page_info.get("images"),
+            "width_mm": page_info.get("width_mm"),
+            "height_mm": page_info.get("height_mm"),
+            "text_rich": page_info.get("text_rich"),
+            "keywords": {field: hits for field, hits in relevant.items() if hits},
+        }
+        for field in relevant:
+            fields[field].append(file)
+    return {"fingerprint": _fingerprint(manifest), "pages": pages, "fields": fields}
+
+
+def load_triage_index(images_path: str) -> dict:
+    """
+    Return the triage index of an image folder, building and saving it when
+    it is missing or the page manifest changed since it was built.
+    """
+    manifest = read_page_manifest(images_path)
+    index_path = os.path.join(images_path, TRIAGE_INDEX)
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("fingerprint") == _fingerprint(manifest):
+            logger.info("Reusing page triage index.")
+            return index
+
+    index = build_triage_index(manifest)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+    logger.info(f"Built page triage index for {len(index['pages'])} pages.")
+    return index
+
+
+def select_pages(index: dict, field: str, files: list, pages: list) -> list:
+    """
+    Return the pages that are candidates for a field, in their original order.
+
+    Pages missing from the index (e.g. rendered before triage existed) are
+    always kept, and a field without any candidate falls back to all pages.
+    """
+    candidates = set(index["fields"].get(field, []))
+    selected = [page for file, page in zip(files, pages) if file in candidates or file not in index["pages"]]
+    return selected or list(pages)
+
+
+def log_triage_savings(index: dict, files: list, fields) -> int:
+    """
+    Log and return how many page requests the triage index avoids for the given fields.
+    """
+    total = len(files) * len(fields)
+    selected = sum(len(select_pages(index, field, files, files)) for field in fields)
+    avoided = total - selected
+    logger.info(f"Page triage: {selected} of {total} field requests needed, {avoided} avoided.")
+    return avoided
@@ -0,0 +1,266 @@
+import os
+import time
+import atexit
+import logging
+import threading
+import contextvars
+from datetime import datetime
+from contextlib import contextmanager
+from sqlalchemy import func, case
+from ..database.database import SessionLocal
+from ..models import models
+from .job_context import current_job
+
+logger = logging.getLogger(__name__)
+
+# Ledger rows are written in batches by a background thread, at least every
+# LEDGER_FLUSH_SECONDS or as soon as LEDGER_FLUSH_SIZE rows are waiting
+LEDGER_ENABLED = os.getenv("OPENAI_LEDGER", "true").lower() in ("1", "true", "yes")
+LEDGER_FLUSH_SECONDS = float(os.getenv("LEDGER_FLUSH_SECONDS", 5))
+LEDGER_FLUSH_SIZE = int(os.getenv("LEDGER_FLUSH_SIZE", 200))
+
+# USD per 1M tokens: input, cached input, output. Batch API requests cost half.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+BATCH_DISCOUNT = 0.5
+
+_document = contextvars.ContextVar("ledger_document", default=None)
+_field = contextvars.ContextVar("ledger_field", default=None)
+_escalated = contextvars.ContextVar("ledger_escalated", default=False)
+
+
+def set_ledger_document(document_id: int):
+    """
+    Attribute the OpenAI requests of the rest of the current request (context) to a document.
+    """
+    _document.set(document_id)
+
+
+@contextmanager
+def ledger_field(field: str):
+    """
+    Attribute the OpenAI requests made inside the block to a field.
+    """
+    token = _field.set(field)
+    try:
+        yield
+    finally:
+        _field.reset(token)
+
+
+def current_ledger_field():
+    return _field.get()
+
+
+@contextmanager
+def ledger_escalation(escalated: bool = True):
+    """
+    Mark the OpenAI requests made inside the block as escalations of a rejected small-model reply.
+    """
+    token = _escalated.set(escalated)
+    try:
+        yield
+    finally:
+        _escalated.reset(token)
+
+
+def in_field(field: str, fn, /, *args, **kwargs):
+    """
+    Call fn inside ledger_field(field), e.g. as the target of an executor.
+    """
+    with ledger_field(field):
+        return fn(*args, **kwargs)
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0, batch: bool = False) -> float:
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        # Dated snapshots (e.g. gpt-4o-2024-08-06) cost the same as their model
+        prices = next((price for name, price in MODEL_PRICES.items() if model and model.startswith(name + "-")), None)
+    if prices is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1e6
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+class UsageLedger:
+    """
+    Buffers one row per OpenAI request and writes them to the openai_calls table in batches.
+
+    record() only appends to a list, so the request path never waits for the
+    database. A daemon thread flushes the buffer, and the rest is flushed when
+    the process exits.
+    """
+
+    def __init__(self, session_factory=SessionLocal, flush_seconds: float = LEDGER_FLUSH_SECONDS,
+                 flush_size: int = LEDGER_FLUSH_SIZE):
+        self.session_factory = session_factory
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.written = 0
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def record(self, response_json: dict = None, stage: str = None, model: str = None, latency: float = 0.0,
+               retries: int = 0, status_code: int = 200, from_cache: bool = False, batch: bool = False):
+        """
+        Queue a ledger row for one request. The usage is read from response_json when there is one.
+        """
+        if not LEDGER_ENABLED:
+            return
+        # Cached responses used no tokens this time
+        usage = {} if from_cache else (response_json or {}).get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+        model = (response_json or {}).get("model") or model
+        cost = call_cost(model, prompt_tokens, completion_tokens, cached_tokens, batch)
+        job = current_job()
+        row = {
+            "document_id": _document.get(),
+            "job": job["job"] if job is not None else None,
+            "stage": stage,
+            "field": _field.get(),
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "latency": round(latency, 3),
+            "retries": retries,
+            "status_code": status_code,
+            "from_cache": from_cache,
+            "batch": batch,
+            "escalated": _escalated.get(),
+            "cost": cost,
+            "created_at": datetime.utcnow(),
+        }
+        with self._lock:
+            self._rows.append(row)
+            pending = len(self._rows)
+            self._start()
+        if pending >= self.flush_size:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Write the buffered rows, e.g. before reading the ledger.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+            start_time = time.time()
+            db = self.session_factory()
+            try:
+                db.bulk_insert_mappings(models.OpenAICall, rows)
+                db.commit()
+                self.written += len(rows)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Could not write {len(rows)} OpenAI ledger rows: {e}")
+            finally:
+                db.close()
+            logger.debug(f"Wrote {len(rows)} OpenAI ledger rows in {time.time() - start_time:.3f}s.")
+
+
+def aggregate_calls(db, group_by: tuple = (), document_ids: list = None) -> list:
+    """
+    Sum up the ledger rows per group, most expensive group first.
+
+    Args:
+    group_by: Column names of OpenAICall to group by, e.g. ("stage", "field").
+    document_ids: Only count the requests of these documents.
+
+    Returns:
+    list: one dict per group with the group columns, request count, tokens, latency, retries, errors,
+    escalated requests and cost
+    """
+    call = models.OpenAICall
+    columns = [getattr(call, name) for name in group_by]
+    query = db.query(
+        *columns,
+        func.count(call.id).label("requests"),
+        func.sum(case((call.from_cache.is_(True), 1), else_=0)).label("cache_hits"),
+        func.sum(case((call.status_code != 200, 1), else_=0)).label("errors"),
+        func.sum(case((call.escalated.is_(True), 1), else_=0)).label("escalations"),
+        func.sum(call.prompt_tokens).label("prompt_tokens"),
+        func.sum(call.completion_tokens).label("completion_tokens"),
+        func.sum(call.cached_tokens).label("cached_tokens"),
+        func.sum(call.retries).label("retries"),
+        func.sum(call.latency).label("latency_seconds"),
+        func.max(call.latency).label("max_latency_seconds"),
+        func.sum(call.cost).label("cost"),
+    )
+    if document_ids is not None:
+        query = query.filter(call.document_id.in_(document_ids))
+    if columns:
+        query = query.group_by(*columns)
+    rows = []
+    for row in query.all():
+        row = dict(row._mapping)
+        if not row["requests"]:
+            continue
+        row["avg_latency_seconds"] = round((row["latency_seconds"] or 0) / row["requests"], 3)
+        row["latency_seconds"] = round(row["latency_seconds"] or 0, 2)
+        row["cost"] = round(row["cost"] or 0, 4)
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["cost"], reverse=True)
+
+
+def prompt_cache_report(db, document_ids: list = None) -> list:
+    """
+    Provider prompt cache usage per prompt (stage and field), from the ledger.
+
+    Only requests actually sent to OpenAI are counted: no response cache hits and no errors.
+    The latency change compares requests that got cached prompt tokens with those that did not.
+
+    Returns:
+    list: one dict per prompt with requests, prompt and cached tokens, the share of prompt
+    tokens served from the cache, and the average latency with and without a cache hit
+    """
+    call = models.OpenAICall
+    hit = call.cached_tokens > 0
+    query = db.query(
+        call.stage,
+        call.field,
+        func.count(call.id).label("requests"),
+        func.sum(case((hit, 1), else_=0)).label("requests_with_cached_tokens"),
+        func.sum(call.prompt_tokens).label("prompt_tokens"),
+        func.sum(call.cached_tokens).label("cached_tokens"),
+        func.avg(case((hit, call.latency), else_=None)).label("avg_latency_cached"),
+        func.avg(case((hit, None), else_=call.latency)).label("avg_latency_uncached"),
+    ).filter(call.from_cache.is_(False), call.status_code == 200)
+    if document_ids is not None:
+        query = query.filter(call.document_id.in_(document_ids))
+    rows = []
+    for row in query.group_by(call.stage, call.field).all():
+        row = dict(row._mapping)
+        row["cache_hit_ratio"] = round((row["cached_tokens"] or 0) / row["prompt_tokens"], 3) if row["prompt_tokens"] else 0.0
+        cached, uncached = row["avg_latency_cached"], row["avg_latency_uncached"]
+        row["avg_latency_cached"] = round(cached, 3) if cached is not None else None
+        row["avg_latency_uncached"] = round(uncached, 3) if uncached is not None else None
+        row["latency_change"] = round((cached - uncached) / uncached, 3) if cached is not None and uncached else None
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["prompt_tokens"] or 0, reverse=True)
+
+
+usage_ledger = UsageLedger()
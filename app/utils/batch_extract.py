@@ -0,0 +1,132 @@
+"""
+Extract the project details of a backlog of uploaded projects through the OpenAI Batch API.
+
+Usage:
+    python -m app.utils.batch_extract                  # every project without project details
+    python -m app.utils.batch_extract --doc-ids 3 7 12
+    OPENAI_BATCH_TRANSPORT=local python -m app.utils.batch_extract --doc-ids 3
+
+All page/field requests of all projects go into one batch (split into several
+input files when the Batch API limits require it). Once the batch is done,
+the replies are fed into the usual reducers and saved just like /analyze/ does.
+"""
+import os
+import time
+import logging
+import argparse
+from ..database.database import SessionLocal
+from ..models import models
+from ..services.batch_service import BatchJob, run_batch
+from ..services.dedup_service import load_dedup_map
+from ..services.image_service import list_page_files, encode_pages
+from ..services.pdf_service import process_pdfs
+from ..services.openai_service import (
+    FIELD_PROMPTS, add_page_requests, collect_page_responses, triage_candidates, reduce_field_responses,
+    final_response, extract_location
+)
+from ..services.file_service import save_analysis_into_db, save_project_details_into_db
+from ..services.job_context import with_job
+from ..services.usage_ledger import set_ledger_document, usage_ledger
+from app.utils.utils import mapping, get_coordinates
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = os.path.join(os.getcwd(), "uploads")
+
+
+def pending_documents(db, doc_ids: list = None) -> list:
+    """
+    Documents to process: the given ids, or every document without project details.
+    """
+    query = db.query(models.Document)
+    if doc_ids:
+        return query.filter(models.Document.id.in_(doc_ids)).all()
+    done = {row.document_id for row in db.query(models.ProjectDetails.document_id).all()}
+    return [document for document in query.all() if document.id not in done]
+
+
+def project_images(document) -> str:
+    """
+    Return the page image folder of a project, rendering its PDFs first when needed.
+    """
+    project_name = document.file_name
+    img_folder = os.path.join(CURRENT_DIR, str(document.user_id), project_name, "images", "Project_images")
+    if not os.path.exists(img_folder) or not list_page_files(img_folder):
+        pdf_folder = os.path.join(CURRENT_DIR, str(document.user_id), project_name, "pdfs", project_name)
+        pdf_paths = [os.path.join(pdf_folder, file) for file in os.listdir(pdf_folder)]
+        process_pdfs(pdf_paths, folder_path=img_folder, project_name=project_name)
+    return img_folder
+
+
+@with_job("batch-extract")
+def batch_extract(db, documents: list) -> dict:
+    """
+    Run the extraction of all documents as one batch and save the results.
+
+    Returns:
+    dict: document id -> extracted fields
+    """
+    start_time = time.time()
+    batch = BatchJob(name=f"backlog-{int(start_time)}")
+    prepared = []
+    for document in documents:
+        try:
+            images_path = project_images(document)
+        except OSError as e:
+            logger.error(f"Skipping document {document.id}, no PDFs or images found: {e}")
+            continue
+        page_files = load_dedup_map(images_path, list_page_files(images_path))["kept"]
+        encoded_images = encode_pages(images_path=images_path, files=page_files)
+        candidates = triage_candidates(images_path, page_files, encoded_images)
+        add_page_requests(batch, candidates, analysis_pages=encoded_images, prefix=f"{document.id}:")
+        prepared.append(document)
+    if not prepared:
+        return {}
+
+    print(f"Sending {batch.requests} requests for {len(prepared)} projects through the batch API")
+    results = run_batch(batch)
+    duration = (time.time() - start_time) / 60
+
+    extracted = {}
+    for document in prepared:
+        set_ledger_document(document.id)
+        responses = collect_page_responses(results, prefix=f"{document.id}:")
+        extracted_fields = reduce_field_responses({field: responses[field] for field in FIELD_PROMPTS})
+        response = final_response(responses=responses["analysis"])
+        location = extract_location(extracted_fields.get("location_within_building_zone"))
+        latitude, longitude = get_coordinates(location)
+        save_analysis_into_db(db=db, response=response, duration=duration, doc_id=document.id)
+        save_project_details_into_db(
+            db=db,
+            user_id=document.user_id,
+            document_id=document.id,
+            latitude=latitude,
+            longitude=longitude,
+            **{key: extracted_fields.get(value) for key, value in mapping.items()}
+        )
+        logger.info(f"Saved the project details of document {document.id} ({document.file_name}).")
+        extracted[document.id] = extracted_fields
+    usage_ledger.flush()
+    return extracted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract project details of uploaded projects through the OpenAI Batch API.")
+    parser.add_argument("--doc-ids", nargs="+", type=int, help="Documents to process, default: all without project details.")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the documents that would be processed.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        documents = pending_documents(db, args.doc_ids)
+        print(f"{len(documents)} projects to process: {[document.id for document in documents]}")
+        if not args.dry_run:
+            extracted = batch_extract(db, documents)
+            print(f"Saved the project details of {len(extracted)} projects.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Compare the extraction modes on an already rendered image folder.
+
+Usage:
+    python -m app.utils.benchmark_extraction uploads/<user>/<project>/images/Project_images
+    python -m app.utils.benchmark_extraction <images_path> --bplan
+    python -m app.utils.benchmark_extraction <images_path> --packing
+    python -m app.utils.benchmark_extraction --reduce 120
+
+Every mode runs the full extraction against the OpenAI API, so this costs
+real requests. Request count, tokens and wall time are reported per mode.
+With --packing the per_field mode is run with every field packed and with
+none packed instead (see send_packed_to_gpt).
+With --reduce N no images are needed: the field reducers are run on N
+synthetic page replies per field, once in a single request per field and
+once as a tree reduce (see tree_reduce).
+"""
+import json
+import time
+import argparse
+from ..services import openai_service
+from ..services.openai_service import (
+    INTERACTIVE_EXTRACTION_MODES, FIELD_PROMPTS, extracting_project_details, extracting_bplan_details, reduce_field_responses,
+    api_stats_snapshot
+)
+
+
+def run_benchmark(images_path: str, modes=INTERACTIVE_EXTRACTION_MODES, bplan: bool = False) -> dict:
+    """
+    Run the extraction once per mode and return the stats of every run.
+    """
+    results = {}
+    for mode in modes:
+        if bplan:
+            details = extracting_bplan_details(db=None, user_id=None, doc_id=None, b_plan_path=images_path, mode=mode)
+        else:
+            details = extracting_project_details(images_path=images_path, mode=mode)
+        results[mode] = details["stats"]
+    return results
+
+
+def run_packing_benchmark(images_path: str, bplan: bool = False) -> dict:
+    """
+    Run the per_field extraction unpacked and with every field packed and return the stats of both runs.
+    """
+    packed_fields = openai_service.PACKED_FIELDS
+    results = {}
+    try:
+        for name, fields in (("unpacked", set()), ("packed", set(FIELD_PROMPTS))):
+            openai_service.PACKED_FIELDS = fields
+            results[name] = run_benchmark(images_path, ["per_field"], bplan)["per_field"]
+    finally:
+        openai_service.PACKED_FIELDS = packed_fields
+    return results
+
+
+def synthetic_responses(field: str, pages: int, chars: int = 1500) -> list:
+    """
+    Page replies of a synthetic project, every page mentioning a slightly different value.
+    """
+    responses = []
+    for page in range(1, pages + 1):
+        text = f"Page {page}: The {field} stated on this page is value {page % 7}. "
+        responses.append((text * (chars // len(text) + 1))[:chars])
+    return responses
+
+
+def run_reduce_benchmark(pages: int, fan_in: int = None, fields=None) -> dict:
+    """
+    Reduce synthetic page replies of the fields (default all) flat, with one request per field,
+    and as a tree, return the stats of both.
+    """
+    responses = {field: synthetic_responses(field, pages) for field in fields or FIELD_PROMPTS}
+    chunk_tokens, reduce_fan_in = openai_service.REDUCE_CHUNK_TOKENS, openai_service.REDUCE_FAN_IN
+    results = {}
+    try:
+        for name, (tokens, width) in (("flat", (10 ** 9, 10 ** 9)), ("tree", (chunk_tokens, fan_in or reduce_fan_in))):
+            openai_service.REDUCE_CHUNK_TOKENS, openai_service.REDUCE_FAN_IN = tokens, width
+            before = api_stats_snapshot()
+            start_time = time.time()
+            reduce_field_responses(responses)
+            after = api_stats_snapshot()
+            stats = {key: after[key] - before[key] for key in after}
+            stats["seconds"] = round(time.time() - start_time, 2)
+            results[name] = stats
+    finally:
+        openai_service.REDUCE_CHUNK_TOKENS, openai_service.REDUCE_FAN_IN = chunk_tokens, reduce_fan_in
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare request count, tokens and wall time of the extraction modes.")
+    parser.add_argument("images_path", nargs="?", help="Folder with rendered page images.")
+    parser.add_argument("--modes", nargs="+", choices=list(INTERACTIVE_EXTRACTION_MODES), default=list(INTERACTIVE_EXTRACTION_MODES))
+    parser.add_argument("--bplan", action="store_true", help="Run the B-plan extraction instead of the project one.")
+    parser.add_argument("--packing", action="store_true", help="Compare packed and unpacked requests instead of the modes.")
+    parser.add_argument("--reduce", type=int, metavar="PAGES", help="Compare flat and tree reduce on this many synthetic pages.")
+    parser.add_argument("--fan-in", type=int, help="Fan-in of the tree reduce, default REDUCE_FAN_IN.")
+    parser.add_argument("--fields", nargs="+", choices=list(FIELD_PROMPTS), help="Fields to reduce with --reduce, default all.")
+    parser.add_argument("--json", action="store_true", help="Print the stats as JSON.")
+    args = parser.parse_args(argv)
+
+    if args.reduce:
+        results = run_reduce_benchmark(args.reduce, args.fan_in, args.fields)
+    elif not args.images_path:
+        parser.error("images_path is required unless --reduce is given")
+    elif args.packing:
+        results = run_packing_benchmark(args.images_path, args.bplan)
+    else:
+        results = run_benchmark(args.images_path, args.modes, args.bplan)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for mode, stats in results.items():
+        print(
+            f"{mode}: {stats['requests']} requests, {stats['total_tokens']} tokens "
+            f"({stats['prompt_tokens']} prompt, {stats['completion_tokens']} completion), {stats['seconds']}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
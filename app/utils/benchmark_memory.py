@@ -0,0 +1,192 @@
+"""
+Compare the memory peak of the page image paths on a synthetic A0 page.
+
+Usage:
+    python -m app.utils.benchmark_memory
+    python -m app.utils.benchmark_memory --dpi 200 --grayscale
+
+Every variant runs in a fresh process and reports its tracemalloc peak
+(Python-side allocations, e.g. the bytes copy of pix.samples) and the growth
+of its peak RSS (everything, PIL and MuPDF buffers included).
+
+    render-frombytes         pix.samples copied into Image.frombytes and fingerprinted, as before
+    render-frombuffer        Image.frombuffer over pix.samples_mv (see pdf_service._pixmap_image)
+    render-frombuffer+encode the same plus save_page_image, the encoder's own copies are the
+                             same for both render paths (Pillow's WebP encoder copies the image to bytes)
+    payload-resize           full decode of a large JPEG, then resize to the payload size, as before
+    payload-draft            reduced-scale decode with Image.draft, then resize with reducing_gap
+
+PIL's decode buffers are not visible to tracemalloc, so the payload paths are compared by peak RSS.
+Exits with status 1 when render-frombuffer does not have a lower tracemalloc peak than
+render-frombytes, or payload-draft no lower peak RSS than payload-resize.
+"""
+import os
+import sys
+import resource
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+from io import BytesIO
+import fitz
+from PIL import Image
+from ..services.image_service import page_fingerprint, page_image_settings, save_page_image
+from ..services.pdf_service import _pixmap_image
+
+# A0 portrait in PDF points
+A0_SIZE = (2384, 3370)
+PAYLOAD_SIZE = (1024, 1024)
+
+
+def synthetic_plan(path: str):
+    """
+    Write a one-page A0 PDF with a grid, text and filled areas, roughly like a plan sheet.
+    """
+    doc = fitz.open()
+    width, height = A0_SIZE
+    page = doc.new_page(width=width, height=height)
+    for x in range(0, width, 40):
+        page.draw_line((x, 0), (x, height), color=(0.6, 0.6, 0.6), width=0.3)
+    for y in range(0, height, 40):
+        page.draw_line((0, y), (width, y), color=(0.6, 0.6, 0.6), width=0.3)
+    for index in range(12):
+        rect = fitz.Rect(100 + index * 180, 400 + index * 200, 260 + index * 180, 560 + index * 200)
+        page.draw_rect(rect, color=(0, 0, 0), fill=(0.2 + index * 0.05, 0.4, 0.7), width=1)
+    for line in range(60):
+        page.insert_text((120, 100 + line * 50), f"Grundriss Erdgeschoss, Achse {line}, GRZ 0.4, GFZ 0.8", fontsize=18)
+    doc.save(path)
+    doc.close()
+
+
+def _legacy_fingerprint(img):
+    # page_fingerprint before it downscaled first: a full-size grayscale copy
+    gray = img.convert("L")
+    gray.resize((17, 16), Image.Resampling.BILINEAR)
+    gray.resize((128, 128), Image.Resampling.BOX)
+
+
+def render_frombytes(pdf_path: str, dpi: int, settings: dict):
+    with fitz.open(pdf_path) as doc:
+        zoom = dpi / 72
+        pix = doc[0].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        if settings["grayscale"]:
+            img = img.convert("L")
+        _legacy_fingerprint(img)
+
+
+def render_frombuffer(pdf_path: str, dpi: int, settings: dict, encode: bool = False):
+    with fitz.open(pdf_path) as doc:
+        zoom = dpi / 72
+        colorspace = fitz.csGRAY if settings["grayscale"] else fitz.csRGB
+        pix = doc[0].get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+        img = _pixmap_image(pix)
+        page_fingerprint(img)
+        if encode:
+            save_page_image(img, settings, dpi)
+        del img, pix
+
+
+def payload_resize(jpeg_path: str):
+    with Image.open(jpeg_path) as img:
+        img = img.resize(PAYLOAD_SIZE)
+        buffered = BytesIO()
+        img.save(buffered, format="PNG")
+        return len(buffered.getvalue())
+
+
+def payload_draft(jpeg_path: str):
+    with Image.open(jpeg_path) as img:
+        img.draft("RGB", PAYLOAD_SIZE)
+        img = img.resize(PAYLOAD_SIZE, reducing_gap=3.0)
+        buffered = BytesIO()
+        img.save(buffered, format="PNG")
+        return len(buffered.getvalue())
+
+
+def peak_rss_kb() -> int:
+    """
+    Peak RSS of this process in KB. ru_maxrss survives exec, so a spawned child would
+    report its parent's peak, VmHWM (Linux) does not.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(target, args, results):
+    rss_before = peak_rss_kb()
+    tracemalloc.start()
+    target(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_growth = peak_rss_kb() - rss_before
+    results.put({"tracemalloc_peak_mb": round(peak / 1024 / 1024, 1), "rss_growth_mb": round(rss_growth / 1024, 1)})
+
+
+def measure(target, *args) -> dict:
+    """
+    Run target(*args) in a fresh process and return its tracemalloc peak and peak RSS growth.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(target, args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def run_benchmark(dpi: int = 150, grayscale: bool = False, folder: str = None) -> dict:
+    """
+    Measure every variant on a synthetic A0 page rendered at dpi and return the results per variant.
+    """
+    folder = folder or tempfile.mkdtemp(prefix="benchmark-memory-")
+    pdf_path = os.path.join(folder, "a0.pdf")
+    jpeg_path = os.path.join(folder, "a0.jpg")
+    synthetic_plan(pdf_path)
+    with fitz.open(pdf_path) as doc:
+        zoom = dpi / 72
+        pix = doc[0].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        _pixmap_image(pix).save(jpeg_path, format="JPEG", quality=85)
+        pixels = pix.width * pix.height
+        del pix
+
+    settings = page_image_settings(grayscale=grayscale)
+    results = {
+        "render-frombytes": measure(render_frombytes, pdf_path, dpi, settings),
+        "render-frombuffer": measure(render_frombuffer, pdf_path, dpi, settings),
+        "render-frombuffer+encode": measure(render_frombuffer, pdf_path, dpi, settings, True),
+        "payload-resize": measure(payload_resize, jpeg_path),
+        "payload-draft": measure(payload_draft, jpeg_path),
+    }
+    print(f"A0 page at {dpi} DPI: {pixels / 1e6:.1f}M pixels, {settings['format']}{' grayscale' if grayscale else ''}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the memory peak of the page image paths on a synthetic A0 page.")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--grayscale", action="store_true", help="Render and store the page in grayscale.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.dpi, args.grayscale)
+    for name, result in results.items():
+        print(f"{name}: tracemalloc peak {result['tracemalloc_peak_mb']} MB, peak RSS +{result['rss_growth_mb']} MB")
+
+    lower = (
+        results["render-frombuffer"]["tracemalloc_peak_mb"] < results["render-frombytes"]["tracemalloc_peak_mb"]
+        and results["payload-draft"]["rss_growth_mb"] < results["payload-resize"]["rss_growth_mb"]
+    )
+    if not lower:
+        print("A new path does not have a lower peak than the old one.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
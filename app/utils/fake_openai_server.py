@@ -0,0 +1,212 @@
+"""
+Minimal stand-in for the OpenAI chat completions endpoint, for tests and benchmarks.
+
+Usage:
+    python -m app.utils.fake_openai_server --port 8765 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test uvicorn app.main:app
+
+Every request is answered after the configured latency with a canned reply.
+With --token-latency the latency grows with the request size, like the
+prompt processing time of the real API does. Requests with stream=true
+get the reply as server-sent event chunks, the usage in the last one.
+With --prompt-cache a system prompt of at least 1024 tokens that was seen
+before is reported as cached_tokens (in steps of 128 tokens, like the real
+prompt cache) and does not count towards --token-latency.
+Requests asking for a JSON object get an empty JSON record, requests with a
+JSON schema the smallest reply matching it, with --confidence for a
+"confidence" property (the small model tier reports one). Token usage is
+estimated from the request size so the usage stats have something to count.
+With --error-rate a share of the requests is answered with --error-status
+(and a Retry-After header when --retry-after is set), to exercise retries.
+"""
+import json
+import re
+import time
+import random
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+PAGE_MARKER = re.compile(r"^Page \d+:$")
+
+# Prompt caching of the real API starts at 1024 prefix tokens and grows in steps of 128
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_STEP = 128
+
+
+def schema_instance(schema: dict, reply: str, defs: dict = None, confidence: float = 0.9):
+    """
+    Smallest value matching a JSON schema, with reply for every string and confidence for a confidence property.
+    """
+    defs = schema.get("$defs", defs or {})
+    if "$ref" in schema:
+        return schema_instance(defs[schema["$ref"].split("/")[-1]], reply, defs, confidence)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if schema.get("type") == "object":
+        return {
+            name: confidence if name == "confidence" else schema_instance(prop, reply, defs, confidence)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if schema.get("type") == "array":
+        return []
+    if schema.get("type") in ("integer", "number"):
+        return 0
+    if schema.get("type") == "boolean":
+        return False
+    return reply
+
+
+def fake_completion(payload: dict, reply: str = "- Project title: Fake", request_size: int = None,
+                    cached_tokens: int = 0, confidence: float = 0.9) -> dict:
+    """
+    Canned chat completion for a request payload, with usage estimated from the request size.
+    """
+    response_format = payload.get("response_format") or {}
+    json_mode = response_format.get("type") == "json_object"
+    content = reply
+    if response_format.get("type") == "json_schema":
+        content = json.dumps(schema_instance(response_format["json_schema"]["schema"], reply, confidence=confidence))
+    elif json_mode:
+        # Packed requests (several "Page N:" parts) get one answer per page, anything else an empty record
+        pages = [
+            part for message in payload.get("messages", []) if isinstance(message.get("content"), list)
+            for part in message["content"] if part.get("type") == "text" and PAGE_MARKER.match(part.get("text", ""))
+        ]
+        content = json.dumps({"pages": [{"page": number, "answer": reply} for number in range(1, len(pages) + 1)]}) if pages else "{}"
+    if request_size is None:
+        request_size = len(json.dumps(payload))
+    prompt_tokens = request_size // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "model": payload.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)}
+        }
+    }
+
+
+def cacheable_prefix(payload: dict) -> str:
+    """
+    The system prompt of a request, the part the fake prompt cache keys on.
+    """
+    messages = payload.get("messages") or []
+    if messages and messages[0].get("role") == "system":
+        return json.dumps(messages[0]["content"])
+    return ""
+
+
+def make_handler(latency: float, reply: str, error_rate: float = 0.0, error_status: int = 429, retry_after: float = None,
+                 token_latency: float = 0.0, prompt_cache: bool = False, confidence: float = 0.9):
+    seen_prefixes = set()
+
+    class FakeOpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not self.path.endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            payload = json.loads(body or b"{}")
+            cached_tokens = 0
+            if prompt_cache:
+                prefix = cacheable_prefix(payload)
+                prefix_tokens = len(prefix) // 4
+                if prefix_tokens >= PROMPT_CACHE_MIN_TOKENS:
+                    if prefix in seen_prefixes:
+                        cached_tokens = prefix_tokens // PROMPT_CACHE_STEP * PROMPT_CACHE_STEP
+                    seen_prefixes.add(prefix)
+            # Request size / 4 as the estimated prompt tokens, like the usage in fake_completion
+            time.sleep(latency + token_latency * max(len(body) / 4 - cached_tokens, 0) / 1000)
+            if random.random() < error_rate:
+                error = json.dumps({"error": {"message": "Injected error", "type": "fake_error"}}).encode("utf-8")
+                self.send_response(error_status)
+                if retry_after is not None:
+                    self.send_header("Retry-After", str(retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(error)))
+                self.end_headers()
+                self.wfile.write(error)
+                return
+            completion = fake_completion(payload, reply, len(body), cached_tokens, confidence)
+            if payload.get("stream"):
+                self.send_stream(completion)
+                return
+            data = json.dumps(completion).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_stream(self, completion: dict, piece: int = 16):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            content = completion["choices"][0]["message"]["content"]
+            base = {"id": completion["id"], "object": "chat.completion.chunk", "model": completion["model"]}
+            chunks = [
+                dict(base, choices=[{"index": 0, "delta": {"content": content[start:start + piece]}, "finish_reason": None}])
+                for start in range(0, len(content), piece)
+            ]
+            chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            chunks.append(dict(base, choices=[], usage=completion["usage"]))
+            for chunk in chunks:
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.write_chunk(b"")
+
+        def write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeOpenAIHandler
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8765, latency: float = 0.0, reply: str = "- Project title: Fake",
+                error_rate: float = 0.0, error_status: int = 429, retry_after: float = None, token_latency: float = 0.0,
+                prompt_cache: bool = False, confidence: float = 0.9):
+    return ThreadingHTTPServer(
+        (host, port),
+        make_handler(latency, reply, error_rate, error_status, retry_after, token_latency, prompt_cache, confidence)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before every reply.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Extra seconds per 1000 prompt tokens.")
+    parser.add_argument("--prompt-cache", action="store_true", help="Report repeated long system prompts as cached tokens.")
+    parser.add_argument("--confidence", type=float, default=0.9, help="Confidence reported in structured replies.")
+    parser.add_argument("--reply", default="- Project title: Fake", help="Content of every non-JSON reply.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with an error.")
+    parser.add_argument("--error-status", type=int, default=429, help="Status code of the injected errors.")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with injected errors.")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.latency, args.reply, args.error_rate, args.error_status, args.retry_after,
+                         args.token_latency, args.prompt_cache, args.confidence)
+    print(f"Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Recompress the page images of existing upload folders into the configured page image format.
+
+Usage:
+    python -m app.utils.recompress_images uploads --format webp --quality 85
+    python -m app.utils.recompress_images uploads --compare
+
+With --compare nothing is changed, every page format is tried on the found
+images instead and disk use, write time and read-back time are reported.
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from PIL import Image
+from ..services.image_service import (
+    PAGE_IMAGE_FORMATS, PAGE_IMAGE_EXTENSIONS, PAGE_MANIFEST, read_page_manifest, page_image_settings, save_page_image
+)
+from ..services.render_cache import RENDER_CACHE_DIR
+
+
+def find_image_folders(root: str) -> list:
+    """
+    Return the folders below root that contain page images, skipping the render cache.
+    """
+    folders = []
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if os.path.join(folder, d) != RENDER_CACHE_DIR and not d.startswith(".")]
+        if any(file.lower().endswith(PAGE_IMAGE_EXTENSIONS) for file in files):
+            folders.append(folder)
+    return sorted(folders)
+
+
+def _image_files(folder: str) -> list:
+    return sorted(os.path.join(folder, file) for file in os.listdir(folder) if file.lower().endswith(PAGE_IMAGE_EXTENSIONS))
+
+
+def _new_stats() -> dict:
+    return {"files": 0, "bytes_before": 0, "bytes_after": 0, "write_seconds": 0.0, "read_seconds": 0.0}
+
+
+def _write_and_read_back(img, settings: dict, path: str, stats: dict):
+    dpi = img.info.get("dpi")
+    start_time = time.time()
+    img_data = save_page_image(img, settings, round(dpi[0]) if dpi else None)
+    with open(path, "wb") as f:
+        f.write(img_data)
+    stats["write_seconds"] += time.time() - start_time
+
+    start_time = time.time()
+    with Image.open(path) as reread:
+        reread.load()
+    stats["read_seconds"] += time.time() - start_time
+    stats["bytes_after"] += len(img_data)
+
+
+def recompress_folder(folder: str, settings: dict, force: bool = False, dry_run: bool = False) -> dict:
+    """
+    Recompress the page images of one folder and update its page manifest.
+
+    Images already stored in the target format are left alone unless force is
+    set, so lossy pages are not re-encoded again on every run.
+    """
+    ext = PAGE_IMAGE_FORMATS[settings["format"]]["ext"]
+    manifest = read_page_manifest(folder)
+    stats = _new_stats()
+    for path in _image_files(folder):
+        if path.lower().endswith(ext) and not force:
+            continue
+        new_path = os.path.splitext(path)[0] + ext
+        stats["files"] += 1
+        stats["bytes_before"] += os.path.getsize(path)
+        if dry_run:
+            continue
+        with Image.open(path) as img:
+            img.load()
+            tmp_path = f"{new_path}.{os.getpid()}.tmp"
+            _write_and_read_back(img, settings, tmp_path, stats)
+        os.replace(tmp_path, new_path)
+        if new_path != path:
+            os.remove(path)
+
+        page_info = manifest.pop(os.path.basename(path), None)
+        if page_info is not None:
+            page_info["format"] = settings["format"]
+            page_info["mime"] = PAGE_IMAGE_FORMATS[settings["format"]]["mime"]
+            manifest[os.path.basename(new_path)] = page_info
+
+    if stats["files"] and not dry_run and os.path.exists(os.path.join(folder, PAGE_MANIFEST)):
+        # triage.json and dedup.json are rebuilt on the next run because their fingerprint changes
+        tmp_path = os.path.join(folder, f"{PAGE_MANIFEST}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(folder, PAGE_MANIFEST))
+    return stats
+
+
+def compare_formats(folders: list, quality: int, grayscale: bool) -> dict:
+    """
+    Encode every image of the folders in each page format and return the per-format stats.
+    """
+    results = {}
+    tmp_dir = tempfile.mkdtemp(prefix="page-formats-")
+    try:
+        for image_format, format_info in PAGE_IMAGE_FORMATS.items():
+            settings = page_image_settings(image_format, quality, grayscale)
+            stats = _new_stats()
+            for folder in folders:
+                for path in _image_files(folder):
+                    stats["files"] += 1
+                    stats["bytes_before"] += os.path.getsize(path)
+                    with Image.open(path) as img:
+                        img.load()
+                        out_path = os.path.join(tmp_dir, f"{stats['files']}{format_info['ext']}")
+                        _write_and_read_back(img, settings, out_path, stats)
+                    os.remove(out_path)
+            results[image_format] = stats
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def print_stats(name: str, stats: dict):
+    ratio = stats["bytes_after"] / stats["bytes_before"] if stats["bytes_before"] else 0.0
+    print(
+        f"{name}: {stats['files']} files, "
+        f"{stats['bytes_before'] / 1024 / 1024:.1f} MiB -> {stats['bytes_after'] / 1024 / 1024:.1f} MiB ({ratio:.0%}), "
+        f"write {stats['write_seconds']:.2f}s, read-back {stats['read_seconds']:.2f}s"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompress page images of existing upload folders.")
+    parser.add_argument("root", nargs="?", default=os.path.join(os.getcwd(), "uploads"), help="Upload folder to scan.")
+    parser.add_argument("--format", choices=list(PAGE_IMAGE_FORMATS), help="Target format (default: PAGE_IMAGE_FORMAT).")
+    parser.add_argument("--quality", type=int, help="Lossy quality (default: PAGE_IMAGE_QUALITY).")
+    parser.add_argument("--grayscale", action="store_true", default=None, help="Store pages in grayscale.")
+    parser.add_argument("--force", action="store_true", help="Also re-encode images already in the target format.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be recompressed.")
+    parser.add_argument("--compare", action="store_true", help="Report size and timings of every format, change nothing.")
+    args = parser.parse_args(argv)
+
+    settings = page_image_settings(args.format, args.quality, args.grayscale)
+    folders = find_image_folders(args.root)
+    print(f"Found {len(folders)} image folders under {args.root}")
+
+    if args.compare:
+        for image_format, stats in compare_formats(folders, settings["quality"], settings["grayscale"]).items():
+            print_stats(image_format, stats)
+        return
+
+    total = _new_stats()
+    for folder in folders:
+        stats = recompress_folder(folder, settings, force=args.force, dry_run=args.dry_run)
+        for key in total:
+            total[key] += stats[key]
+        if stats["files"]:
+            print_stats(os.path.relpath(folder, args.root), stats)
+    print_stats(f"total ({settings['format']})", total)
+
+
+if __name__ == "__main__":
+    main()